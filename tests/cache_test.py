@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+
+from vox_harbor.common.cache import MemoryCache, QueryCache, make_key
+from vox_harbor.common.exceptions import NotFoundError
+
+
+class Timer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_single_flight_and_ttl() -> None:
+    timer = Timer()
+    cache = QueryCache('test', MemoryCache(maxsize=10, ttl=60, timer=timer))
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return calls
+
+    async def main():
+        assert await asyncio.gather(*(cache.get_or_fetch('key', fetch) for _ in range(5))) == [1] * 5
+        assert await cache.get_or_fetch('key', fetch) == 1
+
+        timer.now = 61
+        assert await cache.get_or_fetch('key', fetch) == 2
+
+    asyncio.run(main())
+    assert (cache.stats.misses, cache.stats.coalesced, cache.stats.hits) == (2, 4, 1)
+
+
+def test_errors_are_not_cached() -> None:
+    cache = QueryCache('test', MemoryCache(maxsize=10, ttl=60))
+
+    async def not_found():
+        await asyncio.sleep(0.01)
+        raise NotFoundError('user')
+
+    async def main():
+        results = await asyncio.gather(*(cache.get_or_fetch('key', not_found) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(r, NotFoundError) for r in results)
+
+        with pytest.raises(NotFoundError):
+            await cache.get_or_fetch('key', not_found)
+
+    asyncio.run(main())
+    assert cache.stats.size == 0 and cache.stats.misses == 2
+
+
+def test_lru_bound() -> None:
+    cache = MemoryCache(maxsize=2, ttl=60)
+
+    async def main():
+        for key in 'abc':
+            await cache.set(key, key)
+        assert len(cache) == 2
+
+    asyncio.run(main())
+
+
+def test_make_key() -> None:
+    assert make_key('User', 'q', dict(user_ids=[1, 2], b=1)) == make_key('User', 'q', dict(b=1, user_ids=[1, 2]))
+    hash(make_key(dict(user_ids=[1, [2, 3]])))
+
+
+def test_cancelled_fetch_is_retried_by_waiters() -> None:
+    cache = QueryCache('test', MemoryCache(maxsize=10, ttl=60))
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return calls
+
+    async def main():
+        leader = asyncio.create_task(cache.get_or_fetch('key', fetch))
+        await asyncio.sleep(0)
+        waiters = [asyncio.create_task(cache.get_or_fetch('key', fetch)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+
+        leader.cancel()
+        assert await asyncio.gather(*waiters) == [2] * 3
+        assert leader.cancelled()
+
+    asyncio.run(main())
+    assert calls == 2 and cache.stats.size == 1
+
+
+def test_cancelled_waiter_does_not_cancel_fetch() -> None:
+    cache = QueryCache('test', MemoryCache(maxsize=10, ttl=60))
+
+    async def fetch():
+        await asyncio.sleep(0.05)
+        return 'value'
+
+    async def main():
+        leader = asyncio.create_task(cache.get_or_fetch('key', fetch))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.get_or_fetch('key', fetch))
+        await asyncio.sleep(0.01)
+
+        waiter.cancel()
+        assert await leader == 'value'
+        assert waiter.cancelled()
+
+    asyncio.run(main())
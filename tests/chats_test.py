@@ -0,0 +1,108 @@
+import asyncio
+import contextlib
+import datetime
+import time
+import types
+
+import pytest
+
+from vox_harbor.big_bot import chats
+from vox_harbor.big_bot.chats import ChatsManager
+from vox_harbor.big_bot.structures import Chat
+from vox_harbor.common.config import config
+
+from tests.utils import local_timezone  # type: ignore
+
+
+def _chat(chat_id: int, added: int, bot_index: int = 0) -> Chat:
+    return Chat(
+        id=chat_id,
+        name=f'chat {chat_id}',
+        join_string='',
+        shard=config.SHARD_NUM,
+        bot_index=bot_index,
+        added=datetime.datetime.fromtimestamp(added),
+        type=Chat.Type.CHAT,
+    )
+
+
+def test_merge_returns_only_changed_chats() -> None:
+    manager = ChatsManager(bot_manager=None)  # type: ignore
+
+    assert manager._merge([_chat(1, 100), _chat(2, 100)]) == [_chat(1, 100), _chat(2, 100)]
+    assert manager._merge([_chat(1, 100), _chat(2, 200, bot_index=1)]) == [_chat(2, 200, bot_index=1)]
+
+    # a stale replica of a row must not overwrite a newer one
+    assert manager._merge([_chat(2, 150)]) == []
+    assert manager.known_chats[2] == _chat(2, 200, bot_index=1)
+
+
+def test_plan_joins_and_leaves() -> None:
+    manager = ChatsManager(bot_manager=None)  # type: ignore
+    mine = _chat(1, 100, bot_index=1).model_copy(update=dict(join_string='@mine'))
+    other_shard = _chat(2, 100).model_copy(update=dict(shard=config.SHARD_NUM + 1, join_string='@other'))
+    private = _chat(3, 100, bot_index=1).model_copy(update=dict(type=Chat.Type.PRIVATE))
+
+    plan = manager._plan([mine, other_shard, private], [{1, 3}, {2}])
+
+    assert plan == [
+        (0, ChatsManager.Action.LEAVE, mine),
+        (1, ChatsManager.Action.JOIN, mine),
+        (1, ChatsManager.Action.LEAVE, other_shard),
+    ]
+
+
+class FakeSession:
+    def __init__(self):
+        self.rows: list[dict] = []
+
+    def set_settings(self, settings: dict):
+        pass
+
+    async def execute(self, query: str, rows: list[dict]):
+        self.rows.extend(rows)
+
+
+class FakeBot:
+    async def get_chat(self, chat_id: int):
+        return types.SimpleNamespace(
+            id=chat_id, title='chat', username='chat', invite_link=None, type=chats.enums.ChatType.SUPERGROUP
+        )
+
+    async def generate_history_task(self, *args, **kwargs):
+        pass
+
+
+@pytest.mark.usefixtures('local_timezone')
+def test_registered_chat_is_in_delta_window(monkeypatch) -> None:
+    session = FakeSession()
+
+    @contextlib.asynccontextmanager
+    async def session_scope():
+        yield session
+
+    queries: list[dict] = []
+
+    async def db_fetchall(model, query, args=None, **kwargs):
+        queries.append(args)
+        # `WHERE added >= now() - INTERVAL %(since)s SECOND`, with the server clock in UTC
+        return [Chat(**row) for row in session.rows if row['added'].timestamp() >= time.time() - args['since']]
+
+    monkeypatch.setattr(chats, 'session_scope', session_scope)
+    monkeypatch.setattr(chats, 'db_fetchall', db_fetchall)
+
+    manager = ChatsManager(bot_manager=[FakeBot()])  # type: ignore
+    manager.last_full_update = manager.last_updated = time.monotonic()
+    manager.known_chats = {}
+
+    async def reconcile(changed: list[Chat]):
+        assert [chat.id for chat in changed] == [-100]
+
+    monkeypatch.setattr(manager, '_reconcile', reconcile)
+
+    asyncio.run(manager.register_new_chat(0, -100))
+    manager.known_chats = {}  # as if it was registered by another shard
+    asyncio.run(manager.update())
+
+    assert queries == [dict(since=ChatsManager.DELTA_OVERLAP)]
+    assert manager.known_chats[-100].name == 'chat (chat)'
@@ -0,0 +1,19 @@
+from vox_harbor.common.db_utils import ColumnarBlock
+
+
+def test_columnar_block() -> None:
+    block = ColumnarBlock('posts', ('id', 'data.key', 'data.value'))
+    assert not block
+
+    block.append(1, ['@views'], [10])
+    block.append(2, ['@views', '👍'], [20, 1])
+
+    assert len(block) == 2
+    assert block.nbytes == 8 + 6 + 8 + 8 + 6 + 1 + 8 + 8
+    assert block.query == 'INSERT INTO posts (`id`, `data.key`, `data.value`) VALUES'
+    assert block.data == [[1, 2], [['@views'], ['@views', '👍']], [[10], [20, 1]]]
+
+    taken = block.take()
+    assert len(taken) == 2 and not block
+    assert taken.nbytes > 0 and block.nbytes == 0
+    assert taken.columns == block.columns
@@ -0,0 +1,139 @@
+import asyncio
+import contextlib
+
+from vox_harbor.big_bot import coverage as coverage_module
+from vox_harbor.big_bot import handlers, structures
+from vox_harbor.big_bot.coverage import MAX_MESSAGE_ID, CoverageIndex, IntervalSet, missing_history
+from vox_harbor.big_bot.tasks import HistoryTask
+from vox_harbor.common.config import config
+from vox_harbor.common.db_utils import ColumnarBlock
+
+
+def test_interval_set_merges() -> None:
+    intervals = IntervalSet([(10, 20), (30, 40), (50, 60)])
+    assert list(intervals) == [(10, 20), (30, 40), (50, 60)]
+
+    intervals.add(21, 29)  # adjacent on both sides
+    intervals.add(45, 55)
+    assert list(intervals) == [(10, 40), (45, 60)]
+
+    intervals.add(1, 100)
+    assert list(intervals) == [(1, 100)]
+    assert 1 in intervals and 100 in intervals and 101 not in intervals
+
+
+def test_interval_set_gaps() -> None:
+    intervals = IntervalSet([(10, 20), (30, 40)])
+
+    assert intervals.gaps(1, 50) == [(1, 9), (21, 29), (41, 50)]
+    assert intervals.gaps(15, 35) == [(21, 29)]
+    assert intervals.gaps(12, 18) == []
+    assert IntervalSet().gaps(1, 5) == [(1, 5)]
+
+
+def test_missing_history() -> None:
+    assert missing_history(IntervalSet()) == [(0, 0)]
+
+    covered = IntervalSet([(2000, 3000), (3002, 4000), (5000, 6000)])
+    assert missing_history(covered) == [(0, 6000), (5000, 4000), (2000, 0)]
+    assert missing_history(covered, with_latest=False, min_backfill_id=5000) == [(5000, 4000)]
+
+    # a resumed task still crawling down from the newest message
+    covered.add(6001, MAX_MESSAGE_ID)
+    assert missing_history(covered) == [(5000, 4000), (2000, 0)]
+
+
+def test_interval_set_remove() -> None:
+    intervals = IntervalSet([(10, 20), (30, 40)])
+
+    intervals.remove(15, 15)
+    assert list(intervals) == [(10, 14), (16, 20), (30, 40)]
+
+    intervals.remove(12, 35)
+    assert list(intervals) == [(10, 11), (36, 40)]
+
+    intervals.remove(1, 5)
+    intervals.remove(10, 11)
+    assert list(intervals) == [(36, 40)]
+
+
+def test_live_coverage() -> None:
+    index = CoverageIndex()
+    for message_id in (100, 101, 105, 103, 102):
+        index.record_live(1, message_id)
+
+    # missed updates stay uncovered
+    assert list(index.get(1)) == [(100, 103), (105, 105)]
+    assert list(index.get(2)) == []
+
+    index.forget(1, 102)
+    assert list(index.get(1)) == [(100, 100), (105, 105)]
+
+
+def test_coverage_is_saved_per_chat(monkeypatch) -> None:
+    inserted: list[ColumnarBlock] = []
+
+    class FakeSession:
+        def set_settings(self, settings):
+            pass
+
+        async def insert_block(self, block):
+            inserted.append(block)
+
+    @contextlib.asynccontextmanager
+    async def session_scope():
+        yield FakeSession()
+
+    async def db_fetchall(model, query, query_args=None, name=None, *, raise_not_found=True, cache=None):
+        if model is structures.HistoryCoverage:
+            return [structures.HistoryCoverage(chat_id=1, lo=[1, 10], hi=[5, 20], shard=0)]
+        if model is structures.CommentRange:
+            # other shards' chats are seeded by their own shards
+            assert 'FROM chats FINAL WHERE shard = %(shard)s' in query and query_args == dict(shard=config.SHARD_NUM)
+            return [structures.CommentRange(chat_id=c, min_message_id=1, max_message_id=500) for c in (1, 2)]
+
+        assert query_args['chat_ids'] == [2]  # only chats without coverage are seeded
+        return [structures.CoverageRange(chat_id=2, lo=1, hi=200), structures.CoverageRange(chat_id=2, lo=400, hi=500)]
+
+    monkeypatch.setattr(coverage_module, 'session_scope', session_scope)
+    monkeypatch.setattr(coverage_module, 'db_fetchall', db_fetchall)
+
+    index = CoverageIndex()
+    asyncio.run(index.load())
+    assert list(index.get(1)) == [(1, 5), (10, 20)]
+    assert list(index.get(2)) == [(1, 200), (400, 500)]
+
+    index.record(1, 6, 9)
+    for _ in range(3):
+        index.record_live(1, 21)
+    asyncio.run(index.save())
+    asyncio.run(index.save())  # nothing changed
+
+    assert len(inserted) == 1
+    rows = {chat_id: (lo, hi) for chat_id, lo, hi, _ in zip(*inserted[0].data)}
+    assert rows == {1: ([1], [21]), 2: ([1, 400], [200, 500])}
+
+
+def test_lost_comments_are_uncovered(monkeypatch) -> None:
+    index = CoverageIndex()
+    index.record(-100, 1, 10)
+    monkeypatch.setattr(handlers, 'coverage', index)
+
+    async def failing_insert(block):
+        raise ConnectionError('clickhouse is down')
+
+    inserter = handlers.BlockInserter()
+    monkeypatch.setattr(inserter, '_insert_block', failing_insert)
+    for message_id in (3, 4, 8):
+        inserter.comments.append(1, None, -100, message_id, None, None, 0, 0)
+
+    asyncio.run(inserter.flush())
+    assert list(index.get(-100)) == [(1, 1), (6, 6), (10, 10)]
+
+
+def test_lost_comment_is_crawled_again() -> None:
+    index = CoverageIndex()
+    index.record(-100, 1, 1000)
+    index.forget(-100, 500)
+
+    assert missing_history(index.get(-100), with_latest=False, min_gap=HistoryTask.DELTA) == [(502, 498)]
@@ -0,0 +1,48 @@
+import asyncio
+import datetime
+import re
+
+import pytest
+
+from vox_harbor.big_bot.structures import Comment
+from vox_harbor.services import controller
+from vox_harbor.services.utils import decode_comments_cursor, encode_comments_cursor
+
+from tests.utils import local_timezone  # type: ignore
+
+
+def make_comment(date: datetime.datetime) -> Comment:
+    return Comment(user_id=1, date=date, chat_id=-100, message_id=42, channel_id=None, post_id=None, bot_index=0, shard=0)
+
+
+@pytest.mark.usefixtures('local_timezone')
+def test_cursor_dates_are_utc() -> None:
+    naive = datetime.datetime(2023, 10, 1, 12, 0)
+    expected = int(naive.replace(tzinfo=datetime.timezone.utc).timestamp())
+
+    assert decode_comments_cursor(encode_comments_cursor(make_comment(naive))) == (expected, -100, 42)
+
+    aware = naive.replace(tzinfo=datetime.timezone(datetime.timedelta(hours=3)))
+    assert decode_comments_cursor(encode_comments_cursor(make_comment(aware)))[0] == expected - 3 * 60 * 60
+
+
+def test_invalid_cursor() -> None:
+    with pytest.raises(ValueError):
+        decode_comments_cursor('not a cursor')
+
+
+def test_comments_pages_share_order(monkeypatch) -> None:
+    queries: list[tuple[str, dict]] = []
+
+    async def db_fetchall(model, query, args, *a, **kw):
+        queries.append((query, args))
+        return []
+
+    monkeypatch.setattr(controller, 'db_fetchall', db_fetchall)
+    for offset in range(3):
+        asyncio.run(controller.get_comments(1, offset=offset, fetch=10))
+    asyncio.run(controller.get_comments_page(1, fetch=10))
+
+    orders = {re.search(r'ORDER BY ([\w, ]+?)(?: OFFSET|\n)', query).group(1) for query, _ in queries}
+    assert orders == {'date, chat_id, message_id'}
+    assert [args['offset'] for _, args in queries[1:3]] == [10, 20]
@@ -0,0 +1,146 @@
+import asyncio
+import contextlib
+import datetime
+import json
+
+import pytest
+
+from vox_harbor.big_bot.structures import Comment, Message
+from vox_harbor.common import db_utils
+from vox_harbor.services import controller
+
+
+class FakeProtoConnection:
+    def __init__(self):
+        self.connected = True
+        self.unread = 0
+
+    async def disconnect(self):
+        self.connected = False
+        self.unread = 0
+
+
+class FakeCursor(db_utils.DictCursor):
+    """Serves `rows` in streamed batches, rows not fetched yet stay unread on the connection."""
+
+    def __init__(self, connection, rows: list[dict]):
+        super().__init__(connection)
+        self._fake_rows = rows
+
+    async def execute(self, query, *args, **kwargs):
+        self._connection._connection.unread = len(self._fake_rows)
+
+    async def fetchmany(self, size: int):
+        proto = self._connection._connection
+        offset = len(self._fake_rows) - proto.unread
+        if not proto.unread:
+            raise AttributeError('no more rows')
+
+        batch = self._fake_rows[offset : offset + size]
+        proto.unread -= len(batch)
+        return batch
+
+
+class FakeConnection:
+    def __init__(self, rows: list[dict]):
+        self._connection = FakeProtoConnection()
+        self.rows = rows
+
+    @contextlib.asynccontextmanager
+    async def cursor(self, cursor_type):
+        yield FakeCursor(self, self.rows)
+
+
+class FakePool:
+    def __init__(self, rows: list[dict]):
+        self.connection = FakeConnection(rows)
+        self.released = 0
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        try:
+            yield self.connection
+        finally:
+            self.released += 1
+
+    @property
+    def dirty(self) -> bool:
+        proto = self.connection._connection
+        return proto.connected and proto.unread > 0
+
+
+def make_row(message_id: int) -> dict:
+    return dict(
+        user_id=1,
+        date=datetime.datetime(2023, 10, 1, 12, 0, message_id),
+        chat_id=-100,
+        message_id=message_id,
+        channel_id=None,
+        post_id=None,
+        bot_index=0,
+        shard=0,
+    )
+
+
+@pytest.fixture
+def fake_pool(monkeypatch) -> FakePool:
+    pool = FakePool([make_row(i) for i in range(5)])
+    monkeypatch.setattr(db_utils, 'pool', pool)
+    return pool
+
+
+def test_db_iterate(fake_pool: FakePool) -> None:
+    async def read_all() -> list[list[Comment]]:
+        return [batch async for batch in db_utils.db_iterate(Comment, 'SELECT', batch_size=2)]
+
+    assert [[c.message_id for c in batch] for batch in asyncio.run(read_all())] == [[0, 1], [2, 3], [4]]
+    assert fake_pool.released == 1 and fake_pool.connection._connection.connected
+
+    async def read_first() -> list[Comment]:
+        async with contextlib.aclosing(db_utils.db_iterate(Comment, 'SELECT', batch_size=2)) as batches:
+            async for batch in batches:
+                return batch
+
+    assert [c.message_id for c in asyncio.run(read_first())] == [0, 1]
+    assert fake_pool.released == 2 and not fake_pool.dirty
+
+
+def read_export(response) -> list[dict]:
+    async def read() -> bytes:
+        return b''.join([chunk async for chunk in response.body_iterator])
+
+    return [json.loads(line) for line in asyncio.run(read()).splitlines()]
+
+
+@pytest.mark.usefixtures('fake_pool')
+def test_export_keeps_comments_without_text(monkeypatch) -> None:
+    async def get_messages(comments: list[Comment]) -> list[Message]:
+        return [Message(text=f'text {c.message_id}', comment=c) for c in comments if c.message_id % 2]
+
+    monkeypatch.setattr(controller, '_get_messages', get_messages)
+
+    lines = read_export(asyncio.run(controller.export_comments(user_id=1, with_text=True)))
+    assert [(line['comment']['message_id'], line['text']) for line in lines[:-1]] == [
+        (0, None),
+        (1, 'text 1'),
+        (2, None),
+        (3, 'text 3'),
+        (4, None),
+    ]
+    assert lines[-1] == dict(rows=5, error=None)
+
+
+@pytest.mark.usefixtures('fake_pool')
+def test_export_reports_errors(monkeypatch) -> None:
+    monkeypatch.setattr(controller, 'EXPORT_BATCH_SIZE', 2)
+
+    async def get_messages(comments: list[Comment]) -> list[Message]:
+        if comments[0].message_id >= 2:
+            raise ConnectionError('shard is down')
+        return [Message(text='text', comment=c) for c in comments]
+
+    monkeypatch.setattr(controller, '_get_messages', get_messages)
+
+    lines = read_export(asyncio.run(controller.export_comments(chat_id=-100, with_text=True)))
+    assert [line['comment']['message_id'] for line in lines[:-1]] == [0, 1]
+    assert lines[-1]['rows'] == 2 and 'shard is down' in lines[-1]['error']
@@ -0,0 +1,88 @@
+"""
+Ingest-path benchmark for `BlockInserter`: per-row pydantic dicts vs. columnar blocks.
+Does not touch ClickHouse, only measures buffering cost.
+
+    python -m tests.inserter_bench [rows]
+"""
+import asyncio
+import datetime
+import sys
+import time
+from types import SimpleNamespace
+
+from vox_harbor.big_bot import structures
+from vox_harbor.big_bot.handlers import BlockInserter
+from vox_harbor.common.config import config
+
+
+class LegacyBlockInserter:
+    """The previous ingest path: one validated model per row, dumped to a dict."""
+
+    def __init__(self):
+        self.comments = []
+        self.users = []
+        self.lock = asyncio.Lock()
+
+    async def insert(self, message, bot_index: int, channel_id: int | None, post_id: int | None):
+        async with self.lock:
+            self.comments.append(
+                structures.Comment(
+                    user_id=message.from_user.id,
+                    date=message.date.astimezone(datetime.timezone.utc),
+                    chat_id=message.chat.id,
+                    message_id=message.id,
+                    channel_id=channel_id,
+                    post_id=post_id,
+                    bot_index=bot_index,
+                    shard=config.SHARD_NUM,
+                ).model_dump()
+            )
+
+            name = ' '.join(filter(None, (message.from_user.first_name, message.from_user.last_name)))
+            self.users.append(
+                structures.User(
+                    user_id=message.from_user.id,
+                    username=message.from_user.username or '',
+                    name=name,
+                ).model_dump()
+            )
+
+
+def make_messages(count: int) -> list[SimpleNamespace]:
+    now = datetime.datetime.now()
+    chat = SimpleNamespace(id=-1001234567890)
+
+    return [
+        SimpleNamespace(
+            id=i,
+            date=now,
+            chat=chat,
+            from_user=SimpleNamespace(id=100_000 + i % 5000, username=f'user_{i % 5000}', first_name='Ivan', last_name=None),
+        )
+        for i in range(count)
+    ]
+
+
+async def measure(inserter, messages: list[SimpleNamespace]) -> float:
+    started = time.perf_counter()
+    for message in messages:
+        await inserter.insert(message, 0, -1001234567891, message.id // 100)
+
+    return len(messages) / (time.perf_counter() - started)
+
+
+async def main(rows: int = 200_000) -> None:
+    messages = make_messages(rows)
+
+    legacy = await measure(LegacyBlockInserter(), messages)
+    inserter = BlockInserter()
+    inserter.MAX_BLOCK_SIZE = rows + 1  # no flush loop here, disable backpressure
+    columnar = await measure(inserter, messages)
+
+    print(f'rows:     {rows}')
+    print(f'legacy:   {legacy:,.0f} rows/sec')
+    print(f'columnar: {columnar:,.0f} rows/sec ({columnar / legacy:.1f}x)')
+
+
+if __name__ == '__main__':
+    asyncio.run(main(*map(int, sys.argv[1:])))
@@ -0,0 +1,73 @@
+import asyncio
+import logging
+
+import pytest
+
+from vox_harbor.common.db_utils import ColumnarBlock
+from vox_harbor.common.logging_utils import ClickHouseHandler
+
+
+def make_record(name: str, level: int = logging.INFO, msg: str = 'message') -> logging.LogRecord:
+    return logging.LogRecord(name, level, __file__, 1, msg, (), None)
+
+
+class FakeHandler(ClickHouseHandler):
+    MAX_BATCH = 3
+    MAX_RETRY_ROWS = 5
+    BURST = 5
+    RATE = 0
+
+    def __init__(self, max_size: int = 10):
+        super().__init__(max_size)
+        self.down = False
+        self.inserted: list[ColumnarBlock] = []
+
+    async def _insert(self, block: ColumnarBlock):
+        if self.down:
+            raise ConnectionError('clickhouse is down')
+        self.inserted.append(block)
+
+
+def test_rate_limit_and_queue_bound() -> None:
+    handler = FakeHandler()
+
+    for _ in range(7):
+        handler.emit(make_record('noisy'))
+    handler.emit(make_record('noisy', logging.ERROR))
+    handler.emit(make_record('quiet'))
+    assert handler.rate_limited == {'noisy': 2}
+
+    for _ in range(5):
+        handler.emit(make_record('other', logging.WARNING))
+    assert handler.dropped == {'queue_full': 2}
+    assert handler.pending == 10
+
+
+def test_batches_and_retry() -> None:
+    handler = FakeHandler()
+    for i in range(5):
+        handler.emit(make_record('test', logging.WARNING, f'message {i}'))
+
+    asyncio.run(handler.batch_flush())
+    assert [len(block) for block in handler.inserted] == [3, 2]
+    assert handler.inserted[0].columns[5] == 'message'
+    assert handler.inserted[1].data[5] == ['message 3', 'message 4']
+    assert handler.shipped == 5 and handler.pending == 0
+
+    handler.down = True
+    for i in range(8):
+        handler.emit(make_record('test', logging.WARNING, f'message {i}'))
+
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            asyncio.run(handler.batch_flush())
+
+    # the oldest failed block does not fit into the retry buffer
+    assert handler.dropped == {'insert_failed': 3}
+    assert handler.pending == 5
+
+    handler.down = False
+    asyncio.run(handler.batch_flush())
+    assert handler.shipped == 10 and handler.pending == 0
+    assert handler.inserted[-2].data[5] == ['message 3', 'message 4', 'message 5']
+    assert handler.inserted[-1].data[5] == ['message 6', 'message 7']
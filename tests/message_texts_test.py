@@ -0,0 +1,169 @@
+import asyncio
+import datetime
+import types
+
+import pytest
+
+from vox_harbor.big_bot import handlers
+from vox_harbor.big_bot.structures import Comment, Message, MessageText
+from vox_harbor.common import message_texts
+from vox_harbor.common.message_texts import MessageTextStore
+from vox_harbor.services import controller, shard
+
+
+def make_comment(message_id: int, chat_id: int = -100, second: int | None = None, shard: int = 0) -> Comment:
+    return Comment(
+        user_id=1,
+        date=datetime.datetime(2023, 10, 1, 12, 0, message_id if second is None else second),
+        chat_id=chat_id,
+        message_id=message_id,
+        channel_id=None,
+        post_id=None,
+        bot_index=0,
+        shard=shard,
+    )
+
+
+class FakeTable:
+    """`message_texts` table behind a fake `db_fetchall`."""
+
+    def __init__(self, *texts: MessageText):
+        self.rows = {(t.chat_id, t.message_id): t for t in texts}
+        self.lookups: list[list[tuple[int, int]]] = []
+
+    async def db_fetchall(self, model, query, args, *, raise_not_found=True, **kwargs):
+        assert model is MessageText and 'FROM message_texts FINAL' in query
+        self.lookups.append(list(args['keys']))
+        return [self.rows[key] for key in args['keys'] if key in self.rows]
+
+
+class FakeBotManager:
+    def __init__(self, texts: dict[tuple[int, int], str]):
+        self.texts = texts
+        self.calls: list[tuple[int, int, list[int]]] = []
+
+    async def get_messages(self, bot_index: int, chat_id: int, message_ids: list[int]):
+        self.calls.append((bot_index, chat_id, message_ids))
+        return [
+            types.SimpleNamespace(text=text, caption=None, chat=types.SimpleNamespace(title='chat'))
+            if (text := self.texts.get((chat_id, message_id))) is not None
+            else None
+            for message_id in message_ids
+        ]
+
+
+class FakeInserter:
+    def __init__(self):
+        self.written: list[MessageText] = []
+
+    async def insert_message_texts(self, texts: list[MessageText]):
+        self.written.extend(texts)
+
+
+@pytest.fixture
+def table(monkeypatch) -> FakeTable:
+    table = FakeTable(MessageText(chat_id=-100, message_id=2, text='from table', chat='chat'))
+    monkeypatch.setattr(message_texts, 'db_fetchall', table.db_fetchall)
+    return table
+
+
+@pytest.fixture
+def bot_manager(monkeypatch) -> FakeBotManager:
+    bot_manager = FakeBotManager({(-100, 3): 'from telegram'})
+
+    async def get_instance(shard_num: int) -> FakeBotManager:
+        return bot_manager
+
+    monkeypatch.setattr(shard.BotManager, 'get_instance', get_instance)
+    return bot_manager
+
+
+@pytest.fixture
+def inserter(monkeypatch) -> FakeInserter:
+    inserter = FakeInserter()
+    monkeypatch.setattr(shard, 'inserter', inserter)
+    return inserter
+
+
+def test_store_levels(table: FakeTable) -> None:
+    store = MessageTextStore()
+    store.remember([MessageText(chat_id=-100, message_id=1, text='from memory', chat='chat')])
+
+    found = asyncio.run(store.get_many([(-100, 1), (-100, 2), (-100, 3), (-100, 1)]))
+    assert {key: t.text for key, t in found.items()} == {(-100, 1): 'from memory', (-100, 2): 'from table'}
+    assert table.lookups == [[(-100, 2), (-100, 3)]]
+    assert (store.memory_hits, store.db_hits, store.misses) == (1, 1, 1)
+
+    # the table hit is kept in memory
+    asyncio.run(store.get_many([(-100, 2)]))
+    assert len(table.lookups) == 1
+
+
+def test_store_table_failure(monkeypatch) -> None:
+    async def db_fetchall(*args, **kwargs):
+        raise ConnectionError('clickhouse is down')
+
+    monkeypatch.setattr(message_texts, 'db_fetchall', db_fetchall)
+    assert asyncio.run(MessageTextStore().get_many([(-100, 1)])) == {}
+
+
+def test_messages_fallback(monkeypatch, table: FakeTable, bot_manager: FakeBotManager, inserter: FakeInserter) -> None:
+    monkeypatch.setattr(shard, 'message_texts', MessageTextStore())
+    shard.message_texts.remember([MessageText(chat_id=-100, message_id=1, text='from memory', chat='chat')])
+
+    comments = [make_comment(message_id) for message_id in (1, 2, 3, 4)]
+    messages = asyncio.run(shard.get_messages(comments))
+
+    assert [(m.comment.message_id, m.text) for m in messages] == [
+        (1, 'from memory'),
+        (2, 'from table'),
+        (3, 'from telegram'),
+    ]
+    # only texts missing in memory and in the table go to Telegram, and what it returns is written back
+    assert bot_manager.calls == [(0, -100, [3, 4])]
+    assert [(t.message_id, t.text) for t in inserter.written] == [(3, 'from telegram')]
+
+    # the next request is served without Telegram
+    assert [m.text for m in asyncio.run(shard.get_messages(comments[2:3]))] == ['from telegram']
+    assert len(bot_manager.calls) == 1
+
+
+class FakeShardClient:
+    async def get_messages(self, sorted_comments: list[Comment]) -> list[Message]:
+        return [Message(text=f'text {c.message_id}', chat='chat', comment=c) for c in sorted_comments]
+
+
+def test_messages_order(monkeypatch) -> None:
+    monkeypatch.setattr(controller, 'shard_clients', {0: FakeShardClient(), 1: FakeShardClient()})
+    monkeypatch.setattr(controller, 'message_texts', MessageTextStore())
+    controller.message_texts.remember([MessageText(chat_id=-100, message_id=3, text='text 3', chat='chat')])
+
+    # known texts don't jump ahead of the ones served by shards
+    comments = [make_comment(5, second=0, shard=1), make_comment(4, second=0), make_comment(3, second=0)]
+    comments.append(make_comment(1, second=1))
+    comments.insert(0, make_comment(2, second=2))
+
+    messages = asyncio.run(controller._get_messages(comments))
+    assert [m.comment.message_id for m in messages] == [5, 4, 3, 1, 2]
+    assert all(m.text == f'text {m.comment.message_id}' for m in messages)
+
+
+@pytest.mark.parametrize(
+    'text, caption, stored',
+    [('text', None, 'text'), (None, 'caption', 'caption'), (None, None, None)],
+)
+def test_ingest_text(monkeypatch, text: str | None, caption: str | None, stored: str | None) -> None:
+    monkeypatch.setattr(handlers.config, 'STORE_MESSAGE_TEXTS', True)
+
+    message = types.SimpleNamespace(
+        id=1,
+        date=datetime.datetime(2023, 10, 1, 12, 0, tzinfo=datetime.timezone.utc),
+        chat=types.SimpleNamespace(id=-100, title='chat'),
+        from_user=types.SimpleNamespace(id=1, username=None, first_name='Ivan', last_name=None),
+        text=text,
+        caption=caption,
+    )
+
+    inserter = handlers.BlockInserter()
+    asyncio.run(inserter.insert(message, 0, None, None))
+    assert inserter.message_texts.data[2] == [stored]
@@ -0,0 +1,54 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from vox_harbor.common.metrics import Counter, Gauge, Histogram, instrument
+
+
+def test_render() -> None:
+    calls = Counter('calls_total', 'Calls.', ('bot', 'method'))
+    calls.inc(bot=1, method='GetHistory')
+    calls.inc(2, bot=1, method='GetHistory')
+    calls.inc(bot=2, method='say "hi"\n')
+    assert calls.render() == (
+        '# HELP calls_total Calls.\n'
+        '# TYPE calls_total counter\n'
+        'calls_total{bot="1",method="GetHistory"} 3\n'
+        'calls_total{bot="2",method="say \\"hi\\"\\n"} 1'
+    )
+
+    size = Gauge('size', 'Size.', collect=lambda: {(): 1.5})
+    assert size.render().endswith('\nsize 1.5')
+
+    latency = Histogram('latency_seconds', 'Latency.', ('name',), buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        latency.observe(value, name='users')
+    assert latency.render().split('\n')[2:] == [
+        'latency_seconds_bucket{name="users",le="0.1"} 2',
+        'latency_seconds_bucket{name="users",le="1"} 3',
+        'latency_seconds_bucket{name="users",le="+Inf"} 4',
+        'latency_seconds_sum{name="users"} 3.65',
+        'latency_seconds_count{name="users"} 4',
+    ]
+
+
+def test_instrument() -> None:
+    app = FastAPI()
+    instrument(app)
+
+    @app.get('/user/{user_id}')
+    async def get_user(user_id: int) -> int:
+        return user_id
+
+    client = TestClient(app)
+    assert client.get('/user/1').json() == 1
+    assert client.get('/user/2').status_code == 200
+    assert client.get('/missing').status_code == 404
+
+    response = client.get('/metrics')
+    assert response.headers['content-type'].startswith('text/plain; version=0.0.4')
+
+    metrics = response.text
+    assert 'vox_harbor_http_request_duration_seconds_count{method="GET",endpoint="/user/{user_id}",status="200"} 2' in (
+        metrics
+    )
+    assert 'vox_harbor_http_request_duration_seconds_count{method="GET",endpoint="unmatched",status="404"} 1' in metrics
@@ -0,0 +1,78 @@
+import asyncio
+import datetime
+import time
+
+from vox_harbor.big_bot.handlers import BlockInserter
+from vox_harbor.big_bot.posts import PostManager
+from vox_harbor.big_bot.structures import NewPost, PostPollingStats
+
+
+def _post(post_id: int, age: datetime.timedelta) -> NewPost:
+    return NewPost(id=post_id, channel_id=-100, post_date=datetime.datetime.utcnow() - age, bot_index=0, shard=0)
+
+
+def test_pop_due_and_eviction() -> None:
+    manager = PostManager(bots=None)  # type: ignore
+    now = datetime.datetime.utcnow()
+
+    fresh = _post(1, datetime.timedelta(minutes=10))  # polled every minute
+    day_old = _post(2, datetime.timedelta(days=2))  # polled every hour
+    expired = _post(3, datetime.timedelta(days=3, minutes=1))
+
+    for post in (fresh, day_old, expired):
+        manager._posts[post.channel_id, post.id] = post
+        manager._schedule_post(post, now - datetime.timedelta(minutes=5))
+
+    assert manager.pop_due(now) == [fresh]
+    assert manager.pop_due(now + datetime.timedelta(hours=1)) == [day_old]
+
+    assert list(manager._posts) == [(-100, 1), (-100, 2)]
+    assert manager._schedule == []
+
+
+def test_due_posts_are_batched_per_channel() -> None:
+    class FakeBot:
+        index = 0
+
+        def __init__(self):
+            self.calls: list[tuple[int, list[int]]] = []
+
+        async def get_subscribed_chats(self):
+            return {-100, -200}
+
+        async def get_messages(self, chat_id: int, message_ids: list[int]):
+            self.calls.append((chat_id, message_ids))
+            return [None] * len(message_ids)
+
+    bot = FakeBot()
+    manager = PostManager(bots=[bot])  # type: ignore
+    manager.BATCH_SIZE = 2
+    manager._last_discovered = time.monotonic()
+
+    past = datetime.datetime.utcnow() - datetime.timedelta(minutes=5)
+    for channel_id, post_id in ((-100, 1), (-200, 1), (-100, 2), (-100, 3)):
+        post = _post(post_id, datetime.timedelta(minutes=10)).model_copy(update=dict(channel_id=channel_id))
+        manager._posts[channel_id, post_id] = post
+        manager._schedule_post(post, past)
+
+    asyncio.run(manager.run_once())
+
+    assert sorted(bot.calls) == [(-200, [1]), (-100, [1, 2]), (-100, [3])]
+    assert manager.stats() == PostPollingStats(tracked=4, calls=3, polled_posts=4, posts_per_call=4 / 3)
+    assert len(manager._schedule) == 4
+
+
+def test_unchanged_post_snapshots_are_skipped() -> None:
+    inserter = BlockInserter()
+    inserter.KEYFRAME_EVERY = 3
+
+    assert inserter._post_changed(-100, 1, {'@views': 1000, '👍': 5})
+    assert not inserter._post_changed(-100, 1, {'@views': 1005, '👍': 5})  # within the views threshold
+    assert inserter._post_changed(-100, 1, {'@views': 1005, '👍': 6})
+    assert not inserter._post_changed(-100, 1, {'@views': 1010, '👍': 6})
+    assert not inserter._post_changed(-100, 1, {'@views': 1010, '👍': 6})
+    assert inserter._post_changed(-100, 1, {'@views': 1010, '👍': 6})  # keyframe
+    assert inserter._post_changed(-100, 1, {'@views': 1010, '👍': 6, '🔥': 1})  # new reaction
+    assert inserter._post_changed(-100, 2, {'@views': 1010})
+
+    assert inserter.skipped_post_snapshots == 3
@@ -0,0 +1,114 @@
+import asyncio
+import datetime
+import re
+
+import pytest
+
+from vox_harbor.big_bot.structures import Post
+from vox_harbor.common import db_utils
+from vox_harbor.common.exceptions import BadRequestError
+from vox_harbor.services.controller import _reactions_query
+
+POST_FILTER = 'id = %(id)s AND channel_id = %(channel_id)s'
+DEFAULTS = dict(resolution=None, points=None, from_=None, to=None, keys=None, deltas=False)
+
+# snapshots of post 1 at 10:00, 10:30 and 11:15, and a post the filter leaves out
+SNAPSHOTS = """(
+    SELECT * FROM values(
+        'id Int64, channel_id Int64, post_date DateTime, point_date DateTime,
+         `data.key` Array(String), `data.value` Array(Int64), bot_index UInt8, shard UInt8',
+        (1, -100, '2023-10-01 09:00:00', '2023-10-01 10:00:00', ['@views', '👍'], [100, 1], 0, 0),
+        (1, -100, '2023-10-01 09:00:00', '2023-10-01 10:30:00', ['@views', '👍'], [120, 2], 0, 0),
+        (1, -100, '2023-10-01 09:00:00', '2023-10-01 11:15:00', ['@views', '👍'], [150, 3], 1, 0),
+        (2, -100, '2023-10-01 09:00:00', '2023-10-01 11:00:00', ['@views'], [1000], 1, 0)
+    )
+)"""
+
+
+def reactions_query(**params) -> tuple[str, dict]:
+    query, args = _reactions_query(POST_FILTER, **(DEFAULTS | params))
+    return ' '.join(query.split()), args
+
+
+async def fetch_series(**params) -> list[tuple[datetime.time, dict[str, int]]]:
+    """Runs the query over SNAPSHOTS instead of the `posts` table."""
+    query, args = _reactions_query(POST_FILTER, **(DEFAULTS | params))
+    query = query.replace('FROM posts', f'FROM {SNAPSHOTS}')
+
+    rows = await db_utils.db_fetchall(Post, query, args | dict(id=1, channel_id=-100), raise_not_found=False)
+    return [(row.point_date.time(), dict(zip(row.keys, row.values))) for row in rows]
+
+
+def test_raw_snapshots() -> None:
+    query, args = reactions_query()
+    assert args == {}
+    assert query == (
+        '--sql SELECT *, data.key AS keys, data.value AS values FROM posts '
+        f'WHERE {POST_FILTER} ORDER BY point_date ASC'
+    )
+
+
+def test_resolution() -> None:
+    query, args = reactions_query(resolution=3600)
+    assert args == dict(resolution=3600)
+    assert query.startswith('--sql WITH (0, %(resolution)s) AS span SELECT')
+    assert 'GROUP BY id, channel_id, intDiv(toUnixTimestamp(point_date) - span.1, span.2)' in query
+    assert 'argMax(data.key, point_date), argMax(data.value, point_date)' in query
+    assert 'mapSubtract' not in query and 'bucket_number > 1' not in query
+
+
+def test_points_over_window() -> None:
+    query, args = reactions_query(
+        points=50,
+        from_=datetime.datetime(2023, 10, 1),
+        to=datetime.datetime(2023, 10, 2, tzinfo=datetime.timezone(datetime.timedelta(hours=3))),
+    )
+    assert args == dict(points=50, **{'from': 1696118400}, to=1696194000)
+
+    window = f'{POST_FILTER} AND point_date >= toDateTime(%(from)s) AND point_date < toDateTime(%(to)s)'
+    # the span is computed over the same window as the buckets
+    assert query.count(f'WHERE {window}') == 2
+    assert '%(points)s) + 1' in query
+
+
+def test_keys_and_deltas() -> None:
+    query, args = reactions_query(keys=['@views', '👍'], deltas=True)
+    assert args == dict(keys=['@views', '👍'])
+    assert query.startswith('--sql WITH (0, 1) AS span SELECT')
+    assert 'mapFilter((k, v) -> has(%(keys)s, k), mapFromArrays(' in query
+    assert re.search(r'mapSubtract\(snapshot, lagInFrame\(snapshot\) OVER \(PARTITION BY id, channel_id', query)
+    # the first bucket is only the baseline for the deltas
+    assert 'WHERE bucket_number > 1 ORDER BY point_date ASC' in query
+
+
+@pytest.mark.parametrize('params', [dict(resolution=0), dict(points=-1)])
+def test_invalid_buckets(params) -> None:
+    with pytest.raises(BadRequestError):
+        reactions_query(**params)
+
+
+def test_series_on_clickhouse() -> None:
+    """Needs ClickHouse, like tests/db_test.py."""
+
+    async def main():
+        async with db_utils.clickhouse_default():
+            return (
+                await fetch_series(resolution=3600),
+                await fetch_series(deltas=True),
+                await fetch_series(resolution=3600, deltas=True),
+                await fetch_series(points=2, keys=['👍'], deltas=True),
+            )
+
+    hourly, deltas, hourly_deltas, two_points = asyncio.run(main())
+
+    assert hourly == [
+        (datetime.time(10, 30), {'@views': 120, '👍': 2}),
+        (datetime.time(11, 15), {'@views': 150, '👍': 3}),
+    ]
+    # changes between the snapshots, the first one is only the baseline
+    assert deltas == [
+        (datetime.time(10, 30), {'@views': 20, '👍': 1}),
+        (datetime.time(11, 15), {'@views': 30, '👍': 1}),
+    ]
+    assert hourly_deltas == [(datetime.time(11, 15), {'@views': 30, '👍': 1})]
+    assert two_points == [(datetime.time(11, 15), {'👍': 1})]
@@ -0,0 +1,168 @@
+import asyncio
+import contextlib
+import datetime
+import operator
+import re
+from collections import defaultdict
+
+import pytest
+
+from vox_harbor.services import retention
+from vox_harbor.services.retention import PostRollup
+
+
+class FakeSession:
+    def __init__(self, rows: list[dict] | None):
+        self.rows = rows
+        self.queries: list[tuple[str, dict]] = []
+
+    async def execute(self, query: str, args: dict):
+        self.queries.append((' '.join(query.split()), args))
+
+    async def fetchall(self):
+        if not self.rows:
+            raise AttributeError('no rows')
+        return self.rows
+
+
+@pytest.fixture
+def session(monkeypatch) -> FakeSession:
+    session = FakeSession(rows=None)
+
+    @contextlib.asynccontextmanager
+    async def session_scope():
+        yield session
+
+    monkeypatch.setattr(retention, 'session_scope', session_scope)
+    return session
+
+
+@pytest.mark.parametrize(
+    'target, bucket',
+    [(PostRollup.Tier.HOURLY, 'toStartOfHour'), (PostRollup.Tier.DAILY, 'toStartOfDay')],
+)
+def test_roll_up(session: FakeSession, target: PostRollup.Tier, bucket: str) -> None:
+    asyncio.run(PostRollup().roll_up(target, 86400, 2 * 86400))
+
+    (insert, insert_args), (delete, delete_args) = session.queries
+    assert insert_args == delete_args
+    assert insert_args['target'] == target and (insert_args['start'], insert_args['end']) == (86400, 2 * 86400)
+
+    in_window = 'point_date >= toDateTime(%(start)s) AND point_date < toDateTime(%(end)s)'
+    assert insert.startswith('INSERT INTO posts')
+    assert f'WHERE tier <= %(target)s AND {in_window} GROUP BY channel_id, id, {bucket}(point_date)' in insert
+    assert 'argMax(data.value, point_date)' in insert
+
+    # aggregates of this or a newer, overlapping run are kept
+    assert delete == (
+        f'DELETE FROM posts WHERE tier <= %(target)s AND {in_window} '
+        'AND NOT (tier = %(target)s AND rollup_version >= %(version)s)'
+    )
+
+
+def test_pending_windows(session: FakeSession) -> None:
+    rollup = PostRollup()
+    assert asyncio.run(rollup._pending_windows(PostRollup.Tier.HOURLY, 1_000_000)) == []
+
+    (query, args), = session.queries
+    assert args == dict(target=1, cutoff=1_000_000)
+    assert 'WHERE tier < %(target)s AND point_date < toStartOfDay(toDateTime(%(cutoff)s))' in query
+
+    session.rows = [dict(window_start=0), dict(window_start=86400)]
+    assert asyncio.run(rollup._pending_windows(PostRollup.Tier.DAILY, 1_000_000)) == [0, 86400]
+
+
+def test_run_once_cutoffs(monkeypatch) -> None:
+    monkeypatch.setattr(retention.config, 'POSTS_HOURLY_AFTER_DAYS', 7)
+    monkeypatch.setattr(retention.config, 'POSTS_DAILY_AFTER_DAYS', 30)
+
+    calls = []
+    rollup = PostRollup()
+
+    async def pending_windows(target, cutoff):
+        calls.append((target, cutoff))
+        return [86400] if target == PostRollup.Tier.HOURLY else []
+
+    async def roll_up(target, start, end):
+        calls.append((target, start, end))
+
+    monkeypatch.setattr(rollup, '_pending_windows', pending_windows)
+    monkeypatch.setattr(rollup, 'roll_up', roll_up)
+
+    before = datetime.datetime.now(datetime.timezone.utc).timestamp()
+    asyncio.run(rollup.run_once())
+
+    (hourly, hourly_cutoff), rolled, (daily, daily_cutoff) = calls
+    assert hourly == PostRollup.Tier.HOURLY and daily == PostRollup.Tier.DAILY
+    assert abs(before - 7 * 86400 - hourly_cutoff) < 5 and abs(before - 30 * 86400 - daily_cutoff) < 5
+    assert rolled == (PostRollup.Tier.HOURLY, 86400, 2 * 86400)
+
+
+class FakePosts:
+    """
+    `posts` in memory behind a fake session. Runs the rollup INSERT and DELETE the way ClickHouse would,
+    taking the bucket function and the version comparison from the generated queries.
+    """
+
+    BUCKETS = {'toStartOfHour': 60 * 60, 'toStartOfDay': 24 * 60 * 60}
+    COMPARISONS = {'>=': operator.ge, '=': operator.eq}
+
+    def __init__(self, rows: list[dict]):
+        self.rows = rows
+
+    @staticmethod
+    def _in_window(row: dict, args: dict) -> bool:
+        return args['start'] <= row['point_date'] < args['end'] and row['tier'] <= args['target']
+
+    async def execute(self, query: str, args: dict):
+        if query.startswith('INSERT INTO posts'):
+            bucket = self.BUCKETS[re.search(r'GROUP BY channel_id, id, (\w+)\(point_date\)', query).group(1)]
+
+            groups = defaultdict(list)
+            for row in self.rows:
+                if self._in_window(row, args):
+                    groups[row['channel_id'], row['id'], row['point_date'] // bucket].append(row)
+
+            for rows in groups.values():
+                last = max(rows, key=operator.itemgetter('point_date'))
+                self.rows.append(last | dict(tier=args['target'], rollup_version=args['version']))
+        else:
+            assert query.startswith('DELETE FROM posts')
+            keep = re.search(r'NOT \(tier = %\(target\)s AND rollup_version (>=|=) %\(version\)s\)', query)
+            newer = self.COMPARISONS[keep.group(1)]
+
+            self.rows = [
+                row
+                for row in self.rows
+                if not self._in_window(row, args)
+                or row['tier'] == args['target'] and newer(row['rollup_version'], args['version'])
+            ]
+
+        await asyncio.sleep(0)  # lets overlapping runs interleave query by query
+
+
+def raw(point_date: int, views: int) -> dict:
+    return dict(id=1, channel_id=-100, point_date=point_date, views=views, tier=0, rollup_version=0)
+
+
+def test_overlapping_rollups(monkeypatch) -> None:
+    day = 24 * 60 * 60
+    posts = FakePosts([raw(day + 60, 1), raw(day + 120, 2), raw(day + 3600, 3), raw(2 * day + 60, 4)])
+
+    @contextlib.asynccontextmanager
+    async def session_scope():
+        yield posts
+
+    # both runs start within the same clock tick
+    monkeypatch.setattr(retention.time, 'time_ns', lambda: 1_700_000_000 * 10**9)
+    monkeypatch.setattr(retention, 'session_scope', session_scope)
+
+    async def main():
+        # two controllers: insert, insert, delete, delete
+        await asyncio.gather(*(PostRollup().roll_up(PostRollup.Tier.HOURLY, day, 2 * day) for _ in range(2)))
+
+    asyncio.run(main())
+
+    rows = sorted((row['point_date'], row['views'], row['tier']) for row in posts.rows)
+    assert rows == [(day + 120, 2, 1), (day + 3600, 3, 1), (2 * day + 60, 4, 0)]
+    assert len({row['rollup_version'] for row in posts.rows if row['tier']}) == 1
@@ -0,0 +1,109 @@
+"""
+Latency benchmark for `/users_and_chats` against an in-memory ClickHouse stand-in
+with a fixed per-query latency: sequential getters (previous implementation) vs. classified concurrent lookups.
+
+    python -m tests.search_bench [latency_ms]
+"""
+import asyncio
+import datetime
+import sys
+import time
+
+from vox_harbor.big_bot.structures import Chat, User, UserInfo
+from vox_harbor.common.exceptions import NotFoundError
+from vox_harbor.services import controller
+
+USERS = [User(user_id=100 + i, username=f'user_{i}', name=f'Name {i}') for i in range(1000)]
+CHATS = [
+    Chat(
+        id=-1000000000000 - i,
+        name=f'Chat {i}',
+        join_string=f'chat_{i}',
+        shard=0,
+        bot_index=0,
+        added=datetime.datetime(2023, 10, 1),
+        type=Chat.Type.CHAT,
+    )
+    for i in range(1000)
+]
+
+QUERIES = ['user_12', '105', '-1000000000007', 'https://t.me/chat_3', 'Chat 42', 'nobody']
+
+
+def make_stand_in(latency: float):
+    def select(model, args: dict):
+        if model is User:
+            if 'user_ids' in args:
+                user_ids = {int(user_id) for user_id in args['user_ids']}
+                return [u for u in USERS if u.user_id in user_ids]
+            return [u for u in USERS if u.username.lower().startswith(args['username'].rstrip('%').lower())]
+
+        if 'chat_id' in args or 'id' in args:
+            chat_id = args.get('chat_id', args.get('id'))
+            return [c for c in CHATS if str(c.id) == str(chat_id)]
+
+        name, join_string = (args.get(k) or '\0' for k in ('name', 'join_string'))
+        return [
+            c
+            for c in CHATS
+            if c.name.lower().startswith(name.rstrip('%').lower())
+            or c.join_string.lower().startswith(join_string.rstrip('%').lower())
+        ]
+
+    async def db_fetchall(model, query, query_args=None, name=None, *, raise_not_found=True, cache=None):
+        await asyncio.sleep(latency)
+        if not (rows := select(model, query_args or {})) and raise_not_found:
+            raise NotFoundError(name or model.__name__)
+        return rows
+
+    async def db_fetchone(model, query, query_args=None, name=None, *, raise_not_found=True, cache=None):
+        rows = await db_fetchall(model, query, query_args, name, raise_not_found=raise_not_found)
+        return rows[0] if rows else None
+
+    return db_fetchall, db_fetchone
+
+
+async def legacy_users_and_chats(query: str) -> tuple[list[UserInfo], list[Chat]]:
+    """The previous implementation: six getters awaited one after another, misses raise."""
+
+    async def run(getters):
+        result = []
+        for func, arg_name in getters:
+            try:
+                response = await func(**{arg_name: query})
+            except Exception:
+                continue
+            result += response if isinstance(response, list) else [response]
+        return result
+
+    user_getters = (
+        (controller.get_users, 'username'),
+        (controller.get_user, 'user_id'),
+        (controller.get_user_by_msg_url, 'msg_url'),
+    )
+    chat_getters = ((controller.get_chat, 'chat_id'), (controller.get_chats, 'join_string'), (controller.get_chats, 'name'))
+    return tuple(await asyncio.gather(run(user_getters), run(chat_getters)))
+
+
+async def measure(func, rounds: int = 20) -> float:
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for query in QUERIES:
+            await func(query)
+
+    return (time.perf_counter() - started) / (rounds * len(QUERIES)) * 1000
+
+
+async def main(latency_ms: float = 5) -> None:
+    controller.db_fetchall, controller.db_fetchone = make_stand_in(latency_ms / 1000)
+
+    legacy = await measure(legacy_users_and_chats)
+    classified = await measure(controller.get_users_and_chats)
+
+    print(f'query latency: {latency_ms} ms')
+    print(f'legacy:        {legacy:.1f} ms/search')
+    print(f'classified:    {classified:.1f} ms/search ({legacy / classified:.1f}x)')
+
+
+if __name__ == '__main__':
+    asyncio.run(main(*map(float, sys.argv[1:])))
@@ -0,0 +1,87 @@
+import asyncio
+import datetime
+
+import pytest
+
+from vox_harbor.big_bot.spill import SpillBuffer
+from vox_harbor.common.db_utils import ColumnarBlock
+
+
+def make_block(*user_ids: int) -> ColumnarBlock:
+    block = ColumnarBlock('users', ('user_id', 'username', 'date'))
+    for user_id in user_ids:
+        block.append(user_id, f'user_{user_id}', datetime.datetime(2023, 10, 1, 12, 0))
+    return block
+
+
+def test_spill_replay(tmp_path) -> None:
+    spill = SpillBuffer(tmp_path, max_bytes=2**20)
+    assert spill.write(make_block(1, 2))
+    assert spill.write(make_block(3))
+    assert spill.pending
+
+    inserted: list[ColumnarBlock] = []
+
+    async def flaky_insert(block: ColumnarBlock) -> None:
+        if len(inserted) == 1 and block.data[0] == [3]:
+            inserted.append(None)  # fail only once
+            raise ConnectionError('clickhouse is down')
+        inserted.append(block)
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(spill.replay(flaky_insert))
+
+    # the first block is not replayed again
+    assert asyncio.run(SpillBuffer(tmp_path, max_bytes=2**20).replay(flaky_insert)) == 1
+    assert [b.data[0] for b in inserted if b is not None] == [[1, 2], [3]]
+    assert inserted[-1].data[2] == [datetime.datetime(2023, 10, 1, 12, 0)]
+    assert not spill.pending
+
+
+def test_spill_quota(tmp_path) -> None:
+    spill = SpillBuffer(tmp_path, max_bytes=100)
+    assert not spill.write(make_block(*range(100)))
+    assert spill.dropped_rows == 100
+    assert not spill.pending
+
+
+def test_spill_torn_record(tmp_path) -> None:
+    spill = SpillBuffer(tmp_path, max_bytes=2**20)
+    spill.write(make_block(1))
+    spill.write(make_block(2))
+
+    segment = next(tmp_path.glob('*.seg'))
+    segment.write_bytes(segment.read_bytes()[:-3])
+
+    inserted: list[ColumnarBlock] = []
+
+    async def insert(block: ColumnarBlock) -> None:
+        inserted.append(block)
+
+    assert asyncio.run(spill.replay(insert)) == 1
+    assert not spill.pending
+
+
+def test_spill_corrupted_record(tmp_path) -> None:
+    spill = SpillBuffer(tmp_path, max_bytes=2**20)
+    for user_id in range(1, 4):
+        spill.write(make_block(user_id))
+
+    segment = next(tmp_path.glob('*.seg'))
+    data = bytearray(segment.read_bytes())
+    second = len(data) // 3
+    data[second + SpillBuffer.HEADER.size + 5] ^= 0xFF
+    segment.write_bytes(bytes(data))
+
+    inserted: list[ColumnarBlock] = []
+
+    async def insert(block: ColumnarBlock) -> None:
+        inserted.append(block)
+
+    assert asyncio.run(spill.replay(insert)) == 1
+    assert not spill.pending and spill.size == 0
+
+    # the segment is kept with its sidecar at the corrupted record
+    quarantined = segment.with_suffix(SpillBuffer.QUARANTINE_SUFFIX)
+    assert quarantined.read_bytes() == bytes(data)
+    assert int(segment.with_suffix('.offset').read_text()) == second
@@ -0,0 +1,291 @@
+import asyncio
+import contextlib
+import datetime
+import types
+
+import pytest
+
+from vox_harbor.big_bot import bots, tasks
+from vox_harbor.big_bot.coverage import CoverageIndex
+from vox_harbor.big_bot.structures import Chat, HistoryCheckpoint
+from vox_harbor.big_bot.tasks import HistoryTask, Task, TaskManager
+
+
+class CountingTask(Task):
+    def __init__(self, name: str, steps: int, log: list[str], group: int = 0, priority: int = 0):
+        super().__init__()
+        self.name = name
+        self.steps = steps
+        self.log = log
+        self.count = 0
+        self._group = group
+        self._priority = priority
+
+    async def step(self):
+        await asyncio.sleep(0.01)
+        self.count += 1
+        self.log.append(self.name)
+
+    @property
+    def group(self) -> int:
+        return self._group
+
+    @property
+    def priority(self) -> int:
+        return self._priority
+
+    @property
+    def processed(self) -> int:
+        return self.count
+
+    @property
+    def progress(self) -> float:
+        return self.count / self.steps * 100
+
+    @property
+    def id(self) -> str:
+        return self.name
+
+    @property
+    def finished(self) -> bool:
+        return self.count >= self.steps
+
+    def close(self):
+        self.log.append(f'{self.name} closed')
+
+
+def test_priority_and_fairness() -> None:
+    log: list[str] = []
+
+    async def main():
+        manager = TaskManager()
+        manager.STEPS_PER_BOT = 1
+
+        await manager.add_task(CountingTask('backfill', 2, log, priority=1))
+        await manager.add_task(CountingTask('a', 2, log))
+        await manager.add_task(CountingTask('b', 2, log))
+        await manager.add_task(CountingTask('other_bot', 2, log, group=1))
+        manager.start()
+
+        while manager.tasks:
+            await asyncio.sleep(0.01)
+
+        return manager.stats()
+
+    stats = asyncio.run(main())
+
+    steps = [name for name in log if not name.endswith(' closed')]
+    assert [name for name in steps if name != 'other_bot'] == ['a', 'b', 'a', 'b', 'backfill', 'backfill']
+    assert steps.index('other_bot') < steps.index('b')  # bots don't wait for each other
+    assert [(s.group, s.steps, s.finished, s.processed) for s in stats] == [(0, 6, 3, 6), (1, 2, 1, 2)]
+    assert sorted(name for name in log if name.endswith(' closed')) == [
+        'a closed',
+        'b closed',
+        'backfill closed',
+        'other_bot closed',
+    ]
+
+
+def test_history_task_checkpoint_round_trip() -> None:
+    class FakeBot:
+        index = 1
+
+    task = HistoryTask(FakeBot(), chat_id=42, start_id=0, end_id=500)  # type: ignore
+    task.start, task.current_offset = 2000, 1200
+
+    restored = HistoryTask.from_checkpoint(FakeBot(), task.checkpoint())  # type: ignore
+
+    assert (restored.id, restored.priority, restored.start, restored.end, restored.current_offset) == (
+        '42_0_500',
+        HistoryTask.Priority.FRESH,
+        2000,
+        500,
+        1200,
+    )
+    assert restored.progress == task.progress
+    assert not restored.finished
+
+
+class HistoryBot:
+    """Serves the first page right away, prefetched pages hang until cancelled."""
+
+    index = 0
+
+    def __init__(self, fail_top_messages: bool = False):
+        self.calls = 0
+        self.prefetched: list[asyncio.Future] = []
+        self.top_messages = self
+        self.fail_top_messages = fail_top_messages
+
+    async def get_history(self, chat_id: int, start: int, end: int, limit: int):
+        self.calls += 1
+        if self.calls == 1:
+            return [types.SimpleNamespace(id=i, reply_to_top_message_id=None) for i in range(start - 1, start - 6, -1)]
+
+        page = asyncio.get_running_loop().create_future()
+        self.prefetched.append(page)
+        return await page
+
+    async def get_many(self, chat_id: int, message_ids):
+        if self.fail_top_messages:
+            raise ConnectionError('telegram is down')
+        return {}
+
+
+@pytest.fixture
+def history(monkeypatch) -> CoverageIndex:
+    async def process_message(bot, message, top_messages):
+        pass
+
+    index = CoverageIndex()
+    monkeypatch.setattr(tasks, 'coverage', index)
+    monkeypatch.setattr(tasks, 'process_message', process_message)
+    return index
+
+
+@pytest.mark.usefixtures('history')
+def test_failed_step_cancels_prefetch() -> None:
+    async def main():
+        bot = HistoryBot(fail_top_messages=True)
+        task = HistoryTask(bot, -100, start_id=1000, end_id=0)  # type: ignore
+
+        await task.do_step()
+        await asyncio.sleep(0)
+        return bot, task
+
+    bot, task = asyncio.run(main())
+    assert task.retries_count == 1 and task._prefetch is None
+    assert bot.calls == 1  # the prefetch never reached Telegram
+
+
+@pytest.mark.usefixtures('history')
+def test_closed_task_cancels_prefetch() -> None:
+    async def main():
+        bot = HistoryBot()
+        task = HistoryTask(bot, -100, start_id=1000, end_id=0)  # type: ignore
+
+        await task.do_step()
+        await asyncio.sleep(0)
+        assert bot.calls == 2 and not bot.prefetched[0].done()
+
+        # e.g. dropped by the manager while the next page is still being fetched
+        task.close()
+        await asyncio.sleep(0)
+        return bot, task
+
+    bot, task = asyncio.run(main())
+    assert task.retries_count == 0 and task._prefetch is None
+    assert bot.prefetched[0].cancelled()
+
+
+class CheckpointTable:
+    """`history_checkpoints` behind fake `session_scope` and `db_fetchall`."""
+
+    def __init__(self, monkeypatch):
+        self.rows: list[HistoryCheckpoint] = []
+        monkeypatch.setattr(tasks, 'session_scope', self.session_scope)
+        monkeypatch.setattr(tasks, 'db_fetchall', self.db_fetchall)
+
+    @contextlib.asynccontextmanager
+    async def session_scope(self):
+        yield self
+
+    def set_settings(self, settings: dict):
+        pass
+
+    async def insert_block(self, block):
+        self.rows.extend(HistoryCheckpoint(**dict(zip(block.columns, row))) for row in zip(*block.data))
+
+    async def db_fetchall(self, model, query, args, **kwargs):
+        return list({row.task_id: row for row in self.rows}.values())  # FINAL
+
+
+def test_fresh_task_is_not_finished() -> None:
+    task = HistoryTask(HistoryBot(), -100, start_id=0, end_id=500)  # type: ignore
+    assert task.id == '-100_0_500'
+    assert not task.finished and not task.checkpoint().finished
+
+
+def test_open_ended_task_survives_restart(monkeypatch, history: CoverageIndex) -> None:
+    table = CheckpointTable(monkeypatch)
+    history.record(-100, 1, 500)
+
+    chat = Chat(
+        id=-100,
+        name='chat',
+        join_string='',
+        shard=0,
+        bot_index=0,
+        added=datetime.datetime(2023, 10, 1),
+        type=Chat.Type.CHAT,
+    )
+    chats = types.SimpleNamespace(known_chats={chat.id: chat})
+    monkeypatch.setattr(bots, 'coverage', history)
+
+    async def restart() -> TaskManager:
+        manager = TaskManager()
+        await manager.load_checkpoints()
+        monkeypatch.setattr(tasks, '_task_manager', manager)
+
+        await bots.Bot.generate_history_task(HistoryBot(), chats, chat.id)  # type: ignore
+        return manager
+
+    async def main():
+        manager = await restart()
+        assert list(manager.tasks) == ['-100_0_500']
+
+        # shutdown before the task's first step
+        await manager.save_checkpoints(all_tasks=True)
+        assert list(manager.tasks) == list((await restart()).tasks) == ['-100_0_500']
+
+        # a run that found no new messages doesn't stop the next one from looking
+        manager.tasks['-100_0_500']._finished = True
+        await manager.save_checkpoints(all_tasks=True)
+        assert table.rows[-1].finished
+        assert list((await restart()).tasks) == ['-100_0_500']
+
+    asyncio.run(main())
+
+
+def test_finished_backfill_is_not_repeated(monkeypatch) -> None:
+    CheckpointTable(monkeypatch)
+
+    async def main():
+        manager = TaskManager()
+        task = HistoryTask(HistoryBot(), -100, start_id=1000, end_id=0)  # type: ignore
+        task._finished = True
+        manager.tasks[task.id] = task
+        await manager.save_checkpoints(all_tasks=True)
+
+        restarted = TaskManager()
+        await restarted.load_checkpoints()
+        await restarted.add_task(HistoryTask(HistoryBot(), -100, start_id=1000, end_id=0))  # type: ignore
+        return restarted
+
+    assert not asyncio.run(main()).tasks
+
+
+def test_load_retries_then_fails(monkeypatch) -> None:
+    attempts: list[str] = []
+
+    async def sleep(delay: float):
+        attempts.append(f'sleep {delay}')
+
+    async def load_checkpoints(self):
+        attempts.append('checkpoints')
+
+    async def load_coverage():
+        attempts.append('coverage')
+        raise ConnectionError('clickhouse is down')
+
+    monkeypatch.setattr(tasks.asyncio, 'sleep', sleep)
+    monkeypatch.setattr(TaskManager, 'LOAD_ATTEMPTS', 3)
+    monkeypatch.setattr(TaskManager, 'load_checkpoints', load_checkpoints)
+    monkeypatch.setattr(tasks.coverage, 'load', load_coverage)
+    monkeypatch.setattr(tasks, '_task_manager', None)
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(TaskManager.get_instance())
+
+    assert attempts == ['checkpoints', 'coverage', 'sleep 5', 'coverage', 'sleep 10', 'coverage']
+    assert tasks._task_manager is None  # the next call loads again
@@ -0,0 +1,46 @@
+import asyncio
+from types import SimpleNamespace
+
+from pyrogram import enums
+
+from vox_harbor.big_bot.top_messages import TopMessageCache
+
+CHANNEL = SimpleNamespace(id=-100, type=enums.ChatType.CHANNEL)
+
+
+def _message(chat_id: int, message_id: int, post_id: int | None = None) -> SimpleNamespace:
+    return SimpleNamespace(
+        id=message_id,
+        chat=SimpleNamespace(id=chat_id),
+        empty=False,
+        sender_chat=CHANNEL if post_id else None,
+        forward_from_message_id=post_id,
+    )
+
+
+class FakeBot:
+    index = 0
+
+    def __init__(self):
+        self.calls: list[list[int]] = []
+
+    async def get_messages(self, chat_id: int, message_ids: list[int], replies: int):
+        self.calls.append(message_ids)
+        return [_message(chat_id, i, post_id=i * 10 if i % 2 else None) for i in message_ids]
+
+
+def test_misses_are_coalesced() -> None:
+    bot = FakeBot()
+    cache = TopMessageCache(bot)  # type: ignore
+
+    async def main():
+        cache.remember(_message(1, 7, post_id=70))  # type: ignore
+
+        results = await asyncio.gather(cache.get(1, 1), cache.get(1, 2), cache.get_many(1, [1, 3, 7]))
+        assert results == [(-100, 10), (None, None), {1: (-100, 10), 3: (-100, 30), 7: (-100, 70)}]
+
+        assert await cache.get(1, 3) == (-100, 30)
+
+    asyncio.run(main())
+    assert bot.calls == [[1, 2, 3]]
+    assert (cache.hits, cache.misses, cache.requests) == (2, 4, 1)
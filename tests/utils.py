@@ -1,5 +1,23 @@
+import os
+import time
 from typing import Any, Iterable
 
+import pytest
+
 
 def is_sub_iterable(small: Iterable[Any], big: Iterable[Any]) -> bool:
     return all(elem in big for elem in small)
+
+
+@pytest.fixture
+def local_timezone():
+    """A local timezone east of UTC, so naive local and UTC datetimes differ."""
+    previous = os.environ.get('TZ')
+    os.environ['TZ'] = 'Asia/Yekaterinburg'
+    time.tzset()
+    yield
+    if previous is None:
+        del os.environ['TZ']
+    else:
+        os.environ['TZ'] = previous
+    time.tzset()
@@ -8,20 +8,31 @@ import cachetools
 import pyrogram.errors.exceptions
 from aiolimiter import AsyncLimiter
 from pyrogram import Client, enums, raw, types, utils
+from pyrogram.raw.core import TLObject
+from pyrogram.session import Session
 from pyrogram.types.messages_and_media.message import Message as PyrogramMessage
 
 from vox_harbor.big_bot import structures
 from vox_harbor.big_bot.chats import ChatsManager
+from vox_harbor.big_bot.coverage import coverage, missing_history
 from vox_harbor.big_bot.exceptions import AlreadyJoinedError
 from vox_harbor.big_bot.tasks import HistoryTask, TaskManager
+from vox_harbor.big_bot.top_messages import TopMessageCache
 from vox_harbor.common.config import Mode, config
-from vox_harbor.common.db_utils import db_fetchone, session_scope
+from vox_harbor.common.db_utils import session_scope
 from vox_harbor.common.exceptions import format_exception
+from vox_harbor.common.metrics import counter
+
+telegram_calls = counter('vox_harbor_telegram_calls_total', 'Telegram API calls per bot and method.', ('bot', 'method'))
+telegram_flood_wait = counter(
+    'vox_harbor_telegram_flood_wait_seconds_total',
+    'Flood waits imposed by Telegram per bot and method.',
+    ('bot', 'method'),
+)
 
 
 class Bot(Client):
     INTERVAL = 120
-    lock = asyncio.Lock()
 
     def __init__(self, *args, bot_index, **kwargs):
         super().__init__(*args, sleep_threshold=120, **kwargs)
@@ -30,13 +41,18 @@ class Bot(Client):
 
         self._invites_callback: dict[str, asyncio.Future[int]] = {}
         self._subscribed_chats: set[int] = set()
-        self._subscribed_chats_last_updated = 0
+        self._subscribed_chats_last_updated = 0.0
+        self._subscribed_chats_loaded = False
+        self._resync_task: asyncio.Task | None = None
+        self._resync_changes: dict[int, bool] | None = None
 
         self.logger = logging.getLogger(f'vox_harbor.big_bot.bots.bot.{bot_index}')
 
         self.history_limiter = AsyncLimiter(2, 1)
+        self.membership_limiter = AsyncLimiter(2, 60)  # joins and leaves done by ChatsManager
 
         self.members_count_cache = cachetools.TTLCache(maxsize=10_000, ttl=300)
+        self.top_messages = TopMessageCache(self)
 
     async def resolve_invite_callback(self, chat_title: str, channel_id: int):
         self.logger.info('got confirmation for %s', chat_title)
@@ -46,33 +62,95 @@ class Bot(Client):
         self._invites_callback[chat_title].set_result(channel_id)
         self.logger.info('callback resolved')
 
-    async def update_subscribed_chats(self):
-        self.logger.info('updating subscribed chats')
-        new_chats = set()
+    async def update_subscribed_chats(self) -> set[int]:
+        """Full resync with the dialog list, concurrent callers share a single walk."""
+        await asyncio.shield(self._start_resync())
+        return self._subscribed_chats
+
+    def _start_resync(self) -> asyncio.Task:
+        if self._resync_task is None or self._resync_task.done():
+            self._resync_task = asyncio.create_task(self._resync_subscribed_chats())
+            self._resync_task.add_done_callback(self._on_resync_done)
 
-        async for dialog in self.get_dialogs():
-            new_chats.add(dialog.chat.id)
+        return self._resync_task
 
-        self._subscribed_chats = new_chats
+    async def _resync_subscribed_chats(self):
+        self.logger.info('updating subscribed chats')
         self._subscribed_chats_last_updated = datetime.datetime.now().timestamp()
-        return self._subscribed_chats
 
-    async def get_subscribed_chats(self):
-        async with self.lock:
-            if (
-                not self._subscribed_chats
-                or datetime.datetime.now().timestamp() - self._subscribed_chats_last_updated > self.INTERVAL
-            ):
-                await self.update_subscribed_chats()
+        new_chats = set()
+        self._resync_changes = {}
+        try:
+            async for dialog in self.get_dialogs():
+                new_chats.add(dialog.chat.id)
+
+            # joins and leaves seen during the walk are newer than the dialog list
+            for chat_id, subscribed in self._resync_changes.items():
+                if subscribed:
+                    new_chats.add(chat_id)
+                else:
+                    new_chats.discard(chat_id)
+        finally:
+            self._resync_changes = None
+
+        # in place, readers may hold a reference to the set
+        self._subscribed_chats.clear()
+        self._subscribed_chats.update(new_chats)
+        self._subscribed_chats_loaded = True
+
+    def _on_resync_done(self, task: asyncio.Task):
+        if not task.cancelled() and (e := task.exception()) is not None:
+            self.logger.error('failed to update subscribed chats: %s', format_exception(e))
+
+    async def get_subscribed_chats(self) -> set[int]:
+        """
+        Index of chats the bot is in, kept up to date by join/leave events.
+        Only the first call waits for the dialog list, later resyncs run in background.
+        """
+        if not self._subscribed_chats_loaded:
+            return await self.update_subscribed_chats()
+
+        if datetime.datetime.now().timestamp() - self._subscribed_chats_last_updated > self.INTERVAL:
+            self._start_resync()
 
-            return self._subscribed_chats
+        return self._subscribed_chats
 
     def add_subscribed_chat(self, chat_id: int):
         self._subscribed_chats.add(chat_id)
+        if self._resync_changes is not None:
+            self._resync_changes[chat_id] = True
+
+    def remove_subscribed_chat(self, chat_id: int):
+        self._subscribed_chats.discard(chat_id)
+        if self._resync_changes is not None:
+            self._resync_changes[chat_id] = False
+
+    async def invoke(
+        self,
+        query: TLObject,
+        retries: int = Session.MAX_RETRIES,
+        timeout: float = Session.WAIT_TIMEOUT,
+        sleep_threshold: float | None = None,
+    ):
+        """Sleeps on flood waits here instead of inside pyrogram's session, so that they are accounted."""
+        if sleep_threshold is None:
+            sleep_threshold = self.sleep_threshold
+
+        while True:
+            telegram_calls.inc(bot=self.index, method=query.QUALNAME)
+            try:
+                return await super().invoke(query, retries, timeout, sleep_threshold=0)
+            except pyrogram.errors.FloodWait as e:
+                telegram_flood_wait.inc(e.value, bot=self.index, method=query.QUALNAME)
+                if e.value > sleep_threshold:
+                    raise
+
+                self.logger.warning('waiting for %s seconds before retrying %s', e.value, query.QUALNAME)
+                await asyncio.sleep(e.value)
 
     async def leave_chat(self, chat_id: int, delete: bool = True):
         self.logger.info('leaving %s', chat_id)
-        self._subscribed_chats.remove(chat_id)
+        self.remove_subscribed_chat(chat_id)
         await super().leave_chat(chat_id, delete)
 
     async def join_chat(self, join_string: str | int):
@@ -81,7 +159,7 @@ class Bot(Client):
 
         self.logger.info('joining %s', join_string)
         chat = await super().join_chat(join_string)
-        self._subscribed_chats.add(chat.id)
+        self.add_subscribed_chat(chat.id)
         return chat
 
     async def discover_chat(
@@ -168,12 +246,6 @@ class Bot(Client):
 
             await chats.register_new_chat(self.index, chat.id, join_string)
 
-    async def get_message_witch_cache(self, chat_id: int, message_id: int):
-        if (chat_id, message_id) in self.message_cache.store:
-            return self.message_cache[chat_id, message_id]
-
-        return await self.get_messages(chat_id=chat_id, message_ids=message_id, replies=0)
-
     async def get_history(self, chat_id: int, start: int, end: int, limit: int) -> list[types.Message]:
         await self.history_limiter.acquire()
         raw_messages = await self.invoke(
@@ -194,13 +266,6 @@ class Bot(Client):
 
     async def generate_history_task(self, chats: ChatsManager, chat_id: int, with_from_earliest: bool = True):
         tasks = await TaskManager.get_instance()
-        comment = await db_fetchone(
-            structures.CommentRange,
-            'SELECT chat_id, min(min_message_id) as min_message_id, max(max_message_id) as max_message_id FROM comments_range_mv WHERE chat_id = %(chat_id)s\n'
-            'GROUP BY chat_id',
-            dict(chat_id=chat_id),
-            raise_not_found=False,
-        )
 
         if not (chat := chats.known_chats.get(chat_id)):
             return
@@ -208,14 +273,16 @@ class Bot(Client):
         if chat.type in (structures.Chat.Type.CHANNEL, structures.Chat.Type.PRIVATE):
             return
 
-        if comment is None:
-            await tasks.add_task(HistoryTask(bot=self, chat_id=chat_id, start_id=0, end_id=0))
-        else:
-            if comment.max_message_id and with_from_earliest:
-                await tasks.add_task(HistoryTask(bot=self, chat_id=chat_id, start_id=0, end_id=comment.max_message_id))
+        planned = coverage.get(chat_id)  # chats crawled before the index existed are seeded on load
+
+        for checkpoint in tasks.unfinished_checkpoints(chat_id):
+            task = HistoryTask.from_checkpoint(self, checkpoint)
+            planned.add(*task.remaining)
+
+            await tasks.add_task(task)
 
-            if comment.min_message_id > 1000:
-                await tasks.add_task(HistoryTask(bot=self, chat_id=chat_id, start_id=comment.min_message_id, end_id=0))
+        for start_id, end_id in missing_history(planned, with_latest=with_from_earliest, min_gap=HistoryTask.DELTA):
+            await tasks.add_task(HistoryTask(bot=self, chat_id=chat_id, start_id=start_id, end_id=end_id))
 
     async def get_chat_members_count_with_cache(self, chat_id: int | str) -> int:
         if chat_id in self.members_count_cache:
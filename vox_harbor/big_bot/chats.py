@@ -1,13 +1,17 @@
 import asyncio
 import datetime
+import enum
 import logging
+import time
+from collections import defaultdict
 
+import pyrogram.errors
 from pyrogram import enums, types
 
 import vox_harbor.big_bot
 from vox_harbor.big_bot import structures
 from vox_harbor.common.config import config
-from vox_harbor.common.db_utils import db_fetchall, db_fetchone, session_scope
+from vox_harbor.common.db_utils import db_fetchall, session_scope
 from vox_harbor.common.exceptions import format_exception
 
 
@@ -15,14 +19,24 @@ class ChatsManager:
     logger = logging.getLogger('vox_harbor.big_bot.chats')
     lock = asyncio.Lock()
 
+    class Action(enum.StrEnum):
+        JOIN = 'JOIN'
+        LEAVE = 'LEAVE'
+
     INTERVAL = 60
+    FULL_SYNC_INTERVAL = 60 * 60
+    DELTA_OVERLAP = 30  # seconds, covers async inserts that become visible late
 
     def __init__(self, bot_manager: 'vox_harbor.big_bot.bots.BotManager'):
         self.bots = bot_manager
-        self.last_updated = 0
+        self.last_updated: float | None = None
+        self.last_full_update: float | None = None
 
         self.known_chats: dict[int, structures.Chat] = {}
 
+        self._pending: defaultdict[int, dict[int, tuple[ChatsManager.Action, structures.Chat]]] = defaultdict(dict)
+        self._workers: dict[int, asyncio.Task] = {}
+
     @staticmethod
     def get_chat_type(chat: types.Chat):
         if chat.type == enums.ChatType.CHANNEL:
@@ -45,7 +59,7 @@ class ChatsManager:
                 join_string=join_string,
                 shard=config.SHARD_NUM,
                 bot_index=bot_index,
-                added=datetime.datetime.utcnow().timestamp(),
+                added=datetime.datetime.now(datetime.UTC),
                 type=self.get_chat_type(chat),
             )
 
@@ -58,72 +72,123 @@ class ChatsManager:
         await bot.generate_history_task(self, chat_id, with_from_earliest=False)
         return True
 
-    async def update(self):
-        self.logger.info('updating chats')
+    async def update(self, full: bool = False):
+        """
+        Syncs `known_chats` with the `chats` table and joins/leaves chats that changed.
+        Non-full updates only read rows added since the previous sync (measured with the server clock),
+        a periodic full sync catches anything a delta could miss, e.g. bots kicked from chats.
+        """
+        started = time.monotonic()
+        if full or self.last_full_update is None or started - self.last_full_update > self.FULL_SYNC_INTERVAL:
+            self.logger.info('updating chats (full)')
+            chats = await db_fetchall(structures.Chat, 'SELECT * FROM chats', raise_not_found=False)
+
+            self.known_chats = {}
+            self._merge(chats)
+            self.last_full_update = started
+        else:
+            assert self.last_updated is not None
+            since = int(started - self.last_updated) + self.DELTA_OVERLAP
+            chats = await db_fetchall(
+                structures.Chat,
+                'SELECT * FROM chats WHERE added >= now() - INTERVAL %(since)s SECOND',
+                dict(since=since),
+                raise_not_found=False,
+            )
+
+            chats = self._merge(chats)
+            self.logger.info('updating chats (%s changed in the last %s seconds)', len(chats), since)
+
+        self.last_updated = started
+        await self._reconcile(chats)
+
+    def _merge(self, chats: list[structures.Chat]) -> list[structures.Chat]:
+        """Applies rows to `known_chats` in place, returns the chats that actually changed."""
+        changed: dict[int, structures.Chat] = {}
+        for chat in chats:
+            known = self.known_chats.get(chat.id)
+            if known is not None and (known == chat or known.added > chat.added):
+                continue
+
+            self.known_chats[chat.id] = changed[chat.id] = chat
 
-        join_count = 0
-        leave_count = 0
-        chats = await db_fetchall(structures.Chat, 'SELECT * FROM chats', raise_not_found=False)
+        return list(changed.values())
 
-        new_known_chats = {chat.id: chat for chat in chats}
-        self.known_chats = new_known_chats
+    def _plan(
+        self, chats: list[structures.Chat], subscribed_chats: list[set[int]]
+    ) -> list[tuple[int, Action, structures.Chat]]:
+        """Joins and leaves, as (bot index, action, chat), that bring bots' subscriptions in line with `chats`."""
+        plan: list[tuple[int, ChatsManager.Action, structures.Chat]] = []
 
         for chat in chats:
-            for i, bot in enumerate(self.bots):
+            for i, subscribed in enumerate(subscribed_chats):
                 if (
-                    chat.id in await bot.get_subscribed_chats()
+                    chat.id in subscribed
                     and (chat.shard != config.SHARD_NUM or chat.bot_index != i)
                     and chat.type != structures.Chat.Type.PRIVATE
                 ):
                     # Wrong bot index or shard
-                    try:
-                        await bot.leave_chat(chat.id)
-                        leave_count += 1
+                    plan.append((i, self.Action.LEAVE, chat))
+
+            if (
+                chat.shard == config.SHARD_NUM
+                and chat.join_string
+                and chat.bot_index < len(subscribed_chats)
+                and chat.id not in subscribed_chats[chat.bot_index]
+            ):
+                plan.append((chat.bot_index, self.Action.JOIN, chat))
+
+        return plan
+
+    async def _reconcile(self, chats: list[structures.Chat]):
+        subscribed_chats = [await bot.get_subscribed_chats() for bot in self.bots]
+        plan = self._plan(chats, subscribed_chats)
+
+        for bot_index, action, chat in plan:
+            self._pending[bot_index][chat.id] = action, chat
+
+        for bot_index, pending in self._pending.items():
+            worker = self._workers.get(bot_index)
+            if pending and (worker is None or worker.done()):
+                self._workers[bot_index] = asyncio.create_task(self._run_actions(bot_index))
+
+        joins = sum(action == self.Action.JOIN for _, action, _ in plan)
+        self.logger.info(
+            'planned %s joins, %s leaves, %s actions pending',
+            joins,
+            len(plan) - joins,
+            sum(map(len, self._pending.values())),
+        )
+
+    async def _run_actions(self, bot_index: int):
+        """Drains the bot's pending joins and leaves within its own rate budget, other bots run in parallel."""
+        bot = self.bots[bot_index]
+        pending = self._pending[bot_index]
 
-                        await asyncio.sleep(30)
-                    except Exception as e:
-                        self.logger.error('failed to leave chat %s: %s', chat.name, format_exception(e))
+        while pending:
+            chat_id = next(iter(pending))
+            action, chat = pending.pop(chat_id)
 
-            if chat.shard != config.SHARD_NUM:
-                continue
+            if (chat_id in await bot.get_subscribed_chats()) == (action == self.Action.JOIN):
+                continue  # already done by someone else
 
-            bot = self.bots[chat.bot_index]
-            if chat.id not in await bot.get_subscribed_chats():
+            async with bot.membership_limiter:
                 try:
-                    if chat.join_string:
+                    if action == self.Action.JOIN:
                         await bot.discover_chat(chat.join_string, join_no_check=True)
-
-                        join_count += 1
-                        await asyncio.sleep(30)
+                    else:
+                        await bot.leave_chat(chat_id)
+                except pyrogram.errors.FloodWait as e:
+                    self.logger.warning('bot %s got flood wait for %s s, postponing %s', bot_index, e.value, chat.name)
+                    pending.setdefault(chat_id, (action, chat))
+                    await asyncio.sleep(e.value)  # type: ignore
                 except Exception as e:
-                    self.logger.error('failed to join chat %s: %s', chat.name, format_exception(e))
-
-        self.known_chats = new_known_chats
-        self.logger.info('joined %s, left %s', join_count, leave_count)
-
-    async def run_once(self):
-        update = await db_fetchone(
-            structures.ChatUpdate,
-            'SELECT * FROM chat_updates\n' 
-            'WHERE shard = %(shard)s\n' 
-            'ORDER BY added DESC\n' 
-            'LIMIT 1',
-            dict(shard=config.SHARD_NUM),
-            raise_not_found=False,
-        )
-
-        if update.added.timestamp() > self.last_updated:
-            await self.bots.update_subscribe_chats()
-            await self.update()
-            self.last_updated = datetime.datetime.now().timestamp()
+                    self.logger.error('failed to %s chat %s: %s', action.lower(), chat.name, format_exception(e))
 
     async def loop(self):
         while True:
             try:
                 await asyncio.sleep(self.INTERVAL)
-                # todo: fix timezones issue
-                # await self.run_once()
-
                 await self.update()
             except Exception as e:
                 self.logger.error('failed to update chats. %s', format_exception(e, with_traceback=True))
@@ -138,7 +203,7 @@ class ChatsManager:
             assert bot_manager is not None  # fixme pufit
             _manager = cls(bot_manager)
 
-            await _manager.update()
+            await _manager.update(full=True)
             asyncio.create_task(_manager.loop())
             return
 
@@ -0,0 +1,235 @@
+import bisect
+import logging
+import sys
+import typing as tp
+from collections import defaultdict
+
+from vox_harbor.big_bot import structures
+from vox_harbor.common.config import config
+from vox_harbor.common.db_utils import ColumnarBlock, db_fetchall, session_scope
+
+MAX_MESSAGE_ID = sys.maxsize
+MIN_GAP = 3  # HistoryTask.DELTA, narrower gaps are what finished history tasks leave behind
+
+
+class IntervalSet:
+    """Disjoint closed intervals of integers, overlapping and adjacent intervals are merged."""
+
+    def __init__(self, intervals: tp.Iterable[tuple[int, int]] = ()):
+        self._lo: list[int] = []
+        self._hi: list[int] = []
+
+        for lo, hi in intervals:
+            self.add(lo, hi)
+
+    def add(self, lo: int, hi: int) -> None:
+        if lo > hi:
+            return
+
+        i = bisect.bisect_left(self._hi, lo - 1)
+        j = bisect.bisect_right(self._lo, hi + 1)
+        if i < j:
+            lo = min(lo, self._lo[i])
+            hi = max(hi, self._hi[j - 1])
+
+        self._lo[i:j] = [lo]
+        self._hi[i:j] = [hi]
+
+    def remove(self, lo: int, hi: int) -> None:
+        if lo > hi:
+            return
+
+        i = bisect.bisect_left(self._hi, lo)
+        j = bisect.bisect_right(self._lo, hi)
+        if i >= j:
+            return
+
+        rest_lo, rest_hi = [], []
+        if self._lo[i] < lo:
+            rest_lo.append(self._lo[i])
+            rest_hi.append(lo - 1)
+        if self._hi[j - 1] > hi:
+            rest_lo.append(hi + 1)
+            rest_hi.append(self._hi[j - 1])
+
+        self._lo[i:j] = rest_lo
+        self._hi[i:j] = rest_hi
+
+    def gaps(self, lo: int, hi: int) -> list[tuple[int, int]]:
+        """Sub-intervals of [lo, hi] not covered by the set."""
+        result = []
+
+        i = bisect.bisect_left(self._hi, lo)
+        while i < len(self._lo) and self._lo[i] <= hi:
+            if self._lo[i] > lo:
+                result.append((lo, self._lo[i] - 1))
+            lo = self._hi[i] + 1
+            i += 1
+
+        if lo <= hi:
+            result.append((lo, hi))
+
+        return result
+
+    def copy(self) -> 'IntervalSet':
+        result = IntervalSet()
+        result._lo, result._hi = self._lo.copy(), self._hi.copy()
+        return result
+
+    @property
+    def min(self) -> int:
+        return self._lo[0]
+
+    @property
+    def max(self) -> int:
+        return self._hi[-1]
+
+    def __contains__(self, value: int) -> bool:
+        i = bisect.bisect_right(self._lo, value) - 1
+        return i >= 0 and value <= self._hi[i]
+
+    def __iter__(self) -> tp.Iterator[tuple[int, int]]:
+        return zip(self._lo, self._hi)
+
+    def __len__(self) -> int:
+        return len(self._lo)
+
+    def __repr__(self) -> str:
+        return f'IntervalSet({list(self)})'
+
+
+def missing_history(
+    covered: IntervalSet, with_latest: bool = True, min_backfill_id: int = 1000, min_gap: int = MIN_GAP
+) -> list[tuple[int, int]]:
+    """`(start_id, end_id)` of history tasks that crawl what is not covered yet, newest first."""
+    if not covered:
+        return [(0, 0)]
+
+    ranges = []
+    if with_latest and covered.max < MAX_MESSAGE_ID:
+        ranges.append((0, covered.max))
+
+    for lo, hi in reversed(covered.gaps(covered.min, covered.max)):
+        if hi - lo + 1 >= min_gap:
+            ranges.append((hi + 1, lo - 1))
+
+    if covered.min > min_backfill_id:
+        ranges.append((covered.min, 0))
+
+    return ranges
+
+
+class CoverageIndex:
+    """
+    Message id ranges already crawled per chat, persisted in `history_coverage` as one row of merged
+    intervals per chat. Every save rewrites the whole set of a changed chat, older rows are merged away.
+    """
+
+    logger = logging.getLogger('vox_harbor.big_bot.coverage')
+
+    SEED_MAX_STEP = 100  # a history page, larger steps between stored comments are treated as holes
+
+    def __init__(self):
+        self._covered: defaultdict[int, IntervalSet] = defaultdict(IntervalSet)
+        self._dirty: set[int] = set()
+
+    def get(self, chat_id: int) -> IntervalSet:
+        return self._covered[chat_id].copy() if chat_id in self._covered else IntervalSet()
+
+    def record(self, chat_id: int, lo: int, hi: int) -> None:
+        self._covered[chat_id].add(lo, hi)
+        self._dirty.add(chat_id)
+
+    def record_live(self, chat_id: int, message_id: int) -> None:
+        """Only the message itself: updates missed in between are holes for history tasks to fill."""
+        self.record(chat_id, message_id, message_id)
+
+    def forget(self, chat_id: int, message_id: int) -> None:
+        """
+        For messages that were crawled but never stored. The hole is widened to MIN_GAP around the message,
+        so that `missing_history` doesn't skip it as a leftover of a finished task. Its neighbours are crawled
+        again, which stores nothing new.
+        """
+        if chat_id in self._covered:
+            lo = message_id - (MIN_GAP - 1) // 2
+            self._covered[chat_id].remove(lo, lo + MIN_GAP - 1)
+            self._dirty.add(chat_id)
+
+    async def load(self):
+        rows = await db_fetchall(
+            structures.HistoryCoverage,
+            'SELECT * FROM history_coverage FINAL WHERE shard = %(shard)s',
+            dict(shard=config.SHARD_NUM),
+            raise_not_found=False,
+        )
+
+        for row in rows:
+            self._covered[row.chat_id] = IntervalSet(zip(row.lo, row.hi))
+
+        self.logger.info('loaded coverage of %s chats', len(self._covered))
+        await self._seed()
+
+    async def _seed(self):
+        """
+        Chats of this shard crawled before the index existed are covered where their stored comments
+        are dense enough.
+        """
+        known = await db_fetchall(
+            structures.CommentRange,
+            'SELECT chat_id, min(min_message_id) AS min_message_id, max(max_message_id) AS max_message_id\n'
+            'FROM comments_range_mv\n'
+            'WHERE chat_id IN (SELECT id FROM chats FINAL WHERE shard = %(shard)s)\n'
+            'GROUP BY chat_id',
+            dict(shard=config.SHARD_NUM),
+            raise_not_found=False,
+        )
+        if not (chat_ids := [r.chat_id for r in known if r.chat_id not in self._covered]):
+            return
+
+        ranges = await db_fetchall(
+            structures.CoverageRange,
+            """--sql
+            SELECT chat_id, min(message_id) AS lo, max(message_id) AS hi
+            FROM (
+                SELECT chat_id, message_id, sum(step > %(max_step)s) OVER (
+                    PARTITION BY chat_id ORDER BY message_id ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
+                ) AS island
+                FROM (
+                    SELECT chat_id, message_id, message_id - lagInFrame(message_id, 1, message_id) OVER (
+                        PARTITION BY chat_id ORDER BY message_id ROWS BETWEEN 1 PRECEDING AND CURRENT ROW
+                    ) AS step
+                    FROM (SELECT DISTINCT chat_id, message_id FROM comments WHERE chat_id IN %(chat_ids)s)
+                )
+            )
+            GROUP BY chat_id, island
+            """,
+            dict(chat_ids=chat_ids, max_step=self.SEED_MAX_STEP),
+            raise_not_found=False,
+        )
+
+        for r in ranges:
+            self.record(r.chat_id, r.lo, r.hi)
+
+        self.logger.info('seeded coverage of %s chats from stored comments', len({r.chat_id for r in ranges}))
+
+    async def save(self):
+        dirty, self._dirty = self._dirty, set()
+
+        block = ColumnarBlock('history_coverage', structures.HistoryCoverage.model_fields)
+        for chat_id in dirty:
+            intervals = list(self._covered[chat_id])
+            block.append(chat_id, [lo for lo, _ in intervals], [hi for _, hi in intervals], config.SHARD_NUM)
+
+        if not block:
+            return
+
+        try:
+            async with session_scope() as session:
+                session.set_settings(dict(async_insert=True))
+                await session.insert_block(block)
+        except Exception:
+            self._dirty |= dirty
+            raise
+
+
+coverage = CoverageIndex()
@@ -1,7 +1,10 @@
 import asyncio
 import collections
+import contextlib
 import datetime
 import logging
+from pathlib import Path
+
 import cachetools
 
 from pyrogram import enums, raw, types, utils
@@ -9,105 +12,218 @@ from pyrogram import enums, raw, types, utils
 import vox_harbor.big_bot
 from vox_harbor.big_bot import structures
 from vox_harbor.big_bot.chats import ChatsManager
+from vox_harbor.big_bot.coverage import coverage
+from vox_harbor.big_bot.spill import SpillBuffer
+from vox_harbor.big_bot.top_messages import TopMessage
 from vox_harbor.common.config import config
-from vox_harbor.common.db_utils import session_scope
+from vox_harbor.common.db_utils import ColumnarBlock, session_scope
 from vox_harbor.common.exceptions import format_exception
+from vox_harbor.common.metrics import counter, gauge, histogram
 
 logger = logging.getLogger('vox_harbor.handlers')
+
+flush_duration = histogram('vox_harbor_inserter_flush_duration_seconds', 'Block inserts per table.', ('table',))
+flushed_rows = counter('vox_harbor_inserter_flushed_rows_total', 'Rows inserted per table.', ('table',))
+failed_rows = counter(
+    'vox_harbor_inserter_failed_rows_total', 'Rows that failed to insert, spilled or dropped, per table.', ('table',)
+)
 lock = asyncio.Lock()
 
 media_cache = cachetools.TTLCache(maxsize=10_000, ttl=300)
 
 
 class BlockInserter:
-    BLOCK_SIZE = 10000
-    BLOCK_TTL = 10
+    BLOCK_SIZE = 10000  # rows in any table
+    BLOCK_BYTES = 16 * 2**20  # estimated size of all tables, checked every BYTES_CHECK_ROWS
+    BYTES_CHECK_ROWS = 1000
+    BLOCK_TTL = 10  # seconds since the last flush
+    MAX_BLOCK_SIZE = 5 * BLOCK_SIZE  # producers wait for a flush beyond this
+
+    REPLAY_INTERVAL = 5
+    MAX_REPLAY_INTERVAL = 300
+
+    POST_SNAPSHOTS = 100_000  # last written snapshot per post
+    VIEWS_THRESHOLD = 0.01
+    KEYFRAME_EVERY = 10
 
     def __init__(self):
-        self.comments = []
-        self.users = []
-        self.chats = []
-        self.posts = []
+        self.comments = ColumnarBlock(
+            'comments', ('user_id', 'date', 'chat_id', 'message_id', 'channel_id', 'post_id', 'bot_index', 'shard')
+        )
+        self.users = ColumnarBlock('users', ('user_id', 'username', 'name'))
+        self.chats = ColumnarBlock('discovered_chats', ('id', 'name', 'join_string', 'subscribers_count', 'sign'))
+        self.posts = ColumnarBlock(
+            'posts', ('id', 'channel_id', 'post_date', 'point_date', 'data.key', 'data.value', 'bot_index', 'shard')
+        )
+        self.message_texts = ColumnarBlock('message_texts', ('chat_id', 'message_id', 'text', 'chat'))
 
         self.lock = asyncio.Lock()
         self.last_flush = datetime.datetime.now()
 
+        self._has_space = asyncio.Condition(self.lock)
+        self._flush_needed = asyncio.Event()
+
+        self.spill: SpillBuffer | None = None
+
+        self.post_snapshots: cachetools.LRUCache[tuple[int, int], tuple[dict[str, int], int]] = cachetools.LRUCache(
+            self.POST_SNAPSHOTS
+        )
+        self.skipped_post_snapshots = 0
+
+    @property
+    def blocks(self) -> tuple[ColumnarBlock, ...]:
+        return self.comments, self.users, self.chats, self.posts, self.message_texts
+
+    @property
+    def buffered_rows(self) -> int:
+        return max(map(len, self.blocks))
+
+    @property
+    def buffered_bytes(self) -> int:
+        return sum(block.nbytes for block in self.blocks)
+
+    async def _wait_for_space(self, block: ColumnarBlock):
+        """Backpressure for producers, must be called under `self.lock`."""
+        while len(block) >= self.MAX_BLOCK_SIZE:
+            self._flush_needed.set()
+            await self._has_space.wait()
+
+    def _append(self, block: ColumnarBlock, *row):
+        block.append(*row)
+
+        rows = len(block)
+        if rows >= self.BLOCK_SIZE or (rows % self.BYTES_CHECK_ROWS == 0 and self.buffered_bytes >= self.BLOCK_BYTES):
+            self._flush_needed.set()
+
     async def flush(self):
         async with self.lock:
-            block_comments = self.comments.copy()
-            block_users = self.users.copy()
-            block_chats = self.chats.copy()
-            block_posts = self.posts.copy()
-            self.comments.clear()
-            self.users.clear()
-            self.chats.clear()
-            self.posts.clear()
-
-        async with session_scope() as session:
-            count = len(block_comments)
-            session.set_settings(dict(async_insert=True))
-            if block_comments:
-                await session.execute('INSERT INTO comments VALUES', block_comments)
-
-            if block_users:
-                await session.execute('INSERT INTO users VALUES', block_users)
-
-            if block_chats:
-                await session.execute('INSERT INTO discovered_chats VALUES', block_chats)
-
-            if block_posts:
-                await session.execute('INSERT INTO posts VALUES', block_posts)
-
+            blocks = [block.take() for block in self.blocks]
             self.last_flush = datetime.datetime.now()
-            logger.info('flushed %s records', count)
+            self._flush_needed.clear()
+            self._has_space.notify_all()
+
+        blocks = [block for block in blocks if block]
+        results = await asyncio.gather(*(self._insert_block(block) for block in blocks), return_exceptions=True)
+
+        for block, result in zip(blocks, results):
+            if not isinstance(result, Exception):
+                flushed_rows.inc(len(block), table=block.table)
+                logger.info('flushed %s records into %s', len(block), block.table)
+                continue
+
+            failed_rows.inc(len(block), table=block.table)
+            logger.error('failed to insert %s rows into %s: %s', len(block), block.table, format_exception(result))
+            if self.spill is not None and await asyncio.to_thread(self.spill.write, block):
+                logger.info('spilled %s rows of %s to disk', len(block), block.table)
+            elif block.table == self.comments.table:
+                self._forget_coverage(block)
+
+    @staticmethod
+    def _forget_coverage(block: ColumnarBlock):
+        """Lost comments are not crawled history, leaves them to history tasks."""
+        chat_ids, message_ids = (block.data[block.columns.index(column)] for column in ('chat_id', 'message_id'))
+        for chat_id, message_id in zip(chat_ids, message_ids):
+            coverage.forget(chat_id, message_id)
+
+    @staticmethod
+    async def _insert_block(block: ColumnarBlock):
+        with flush_duration.time(table=block.table):
+            async with session_scope() as session:
+                session.set_settings(dict(async_insert=True))
+                await session.insert_block(block)
 
     async def loop(self):
         while True:
             try:
+                timeout = self.BLOCK_TTL - (datetime.datetime.now() - self.last_flush).total_seconds()
+                with contextlib.suppress(TimeoutError):
+                    await asyncio.wait_for(self._flush_needed.wait(), max(timeout, 0))
+
                 await self.flush()
-                await asyncio.sleep(self.BLOCK_TTL)
             except Exception as e:
                 logger.error('failed to flush a block: %s', format_exception(e, with_traceback=True))
+                await asyncio.sleep(1)
+
+    async def replay_loop(self):
+        delay = self.REPLAY_INTERVAL
+
+        while True:
+            await asyncio.sleep(delay)
+            if not self.spill.pending:
+                continue
+
+            try:
+                await self.spill.replay(self._insert_block)
+                delay = self.REPLAY_INTERVAL
+            except Exception as e:
+                delay = min(delay * 2, self.MAX_REPLAY_INTERVAL)
+                logger.warning('failed to replay spilled blocks, next attempt in %ss: %s', delay, format_exception(e))
 
     def start(self):
+        self.spill = SpillBuffer(Path(config.SPILL_PATH) / f'shard_{config.SHARD_NUM}', config.SPILL_MAX_BYTES)
+
         asyncio.create_task(self.loop())
+        asyncio.create_task(self.replay_loop())
 
     async def insert(self, message: types.Message, bot_index: int, channel_id: int | None, post_id: int | None):
+        user = message.from_user
+        name = ' '.join(filter(None, (user.first_name, user.last_name)))
+        date = message.date.astimezone(datetime.timezone.utc)
+
         async with self.lock:
-            self.comments.append(
-                structures.Comment(
-                    user_id=message.from_user.id,
-                    date=message.date.astimezone(datetime.timezone.utc),
-                    chat_id=message.chat.id,
-                    message_id=message.id,
-                    channel_id=channel_id,
-                    post_id=post_id,
-                    bot_index=bot_index,
-                    shard=config.SHARD_NUM,
-                ).model_dump()
+            await self._wait_for_space(self.comments)
+            self._append(
+                self.comments,
+                user.id,
+                date,
+                message.chat.id,
+                message.id,
+                channel_id,
+                post_id,
+                bot_index,
+                config.SHARD_NUM,
             )
+            self._append(self.users, user.id, user.username or '', name)
 
-            name = ' '.join(filter(None, (message.from_user.first_name, message.from_user.last_name)))
-            self.users.append(
-                structures.User(
-                    user_id=message.from_user.id,
-                    username=message.from_user.username or '',
-                    name=name,
-                ).model_dump()
-            )
+            if config.STORE_MESSAGE_TEXTS:
+                text = message.text or message.caption
+                text = text and text[: config.MESSAGE_TEXT_MAX_LENGTH]
+                self._append(self.message_texts, message.chat.id, message.id, text, message.chat.title)
 
     async def insert_chat(self, chat: types.Chat):
+        name = chat.title or ' '.join((chat.first_name, chat.last_name))
+
+        async with self.lock:
+            await self._wait_for_space(self.chats)
+            self._append(self.chats, chat.id, name, chat.username or '', chat.members_count or 0, 1)
+
+    async def insert_message_texts(self, texts: list[structures.MessageText]):
         async with self.lock:
-            self.chats.append(
-                structures.DiscoveredChat(
-                    id=chat.id,
-                    name=chat.title or ' '.join((chat.first_name, chat.last_name)),
-                    join_string=chat.username,
-                    subscribers_count=chat.members_count,
-                    sign=1,
-                ).model_dump()
+            await self._wait_for_space(self.message_texts)
+            for text in texts:
+                self._append(self.message_texts, text.chat_id, text.message_id, text.text, text.chat)
+
+    def _post_changed(self, channel_id: int, post_id: int, data: dict[str, int]) -> bool:
+        """
+        Compares a snapshot with the last written one. Views count as changed beyond VIEWS_THRESHOLD,
+        any other value on any change. Every KEYFRAME_EVERY-th snapshot in a row is written anyway.
+        """
+        key = channel_id, post_id
+        if (last := self.post_snapshots.get(key)) is not None:
+            last_data, skipped = last
+            changed = last_data.keys() != data.keys() or any(
+                abs(value - last_data[k]) > (last_data[k] * self.VIEWS_THRESHOLD if k == '@views' else 0)
+                for k, value in data.items()
             )
 
+            if not changed and skipped + 1 < self.KEYFRAME_EVERY:
+                self.post_snapshots[key] = last_data, skipped + 1
+                self.skipped_post_snapshots += 1
+                return False
+
+        self.post_snapshots[key] = dict(data), 0
+        return True
+
     async def insert_post(self, post: types.Message, bot_index: int):
         data = collections.defaultdict(int)
         data['@views'] = post.views or 0
@@ -133,25 +249,54 @@ class BlockInserter:
                 for option in post.poll.options:
                     data[f'@option_{option.text}'] = option.voter_count
 
+        if not self._post_changed(post.chat.id, post.id, data):
+            return
+
         async with self.lock:
-            post_json = structures.Post(
-                id=post.id,
-                channel_id=post.chat.id,
-                post_date=post.date.astimezone(datetime.timezone.utc),
-                bot_index=bot_index,
-                shard=config.SHARD_NUM,
-                point_date=datetime.datetime.utcnow(),
-                keys=list(data.keys()),
-                values=list(data.values()),
-            ).model_dump()
+            await self._wait_for_space(self.posts)
+            self._append(
+                self.posts,
+                post.id,
+                post.chat.id,
+                post.date.astimezone(datetime.timezone.utc),
+                datetime.datetime.utcnow(),
+                list(data.keys()),
+                list(data.values()),
+                bot_index,
+                config.SHARD_NUM,
+            )
 
-            post_json['data.key'] = post_json.pop('keys')
-            post_json['data.value'] = post_json.pop('values')
 
-            self.posts.append(post_json)
+async def process_chat_member_updated(bot: 'vox_harbor.big_bot.bots.Bot', update: types.ChatMemberUpdated):
+    member = update.new_chat_member or update.old_chat_member
+    if member is None or member.user is None or not member.user.is_self:
+        return
+
+    new_member = update.new_chat_member
+    if new_member is None or new_member.status in (enums.ChatMemberStatus.LEFT, enums.ChatMemberStatus.BANNED):
+        bot.remove_subscribed_chat(update.chat.id)
+    elif new_member.status != enums.ChatMemberStatus.RESTRICTED or new_member.is_member:
+        bot.add_subscribed_chat(update.chat.id)
+
+
+async def process_live_message(bot: 'vox_harbor.big_bot.bots.Bot', message: types.Message):
+    await process_message(bot, message)
+    coverage.record_live(message.chat.id, message.id)
+
 
+async def process_message(
+    bot: 'vox_harbor.big_bot.bots.Bot',
+    message: types.Message,
+    top_messages: dict[int, TopMessage] | None = None,
+):
+    """`top_messages` are already resolved reply tops of the message's chat by id, see HistoryTask."""
+    if message.left_chat_member and message.left_chat_member.is_self:
+        bot.remove_subscribed_chat(message.chat.id)
+        return
+
+    if message.new_chat_members and any(user.is_self for user in message.new_chat_members):
+        bot.add_subscribed_chat(message.chat.id)
 
-async def process_message(bot: 'vox_harbor.big_bot.bots.Bot', message: types.Message):
     if message.chat.id not in await bot.get_subscribed_chats():
         logger.info('durov moment for chat %s bot %s', message.chat.id, bot.index)
         return
@@ -202,13 +347,16 @@ async def process_message(bot: 'vox_harbor.big_bot.bots.Bot', message: types.Mes
 
         return
 
+    if message.is_automatic_forward:
+        bot.top_messages.remember(message)
+
     channel_id = None
     post_id = None
-    if message.reply_to_top_message_id:
-        top_message = await bot.get_message_witch_cache(message.chat.id, message.reply_to_top_message_id)
-        if top_message.sender_chat and top_message.sender_chat.type == enums.ChatType.CHANNEL:
-            channel_id = top_message.sender_chat.id
-            post_id = top_message.forward_from_message_id
+    if top_id := message.reply_to_top_message_id:
+        if top_messages is None or (top := top_messages.get(top_id)) is None:
+            top = await bot.top_messages.get(message.chat.id, top_id)
+
+        channel_id, post_id = top
 
     if not message.from_user:
         # anon user
@@ -224,3 +372,20 @@ async def channel_confirmation_handler(client: 'vox_harbor.big_bot.bots.Bot', up
 
 
 inserter = BlockInserter()
+
+gauge(
+    'vox_harbor_inserter_buffered_rows',
+    'Rows waiting for the next flush per table.',
+    ('table',),
+    collect=lambda: {(block.table,): len(block) for block in inserter.blocks},
+)
+gauge(
+    'vox_harbor_inserter_buffered_bytes',
+    'Estimated size of all buffered rows.',
+    collect=lambda: {(): inserter.buffered_bytes},
+)
+gauge(
+    'vox_harbor_inserter_spilled_bytes',
+    'Blocks spilled to disk, waiting for a replay.',
+    collect=lambda: {} if inserter.spill is None else {(): inserter.spill.size},
+)
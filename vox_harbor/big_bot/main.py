@@ -1,13 +1,15 @@
 import asyncio
 import logging
 
-from pyrogram.handlers import MessageHandler, RawUpdateHandler
+from pyrogram.handlers import ChatMemberUpdatedHandler, MessageHandler, RawUpdateHandler
 
 from vox_harbor.big_bot import handlers
 from vox_harbor.big_bot.bots import BotManager
 from vox_harbor.big_bot.chats import ChatsManager
+from vox_harbor.big_bot.coverage import coverage
 from vox_harbor.big_bot.posts import PostManager
 from vox_harbor.big_bot.tasks import TaskManager
+from vox_harbor.common.exceptions import format_exception
 from vox_harbor.services.shard import main as shard_main
 
 logger = logging.getLogger('vox_harbor.big_bot.main')
@@ -29,10 +31,12 @@ async def generate_tasks():
 
 async def big_bots_main():
     handlers.inserter.start()
+    await TaskManager.get_instance()  # doesn't start without history checkpoints and coverage
     manager = await BotManager.get_instance()
 
     manager.register_handler(RawUpdateHandler(handlers.channel_confirmation_handler), 0)
-    manager.register_handler(MessageHandler(handlers.process_message), 1)
+    manager.register_handler(MessageHandler(handlers.process_live_message), 1)
+    manager.register_handler(ChatMemberUpdatedHandler(handlers.process_chat_member_updated), 2)
 
     await manager.start()
 
@@ -45,5 +49,16 @@ async def big_bots_main():
         await shard_main()
 
     finally:
+        try:
+            tasks = await TaskManager.get_instance()
+            await tasks.save_checkpoints(all_tasks=True)
+        except Exception as e:
+            logger.error('failed to save history checkpoints: %s', format_exception(e))
+
+        try:
+            await coverage.save()
+        except Exception as e:
+            logger.error('failed to save history coverage: %s', format_exception(e))
+
         await manager.stop()
 
@@ -1,22 +1,45 @@
 import asyncio
 import datetime
+import heapq
 import logging
+import time
+from collections import defaultdict
 
 import vox_harbor.big_bot
 from vox_harbor.big_bot import structures
 from vox_harbor.big_bot.handlers import inserter
 from vox_harbor.common.config import config
-from vox_harbor.common.db_utils import db_fetchall, db_fetchone
+from vox_harbor.common.db_utils import db_fetchall
 from vox_harbor.common.exceptions import format_exception
 
 
 class PostManager:
+    """
+    Polls reactions of recent channel posts. Posts are kept in a heap by the time their next snapshot is due,
+    so each tick only touches due posts. Posts older than MAX_AGE are evicted.
+    """
+
     logger = logging.getLogger('vox_harbor.big_bot.posts')
 
+    TICK = 5
+    DISCOVER_INTERVAL = 30
+    FULL_DISCOVER_INTERVAL = 60 * 60
+    DISCOVER_OVERLAP = 5 * 60  # seconds, covers posts that reach ClickHouse late
+    MAX_AGE = datetime.timedelta(days=3)
+    BATCH_SIZE = 100  # ids per get_messages call
+
     def __init__(self, bots: 'vox_harbor.big_bot.bots.BotManager'):
-        self._last_post_point = {}
         self.bots = bots
 
+        self._posts: dict[tuple[int, int], structures.NewPost] = {}
+        self._schedule: list[tuple[datetime.datetime, int, int]] = []  # (due, channel_id, id)
+
+        self._last_discovered: float | None = None
+        self._last_full_discovered: float | None = None
+
+        self.calls = 0
+        self.polled_posts = 0
+
     @staticmethod
     def _get_update_interval(post_date: datetime.datetime) -> int:
         delta = datetime.datetime.utcnow() - post_date
@@ -29,60 +52,136 @@ class PostManager:
 
         return 3600
 
-    async def process_post(self, post: structures.NewPost):
-        if not (last_updated := self._last_post_point.get(post.id)):
-            point: structures.Post = await db_fetchone(
-                structures.Post,
-                'SELECT id, channel_id, post_date, point_date, `data.key` as keys, `data.value` as values, bot_index, shard\n'
-                'FROM posts WHERE id = %(id)s ORDER BY point_date DESC LIMIT 1',
-                dict(id=post.id),
-                raise_not_found=False
+    def _schedule_post(self, post: structures.NewPost, last_updated: datetime.datetime):
+        due = last_updated + datetime.timedelta(seconds=self._get_update_interval(post.post_date))
+        heapq.heappush(self._schedule, (due, post.channel_id, post.id))
+
+    async def discover(self):
+        """Starts tracking posts that appeared since the previous discovery, all recent ones once an hour."""
+        started = time.monotonic()
+        full = self._last_full_discovered is None or started - self._last_full_discovered > self.FULL_DISCOVER_INTERVAL
+
+        since = int(self.MAX_AGE.total_seconds())
+        if not full:
+            assert self._last_discovered is not None
+            since = min(since, int(started - self._last_discovered) + self.DISCOVER_OVERLAP)
+
+        posts = await db_fetchall(
+            structures.NewPost,
+            'SELECT * FROM new_posts_mv\n'
+            'WHERE post_date > now() - INTERVAL %(since)s SECOND\n'
+            'AND shard = %(shard)s',
+            dict(since=since, shard=config.SHARD_NUM),
+            raise_not_found=False,
+        )
+
+        new_posts = {(p.channel_id, p.id): p for p in posts if (p.channel_id, p.id) not in self._posts}
+        if new_posts:
+            points = await db_fetchall(
+                structures.PostPoint,
+                'SELECT id, channel_id, max(point_date) AS point_date FROM posts\n'
+                'WHERE shard = %(shard)s AND (channel_id, id) IN %(keys)s\n'
+                'GROUP BY channel_id, id',
+                dict(shard=config.SHARD_NUM, keys=list(new_posts)),
+                raise_not_found=False,
             )
+            last_updated = {(p.channel_id, p.id): p.point_date for p in points}
 
-            if not point:
-                self.logger.critical('logical error: projection record is absense in the original table')
-                return
+            for key, post in new_posts.items():
+                if key not in last_updated:
+                    self.logger.critical('logical error: projection record is absense in the original table')
+                    continue
 
-            last_updated = point.point_date
-            self._last_post_point[post.id] = last_updated
+                self._posts[key] = post
+                self._schedule_post(post, last_updated[key])
 
-        if datetime.datetime.utcnow() - last_updated > datetime.timedelta(seconds=self._get_update_interval(post.post_date)):
-            bot = self.bots[post.bot_index]
+        self._last_discovered = started
+        if full:
+            self._last_full_discovered = started
 
-            if post.channel_id not in await bot.get_subscribed_chats():
-                return
+        self.logger.info('discovered %s new posts, tracking %s', len(new_posts), len(self._posts))
 
-            try:
-                message = await bot.get_messages(chat_id=post.channel_id, message_ids=post.id)
-                if not message or not message.chat:
-                    self._last_post_point[post.id] = datetime.datetime.utcnow()  # post was deleted
-                    return
+    def pop_due(self, now: datetime.datetime) -> list[structures.NewPost]:
+        """Due posts in order, expired ones are evicted instead."""
+        due = []
+        while self._schedule and self._schedule[0][0] <= now:
+            _, channel_id, post_id = heapq.heappop(self._schedule)
+            if (post := self._posts.get((channel_id, post_id))) is None:
+                continue
+
+            if now - post.post_date > self.MAX_AGE:
+                del self._posts[channel_id, post_id]
+                continue
 
-                await inserter.insert_post(message, bot.index)
-                self._last_post_point[post.id] = datetime.datetime.utcnow()
+            due.append(post)
+
+        return due
+
+    async def process_posts(self, bot_index: int, channel_id: int, posts: list[structures.NewPost]):
+        """Snapshots posts of one channel with a single `get_messages` call per BATCH_SIZE posts."""
+        bot = self.bots[bot_index]
+
+        for i in range(0, len(posts), self.BATCH_SIZE):
+            batch = posts[i : i + self.BATCH_SIZE]
+
+            try:
+                if channel_id in await bot.get_subscribed_chats():
+                    messages = await bot.get_messages(chat_id=channel_id, message_ids=[p.id for p in batch])
+                    self.calls += 1
+                    self.polled_posts += len(batch)
+
+                    for message in messages:
+                        if message and message.chat:  # otherwise the post was deleted
+                            await inserter.insert_post(message, bot.index)
             except Exception as e:
-                self.logger.error('unable to process a post %s: %s', post, format_exception(e, with_traceback=True))
+                self.logger.error(
+                    'unable to process %s posts of channel %s: %s',
+                    len(batch),
+                    channel_id,
+                    format_exception(e, with_traceback=True),
+                )
+
+            now = datetime.datetime.utcnow()
+            for post in batch:
+                self._schedule_post(post, now)
+
+    @property
+    def posts_per_call(self) -> float:
+        return self.polled_posts / self.calls if self.calls else 0.0
+
+    def stats(self) -> structures.PostPollingStats:
+        return structures.PostPollingStats(
+            tracked=len(self._posts), calls=self.calls, polled_posts=self.polled_posts, posts_per_call=self.posts_per_call
+        )
 
     async def run_once(self):
-        new_posts = await db_fetchall(
-            structures.NewPost,
-            'SELECT * FROM new_posts_mv\n'
-            'WHERE post_date > now() - INTERVAL 3 DAY\n'
-            'AND shard = %(shard)s',
-            dict(shard=config.SHARD_NUM),
-            raise_not_found=False,
-        )
+        if self._last_discovered is None or time.monotonic() - self._last_discovered > self.DISCOVER_INTERVAL:
+            await self.discover()
+
+        due = self.pop_due(datetime.datetime.utcnow())
 
-        await asyncio.gather(*(self.process_post(post) for post in new_posts))
-        self.logger.info('processed %s posts', len(new_posts))
+        by_channel: defaultdict[tuple[int, int], list[structures.NewPost]] = defaultdict(list)
+        for post in due:
+            by_channel[post.bot_index, post.channel_id].append(post)
+
+        await asyncio.gather(*(self.process_posts(*key, posts) for key, posts in by_channel.items()))
+
+        if due:
+            self.logger.info(
+                'processed %s posts of %s channels, %.1f posts per call so far',
+                len(due),
+                len(by_channel),
+                self.posts_per_call,
+            )
 
     async def loop(self):
         while True:
             try:
                 await self.run_once()
-                await asyncio.sleep(30)
+                await asyncio.sleep(self.TICK)
             except Exception as e:
                 self.logger.error('failed in post manager loop %s', format_exception(e, with_traceback=True))
+                await asyncio.sleep(self.TICK)
 
     def start(self):
         asyncio.create_task(self.loop())
@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import os
+import pickle
+import struct
+import threading
+import time
+import typing as tp
+import zlib
+from pathlib import Path
+
+from vox_harbor.common.db_utils import ColumnarBlock
+
+
+class CorruptedRecord(Exception):
+    pass
+
+
+class SpillBuffer:
+    """
+    Durable append-only segments for blocks that failed to reach ClickHouse.
+
+    Each record is `<length:u32><crc32:u32><zlib(pickle((table, columns, data)))>`.
+    Replay progress within a segment is kept in a `.offset` sidecar, so a partially
+    replayed segment is never inserted twice. Writes beyond `max_bytes` are dropped.
+
+    A record cut off by the end of the segment is a torn write and is ignored. A corrupted record
+    in the middle makes the segment quarantined (renamed to `.corrupt`, with its sidecar left
+    at the corrupted record) instead of deleted, so the records after it can be recovered by hand.
+    """
+
+    logger = logging.getLogger('vox_harbor.big_bot.spill')
+
+    HEADER = struct.Struct('<II')
+    SEGMENT_SIZE = 16 * 2**20
+    SUFFIX = '.seg'
+    QUARANTINE_SUFFIX = '.corrupt'
+
+    def __init__(self, path: str | Path, max_bytes: int):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+        self.spilled_rows = 0
+        self.replayed_rows = 0
+        self.dropped_rows = 0
+
+        self._lock = threading.Lock()
+        self._active: Path | None = None
+        self._seq = 0
+        self._size = sum(p.stat().st_size for p in self.path.glob(f'*{self.SUFFIX}'))
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def pending(self) -> bool:
+        return any(self.path.glob(f'*{self.SUFFIX}'))
+
+    def write(self, block: ColumnarBlock) -> bool:
+        """Appends a block to the active segment. Returns False if it was dropped due to the quota."""
+        payload = zlib.compress(pickle.dumps((block.table, block.columns, block.data), pickle.HIGHEST_PROTOCOL), 3)
+        record = self.HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+        with self._lock:
+            if self._size + len(record) > self.max_bytes:
+                self.dropped_rows += len(block)
+                self.logger.error(
+                    'spill quota exceeded (%s bytes), dropping %s rows of %s', self.max_bytes, len(block), block.table
+                )
+                return False
+
+            if self._active is None or self._active.stat().st_size >= self.SEGMENT_SIZE:
+                self._active = self._new_segment()
+
+            with open(self._active, 'ab') as f:
+                f.write(record)
+                f.flush()
+                os.fsync(f.fileno())
+
+            self._size += len(record)
+            self.spilled_rows += len(block)
+
+        return True
+
+    def _new_segment(self) -> Path:
+        self._seq += 1
+        path = self.path / f'{time.time_ns():020d}_{self._seq:06d}{self.SUFFIX}'
+        path.touch()
+        return path
+
+    def _seal(self) -> list[Path]:
+        """Closes the active segment for writes and returns all segments, oldest first."""
+        with self._lock:
+            self._active = None
+            return sorted(self.path.glob(f'*{self.SUFFIX}'))
+
+    @staticmethod
+    def _offset_path(segment: Path) -> Path:
+        return segment.with_suffix('.offset')
+
+    def _read_offset(self, segment: Path) -> int:
+        try:
+            return int(self._offset_path(segment).read_text())
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _write_offset(self, segment: Path, offset: int) -> None:
+        tmp = self._offset_path(segment).with_suffix('.tmp')
+        tmp.write_text(str(offset))
+        os.replace(tmp, self._offset_path(segment))
+
+    def _read_record(self, segment: Path, offset: int) -> tuple[ColumnarBlock, int] | None:
+        """Returns the record at `offset` and the next offset, None at the end of the segment or at a torn tail."""
+        with open(segment, 'rb') as f:
+            f.seek(offset)
+            header = f.read(self.HEADER.size)
+            if not header:
+                return None
+
+            if len(header) < self.HEADER.size:
+                self.logger.warning('torn record at the end of %s at offset %s, ignoring it', segment.name, offset)
+                return None
+
+            length, crc = self.HEADER.unpack(header)
+            payload = f.read(length)
+
+        if len(payload) < length:
+            self.logger.warning('torn record at the end of %s at offset %s, ignoring it', segment.name, offset)
+            return None
+
+        try:
+            if zlib.crc32(payload) != crc:
+                raise ValueError('checksum mismatch')
+
+            table, columns, data = pickle.loads(zlib.decompress(payload))
+        except Exception as e:
+            raise CorruptedRecord(f'{segment.name} at offset {offset}: {e}') from e
+
+        block = ColumnarBlock(table, columns)
+        block.data = data
+        return block, offset + self.HEADER.size + length
+
+    def _remove(self, segment: Path) -> None:
+        with self._lock:
+            self._size -= segment.stat().st_size
+            segment.unlink()
+            self._offset_path(segment).unlink(missing_ok=True)
+
+    def _quarantine(self, segment: Path) -> None:
+        with self._lock:
+            self._size -= segment.stat().st_size
+            segment.rename(segment.with_suffix(self.QUARANTINE_SUFFIX))
+
+    async def replay(self, insert: tp.Callable[[ColumnarBlock], tp.Awaitable[tp.Any]]) -> int:
+        """
+        Re-inserts spilled blocks oldest first and deletes fully replayed segments.
+        Stops at the first failed insert, which is propagated to the caller.
+        """
+        replayed = 0
+
+        for segment in await asyncio.to_thread(self._seal):
+            offset = await asyncio.to_thread(self._read_offset, segment)
+
+            try:
+                while record := await asyncio.to_thread(self._read_record, segment, offset):
+                    block, offset = record
+                    await insert(block)
+                    await asyncio.to_thread(self._write_offset, segment, offset)
+
+                    replayed += len(block)
+                    self.replayed_rows += len(block)
+            except CorruptedRecord as e:
+                self.logger.error('corrupted spill record in %s, quarantining the segment', e)
+                await asyncio.to_thread(self._quarantine, segment)
+                continue
+
+            await asyncio.to_thread(self._remove, segment)
+
+        if replayed:
+            self.logger.info('replayed %s spilled rows', replayed)
+
+        return replayed
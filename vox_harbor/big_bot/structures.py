@@ -81,12 +81,50 @@ class Comment(_Base):
         return vars(self) == vars(other)
 
 
+class CommentsPage(pydantic.BaseModel):
+    comments: list[Comment]
+    next_cursor: str | None
+
+
+class ExportEnd(pydantic.BaseModel):
+    """Last line of an export. Without it, or with an error, the export is incomplete."""
+
+    rows: int
+    error: str | None = None
+
+
 class CommentRange(_Base):
     chat_id: int
     min_message_id: int
     max_message_id: int
 
 
+class HistoryCheckpoint(_Base):
+    task_id: str
+    chat_id: int
+    start_id: int
+    end_id: int
+    current_offset: int
+    priority: int
+    finished: bool
+
+    shard: int
+    bot_index: int
+
+
+class HistoryCoverage(_Base):
+    chat_id: int
+    lo: list[int]
+    hi: list[int]
+    shard: int
+
+
+class CoverageRange(_Base):
+    chat_id: int
+    lo: int
+    hi: int
+
+
 class Message(pydantic.BaseModel):
     text: str | None
     chat: str | None = None
@@ -97,6 +135,14 @@ class Message(pydantic.BaseModel):
         return self.text == other.text and self.comment == other.comment
 
 
+class MessageText(_Base):
+    chat_id: int
+    message_id: int
+
+    text: str | None
+    chat: str | None
+
+
 class User(_Base):
     user_id: int
     username: tp.Optional[str]
@@ -155,6 +201,12 @@ class NewPost(_Base):
     shard: int
 
 
+class PostPoint(_Base):
+    id: int
+    channel_id: int
+    point_date: datetime.datetime
+
+
 class Post(NewPost):
     point_date: datetime.datetime
     keys: list[str]
@@ -197,6 +249,18 @@ class PostText(pydantic.BaseModel):
     text: tp.Optional[str]
 
 
+class SearchQuery(pydantic.BaseModel):
+    class Kind(enum.StrEnum):
+        ID = 'ID'
+        MSG_URL = 'MSG_URL'
+        CHAT_URL = 'CHAT_URL'
+        NAME = 'NAME'
+
+    kind: Kind
+    text: str
+    id: int | None = None
+
+
 class UsersAndChats(pydantic.BaseModel):
     users: list[UserInfo]
     chats: list[Chat]
@@ -204,3 +268,37 @@ class UsersAndChats(pydantic.BaseModel):
 
 class CommentCount(_Base):
     comment_count: int
+
+
+class ShardClientStats(pydantic.BaseModel):
+    shard: int
+    requests: int
+    connections: int
+    reused: int
+
+
+class CacheStats(pydantic.BaseModel):
+    name: str
+    size: int
+    hits: int
+    misses: int
+    coalesced: int
+
+
+class TaskGroupStats(pydantic.BaseModel):
+    group: int
+    queued: int = 0
+    in_flight: int = 0
+    steps: int = 0
+    errors: int = 0
+    finished: int = 0
+    processed: int = 0
+    steps_per_second: float = 0.0
+    processed_per_second: float = 0.0
+
+
+class PostPollingStats(pydantic.BaseModel):
+    tracked: int
+    calls: int
+    polled_posts: int
+    posts_per_call: float
@@ -1,10 +1,22 @@
 import abc
 import asyncio
+import enum
+import itertools
 import logging
+import time
+import typing as tp
+from collections import defaultdict
+
+from pyrogram import types
 
 import vox_harbor.big_bot
+from vox_harbor.big_bot import structures
+from vox_harbor.big_bot.coverage import MAX_MESSAGE_ID, coverage
 from vox_harbor.big_bot.handlers import process_message
+from vox_harbor.common.config import config
+from vox_harbor.common.db_utils import ColumnarBlock, db_fetchall, session_scope
 from vox_harbor.common.exceptions import format_exception
+from vox_harbor.common.metrics import counter, gauge
 
 
 class Task(abc.ABC):
@@ -16,6 +28,36 @@ class Task(abc.ABC):
     def __init__(self):
         self._retries_count = 0
 
+    @property
+    def group(self) -> int:
+        """Tasks of a group share a worker pool, e.g. a bot and its rate limits."""
+        return 0
+
+    @property
+    def priority(self) -> int:
+        """Lower runs first."""
+        return 0
+
+    @property
+    def processed(self) -> int:
+        return 0
+
+    @property
+    def retries_count(self) -> int:
+        return self._retries_count
+
+    def checkpoint(self) -> structures.HistoryCheckpoint | None:
+        """State to resume the task from after a restart, None if the task is not resumable."""
+        return None
+
+    def close(self):
+        """Called once the task is done and won't step again."""
+
+    @property
+    def open_ended(self) -> bool:
+        """The task's range grows over time, so a finished run of it doesn't make it redundant."""
+        return False
+
     async def do_step(self):
         if self.failed:
             return
@@ -64,6 +106,10 @@ class HistoryTask(Task):
 
     DELTA = 3
 
+    class Priority(enum.IntEnum):
+        FRESH = 0  # new chats and messages since the last run
+        BACKFILL = 1  # deep history before the earliest known message
+
     def __init__(self, bot: 'vox_harbor.big_bot.bots.Bot', chat_id: int, start_id: int = 0, end_id: int = 0, limit: int = 100):
         super().__init__()
         self.bot = bot
@@ -74,6 +120,7 @@ class HistoryTask(Task):
         self.limit = limit
 
         self._id = f'{self.chat_id}_{self.start}_{self.end}'
+        self._priority = self.Priority.BACKFILL if start_id else self.Priority.FRESH
 
         self.count = 0
         self.current_offset = start_id
@@ -82,16 +129,69 @@ class HistoryTask(Task):
         self.skips_count = 0
         self.max_skips_count = 3
 
+        self._open_ended = not start_id
+
+        self._prefetch: tuple[int, asyncio.Task[list[types.Message]]] | None = None
+
+    @classmethod
+    def from_checkpoint(
+        cls, bot: 'vox_harbor.big_bot.bots.Bot', checkpoint: structures.HistoryCheckpoint
+    ) -> 'HistoryTask':
+        task = cls(bot, checkpoint.chat_id, start_id=checkpoint.start_id, end_id=checkpoint.end_id)
+        task._id = checkpoint.task_id
+        task._priority = HistoryTask.Priority(checkpoint.priority)
+        task.current_offset = checkpoint.current_offset
+        return task
+
+    def checkpoint(self) -> structures.HistoryCheckpoint:
+        return structures.HistoryCheckpoint(
+            task_id=self.id,
+            chat_id=self.chat_id,
+            start_id=self.start,
+            end_id=self.end,
+            current_offset=self.current_offset,
+            priority=self.priority,
+            finished=self.finished,
+            shard=config.SHARD_NUM,
+            bot_index=self.bot.index,
+        )
+
+    @property
+    def group(self) -> int:
+        return self.bot.index
+
+    @property
+    def open_ended(self) -> bool:
+        """Started from the latest message, which is a different one on every run."""
+        return self._open_ended
+
+    @property
+    def priority(self) -> int:
+        return self._priority
+
+    @property
+    def processed(self) -> int:
+        return self.count
+
     @property
     def total(self):
         return self.start - self.end
 
     async def step(self):
-        messages = await self.bot.get_history(self.chat_id, self.current_offset, self.end, self.limit)
+        try:
+            await self._step()
+        except BaseException:
+            # the retry fetches its page again, a prefetched one would only spend the history budget
+            self._cancel_prefetch()
+            raise
+
+    async def _step(self):
+        messages = await self._get_page(self.current_offset)
         if not messages:
             self.skips_count += 1
             if self.skips_count > self.max_skips_count:
                 self._finished = True
+                coverage.record(self.chat_id, self.end + 1, self.start)
                 self.logger.info('no messages for %s times, finishing block %s', self.skips_count, self.id)
             else:
                 self.current_offset -= self.limit
@@ -103,12 +203,53 @@ class HistoryTask(Task):
         if not self.start:
             self.start = messages[0].id
 
+        # the next page is fetched while this one is processed
+        if messages[-1].id - self.end >= self.DELTA:
+            self._prefetch_page(messages[-1].id)
+
+        top_messages = await self.bot.top_messages.get_many(
+            self.chat_id, (m.reply_to_top_message_id for m in messages if m.reply_to_top_message_id)
+        )
+
+        offset = self.current_offset
         for message in messages:
             self.count += 1
 
-            await process_message(self.bot, message)
+            await process_message(self.bot, message, top_messages)
             self.current_offset = message.id
 
+        # nothing between the page and the previous offset is left unseen
+        coverage.record(self.chat_id, messages[-1].id, offset - 1 if offset else messages[0].id)
+
+    async def _get_page(self, offset: int) -> list[types.Message]:
+        prefetch, self._prefetch = self._prefetch, None
+        if prefetch is not None:
+            prefetch_offset, page = prefetch
+            if prefetch_offset == offset:
+                return await page
+
+            page.cancel()
+
+        return await self.bot.get_history(self.chat_id, offset, self.end, self.limit)
+
+    def _prefetch_page(self, offset: int):
+        page = asyncio.create_task(self.bot.get_history(self.chat_id, offset, self.end, self.limit))
+        page.add_done_callback(lambda t: t.cancelled() or t.exception())  # retrieved on the next step, if any
+        self._prefetch = offset, page
+
+    def _cancel_prefetch(self):
+        prefetch, self._prefetch = self._prefetch, None
+        if prefetch is not None:
+            prefetch[1].cancel()
+
+    def close(self):
+        self._cancel_prefetch()
+
+    @property
+    def remaining(self) -> tuple[int, int]:
+        """Message ids the task is yet to crawl."""
+        return self.end + 1, self.current_offset - 1 if self.current_offset else MAX_MESSAGE_ID
+
     @property
     def progress(self) -> float:
         return ((self.start - self.current_offset) / self.total) * 100 if self.total != 0 else 100.
@@ -118,8 +259,8 @@ class HistoryTask(Task):
         if self._finished:
             return True
 
-        if not self.start and not self.end:
-            return False
+        if not self.start:
+            return False  # the first page is not fetched yet
 
         return self.total - self.start + self.current_offset < self.DELTA
 
@@ -129,50 +270,243 @@ class HistoryTask(Task):
 
 
 class TaskManager:
+    """
+    Runs task steps from per-bot priority queues. Each bot gets its own workers, so a slow bot or chat
+    doesn't hold back the others. Within a priority the task with fewest steps served goes first.
+    """
+
     logger = logging.getLogger('vox_harbor.big_bot.tasks')
+    lock = asyncio.Lock()
+
+    STEPS_PER_BOT = 2  # concurrent steps per bot, matches Bot.history_limiter rate
+    MAX_IN_FLIGHT = 16
+
+    CHECKPOINT_STEPS = 10
+    CHECKPOINT_INTERVAL = 30
+
+    LOAD_ATTEMPTS = 5
+    LOAD_RETRY_DELAY = 5
 
     def __init__(self):
         self.tasks: dict[str, Task] = {}
 
+        self._queues: dict[int, asyncio.PriorityQueue[tuple[int, int, int, Task]]] = {}
+        self._virtual_time: dict[int, int] = defaultdict(int)
+        self._stats: dict[int, structures.TaskGroupStats] = {}
+        self._in_flight = asyncio.Semaphore(self.MAX_IN_FLIGHT)
+        self._workers: list[asyncio.Task] = []
+        self._seq = itertools.count()
+        self._started_at: float | None = None
+
+        self._checkpoints: dict[str, structures.HistoryCheckpoint] = {}
+        self._dirty: dict[str, Task] = {}
+
     async def add_task(self, task: Task):
         if task.id in self.tasks:
             self.logger.info('already processing this task %s', task)
             return
 
+        checkpoint = self._checkpoints.get(task.id)
+        if checkpoint is not None and checkpoint.finished and not task.open_ended:
+            self.logger.info('task %s is already finished', task)
+            return
+
         self.logger.info('new task %s', task)
         self.tasks[task.id] = task
 
-    async def loop(self):
+        # new tasks join at the group's current pace instead of starving older ones
+        self._push(task, self._virtual_time[task.group])
+
+    def _push(self, task: Task, steps: int):
+        if (queue := self._queues.get(task.group)) is None:
+            queue = self._queues[task.group] = asyncio.PriorityQueue()
+            self._stats[task.group] = structures.TaskGroupStats(group=task.group)
+            if self._started_at is not None:
+                self._start_workers(task.group)
+
+        queue.put_nowait((task.priority, steps, next(self._seq), task))
+
+    def _start_workers(self, group: int):
+        for _ in range(self.STEPS_PER_BOT):
+            self._workers.append(asyncio.create_task(self._worker(group)))
+
+    async def _worker(self, group: int):
+        queue = self._queues[group]
+        stats = self._stats[group]
+
         while True:
+            _, steps, _, task = await queue.get()
+            self._virtual_time[group] = steps
+
             try:
-                if not self.tasks:
-                    await asyncio.sleep(10)
-
-                while self.tasks:
-                    await asyncio.gather(*(
-                        task.do_step()
-                        for task in self.tasks.values()
-                    ))
-
-                    self.logger.info(self.tasks)
-                    for task in self.tasks.copy().values():
-                        if task.done:
-                            del self.tasks[task.id]
+                processed = task.processed
+                retries = task.retries_count
+
+                async with self._in_flight:
+                    stats.in_flight += 1
+                    try:
+                        await task.do_step()
+                    finally:
+                        stats.in_flight -= 1
+
+                stats.steps += 1
+                stats.errors += task.retries_count - retries
+                stats.processed += task.processed - processed
             except Exception as e:
-                self.logger.error('failed in task manager loop: %s', format_exception(e, with_traceback=True))
-                await asyncio.sleep(10)
+                self.logger.error('failed in task manager worker: %s', format_exception(e, with_traceback=True))
+
+            if task.done or (steps + 1) % self.CHECKPOINT_STEPS == 0:
+                self._dirty[task.id] = task
+
+            if task.done:
+                self.logger.info('task %s is done', task)
+                task.close()
+                self.tasks.pop(task.id, None)
+                stats.finished += 1
+            else:
+                self._push(task, steps + 1)
+
+    async def load_checkpoints(self):
+        checkpoints = await db_fetchall(
+            structures.HistoryCheckpoint,
+            'SELECT * FROM history_checkpoints FINAL WHERE shard = %(shard)s',
+            dict(shard=config.SHARD_NUM),
+            raise_not_found=False,
+        )
+
+        self._checkpoints = {c.task_id: c for c in checkpoints}
+        self.logger.info('loaded %s history checkpoints', len(self._checkpoints))
+
+    def unfinished_checkpoints(self, chat_id: int) -> list[structures.HistoryCheckpoint]:
+        return [c for c in self._checkpoints.values() if c.chat_id == chat_id and not c.finished]
+
+    async def save_checkpoints(self, all_tasks: bool = False):
+        """Persists tasks that made progress since the last save, or every running task on shutdown."""
+        dirty, self._dirty = self._dirty, {}
+        if all_tasks:
+            dirty.update(self.tasks)
+
+        block = ColumnarBlock('history_checkpoints', structures.HistoryCheckpoint.model_fields)
+        for task in dirty.values():
+            if (checkpoint := task.checkpoint()) is not None:
+                block.append(*checkpoint.model_dump().values())
+                self._checkpoints[checkpoint.task_id] = checkpoint
+
+        if not block:
+            return
+
+        try:
+            async with session_scope() as session:
+                session.set_settings(dict(async_insert=True))
+                await session.insert_block(block)
+        except Exception:
+            self._dirty = dirty | self._dirty
+            raise
+
+        self.logger.info('saved %s history checkpoints', len(block))
+
+    async def checkpoint_loop(self):
+        while True:
+            await asyncio.sleep(self.CHECKPOINT_INTERVAL)
+
+            try:
+                await self.save_checkpoints()
+            except Exception as e:
+                self.logger.error('failed to save history checkpoints: %s', format_exception(e))
+
+            try:
+                await coverage.save()
+            except Exception as e:
+                self.logger.error('failed to save history coverage: %s', format_exception(e))
+
+    def stats(self) -> list[structures.TaskGroupStats]:
+        uptime = time.monotonic() - self._started_at if self._started_at is not None else 0.0
+
+        result = []
+        for group, stats in sorted(self._stats.items()):
+            stats.queued = self._queues[group].qsize()
+            stats.steps_per_second = stats.steps / uptime if uptime else 0.0
+            stats.processed_per_second = stats.processed / uptime if uptime else 0.0
+            result.append(stats.model_copy())
+
+        return result
 
     def start(self):
-        asyncio.create_task(self.loop())
+        self._started_at = time.monotonic()
+        for group in self._queues:
+            self._start_workers(group)
+
+        asyncio.create_task(self.checkpoint_loop())
 
     @classmethod
     async def get_instance(cls):
-        global _task_manager
-        if _task_manager is not None:
+        async with cls.lock:
+            global _task_manager
+            if _task_manager is not None:
+                return _task_manager
+
+            # without checkpoints and coverage every chat would be crawled from scratch, so no manager instead
+            task_manager = cls()
+            await task_manager._load('history checkpoints', task_manager.load_checkpoints)
+            await task_manager._load('history coverage', coverage.load)
+
+            _task_manager = task_manager
             return _task_manager
 
-        _task_manager = cls()
-        return _task_manager
+    async def _load(self, what: str, load: tp.Callable[[], tp.Awaitable[None]]):
+        for attempt in range(1, self.LOAD_ATTEMPTS + 1):
+            try:
+                return await load()
+            except Exception as e:
+                if attempt == self.LOAD_ATTEMPTS:
+                    self.logger.error('failed to load %s, giving up: %s', what, format_exception(e))
+                    raise
+
+                delay = self.LOAD_RETRY_DELAY * attempt
+                self.logger.warning('failed to load %s, retry in %ss: %s', what, delay, format_exception(e))
+                await asyncio.sleep(delay)
 
 
 _task_manager: TaskManager | None = None
+
+
+def _collect_stats(field: str):
+    def collect() -> dict[tuple[int], float]:
+        if _task_manager is None:
+            return {}
+        return {(stats.group,): getattr(stats, field) for stats in _task_manager.stats()}
+
+    return collect
+
+
+def _collect_tasks(aggregate):
+    def collect() -> dict[tuple[int], float]:
+        if _task_manager is None:
+            return {}
+
+        by_group = defaultdict(list)
+        for task in _task_manager.tasks.values():
+            by_group[task.group].append(task)
+        return {(group,): aggregate(tasks) for group, tasks in by_group.items()}
+
+    return collect
+
+
+gauge('vox_harbor_tasks', 'Unfinished tasks per group.', ('group',), collect=_collect_tasks(len))
+gauge(
+    'vox_harbor_tasks_progress_percent',
+    'Mean progress of unfinished tasks per group.',
+    ('group',),
+    collect=_collect_tasks(lambda tasks: sum(task.progress for task in tasks) / len(tasks)),
+)
+gauge('vox_harbor_tasks_queued', 'Tasks waiting for a worker per group.', ('group',), collect=_collect_stats('queued'))
+gauge('vox_harbor_tasks_in_flight', 'Steps running per group.', ('group',), collect=_collect_stats('in_flight'))
+counter('vox_harbor_task_steps_total', 'Task steps per group.', ('group',), collect=_collect_stats('steps'))
+counter('vox_harbor_task_errors_total', 'Failed task steps per group.', ('group',), collect=_collect_stats('errors'))
+counter('vox_harbor_tasks_finished_total', 'Finished tasks per group.', ('group',), collect=_collect_stats('finished'))
+counter(
+    'vox_harbor_task_processed_total',
+    'Messages processed by tasks per group.',
+    ('group',),
+    collect=_collect_stats('processed'),
+)
@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import typing as tp
+
+import cachetools
+from pyrogram import enums, types
+
+import vox_harbor.big_bot
+
+TopMessage = tuple[int | None, int | None]  # (channel_id, post_id), both None if the top is not a channel post
+
+
+class TopMessageCache:
+    """
+    Per-bot (chat_id, message_id) -> (channel_id, post_id) of discussion thread tops.
+    Misses requested within BATCH_DELAY are coalesced into one `get_messages` call per chat.
+    """
+
+    MAXSIZE = 200_000
+    BATCH_DELAY = 0.05
+    BATCH_SIZE = 100
+
+    def __init__(self, bot: 'vox_harbor.big_bot.bots.Bot'):
+        self.bot = bot
+        self.logger = logging.getLogger(f'vox_harbor.big_bot.top_messages.{bot.index}')
+
+        self._cache: cachetools.LRUCache[tuple[int, int], TopMessage] = cachetools.LRUCache(self.MAXSIZE)
+        self._pending: dict[int, dict[int, asyncio.Future[TopMessage]]] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.requests = 0
+
+    @staticmethod
+    def parse(message: types.Message) -> TopMessage:
+        if message.sender_chat and message.sender_chat.type == enums.ChatType.CHANNEL:
+            return message.sender_chat.id, message.forward_from_message_id
+
+        return None, None
+
+    def remember(self, message: types.Message) -> None:
+        """Channel posts forwarded into their discussion chat become thread tops, no need to ask for them later."""
+        self._cache[message.chat.id, message.id] = self.parse(message)
+
+    async def get_many(self, chat_id: int, message_ids: tp.Iterable[int]) -> dict[int, TopMessage]:
+        result: dict[int, TopMessage] = {}
+        waiting: dict[int, asyncio.Future[TopMessage]] = {}
+
+        for message_id in dict.fromkeys(message_ids):
+            if (top := self._cache.get((chat_id, message_id))) is not None:
+                self.hits += 1
+                result[message_id] = top
+            else:
+                self.misses += 1
+                waiting[message_id] = self._request(chat_id, message_id)
+
+        for message_id, future in waiting.items():
+            result[message_id] = await asyncio.shield(future)
+
+        return result
+
+    async def get(self, chat_id: int, message_id: int) -> TopMessage:
+        return (await self.get_many(chat_id, [message_id]))[message_id]
+
+    def _request(self, chat_id: int, message_id: int) -> asyncio.Future[TopMessage]:
+        if (pending := self._pending.get(chat_id)) is None:
+            pending = self._pending[chat_id] = {}
+            asyncio.create_task(self._flush(chat_id))
+
+        if (future := pending.get(message_id)) is None:
+            future = pending[message_id] = asyncio.get_running_loop().create_future()
+
+        return future
+
+    async def _flush(self, chat_id: int):
+        await asyncio.sleep(self.BATCH_DELAY)
+        pending = self._pending.pop(chat_id)
+
+        message_ids = list(pending)
+        for i in range(0, len(message_ids), self.BATCH_SIZE):
+            batch = message_ids[i : i + self.BATCH_SIZE]
+            self.requests += 1
+
+            try:
+                messages = await self.bot.get_messages(chat_id=chat_id, message_ids=batch, replies=0)
+            except Exception as e:
+                for message_id in batch:
+                    pending[message_id].set_exception(e)
+                continue
+
+            found = {m.id: self.parse(m) for m in messages if m is not None and not m.empty}
+            for message_id in batch:
+                top = found.get(message_id, (None, None))
+                self._cache[chat_id, message_id] = top
+                pending[message_id].set_result(top)
@@ -0,0 +1,126 @@
+import abc
+import asyncio
+import logging
+import time
+import typing as tp
+
+import cachetools
+
+from vox_harbor.big_bot.structures import CacheStats
+
+_MISSING = object()
+
+
+class AsyncCache(abc.ABC):
+    """Storage backend for `QueryCache`."""
+
+    @abc.abstractmethod
+    async def get(self, key: tp.Hashable) -> tp.Any:
+        """Returns the cached value or `_MISSING`."""
+
+    @abc.abstractmethod
+    async def set(self, key: tp.Hashable, value: tp.Any) -> None:
+        pass
+
+    @abc.abstractmethod
+    def __len__(self) -> int:
+        pass
+
+
+class MemoryCache(AsyncCache):
+    """In-process LRU cache with per-entry TTL."""
+
+    def __init__(self, maxsize: int, ttl: float, timer: tp.Callable[[], float] = time.monotonic):
+        self._store = cachetools.TTLCache(maxsize=maxsize, ttl=ttl, timer=timer)
+
+    async def get(self, key: tp.Hashable) -> tp.Any:
+        return self._store.get(key, _MISSING)
+
+    async def set(self, key: tp.Hashable, value: tp.Any) -> None:
+        self._store[key] = value
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+
+class QueryCache:
+    """
+    Read-through cache with request coalescing: concurrent misses for the same key
+    share a single fetch. Exceptions (e.g. NotFoundError) are propagated, never cached.
+    If the fetching request is cancelled, the ones waiting for it retry on their own.
+    """
+
+    logger = logging.getLogger('vox_harbor.common.cache')
+
+    def __init__(self, name: str, backend: AsyncCache):
+        self.name = name
+        self.backend = backend
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+        self._in_flight: dict[tp.Hashable, asyncio.Future] = {}
+
+    async def get_or_fetch(self, key: tp.Hashable, fetch: tp.Callable[[], tp.Awaitable[tp.Any]]) -> tp.Any:
+        if (value := await self.backend.get(key)) is not _MISSING:
+            self.hits += 1
+            return value
+
+        if (future := self._in_flight.get(key)) is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling() or not future.cancelled():
+                    raise
+
+                # the fetching request was cancelled, not this one: fetch again instead of failing with it
+                return await self.get_or_fetch(key, fetch)
+
+        self.misses += 1
+        future = self._in_flight[key] = asyncio.get_running_loop().create_future()
+
+        try:
+            value = await fetch()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # mark as retrieved when nobody else is waiting
+            raise
+        else:
+            await self.backend.set(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            del self._in_flight[key]
+
+    @property
+    def stats(self) -> CacheStats:
+        return CacheStats(
+            name=self.name, size=len(self.backend), hits=self.hits, misses=self.misses, coalesced=self.coalesced
+        )
+
+
+caches: dict[str, QueryCache] = {}
+
+
+def query_cache(name: str, ttl: float, maxsize: int = 10_000) -> QueryCache:
+    """Creates and registers an in-memory LRU+TTL query cache."""
+    cache = caches[name] = QueryCache(name, MemoryCache(maxsize=maxsize, ttl=ttl))
+    return cache
+
+
+def make_key(*parts: tp.Any) -> tp.Hashable:
+    """Builds a hashable key out of query arguments (dicts and lists included)."""
+    key = []
+    for part in parts:
+        if isinstance(part, dict):
+            part = tuple(sorted((k, make_key(v)) for k, v in part.items()))
+        elif isinstance(part, (list, tuple)):
+            part = tuple(make_key(x) for x in part)
+        key.append(part)
+
+    return tuple(key) if len(key) != 1 else key[0]
@@ -28,6 +28,11 @@ class _Config(pds.BaseSettings):
     SHARD_HOST: str = '0.0.0.0'
     SHARD_PORT: int = 8001
     SHARD_ENDPOINTS: str | list[tuple[str, int]] = ''
+    SHARD_TIMEOUT: float = 120
+    SHARD_TIMEOUTS: str | list[float] = ''
+    SHARD_MAX_CONNECTIONS: int = 100
+    SHARD_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    SHARD_KEEPALIVE_EXPIRY: float = 60
 
     ACTIVE_BOTS_COUNT: int = 3
     MAX_CHATS_FOR_BOT: int = 200
@@ -36,6 +41,16 @@ class _Config(pds.BaseSettings):
     AUTO_DISCOVER: bool = False
     READ_ONLY: bool = False
 
+    STORE_MESSAGE_TEXTS: bool = False
+    MESSAGE_TEXT_MAX_LENGTH: int = 4096
+
+    POSTS_ROLLUP: bool = False
+    POSTS_HOURLY_AFTER_DAYS: int = 7
+    POSTS_DAILY_AFTER_DAYS: int = 30
+
+    SPILL_PATH: str = 'spill'
+    SPILL_MAX_BYTES: int = 2**30
+
     OPENAI_KEY: str = ''
     OPENAI_MODEL: str = ''
 
@@ -56,6 +71,15 @@ class _Config(pds.BaseSettings):
 
         return result
 
+    # noinspection PyPep8Naming
+    @pd.field_validator('SHARD_TIMEOUTS', mode='before')
+    @classmethod
+    def _3(cls, SHARD_TIMEOUTS: str | float) -> list[float]:
+        if not SHARD_TIMEOUTS:
+            return []
+
+        return [float(x) for x in str(SHARD_TIMEOUTS).split(',')]
+
     @property
     def shard_host(self) -> str:
         return self.SHARD_HOST or self.SHARD_ENDPOINTS[self.SHARD_NUM][0]
@@ -76,6 +100,12 @@ class _Config(pds.BaseSettings):
         endpoint = self.SHARD_ENDPOINTS[shard]
         return f'http://{endpoint[0]}:{endpoint[1]}'
 
+    def shard_timeout(self, shard: int) -> float:
+        if shard < len(self.SHARD_TIMEOUTS):
+            return self.SHARD_TIMEOUTS[shard]  # pyright: ignore
+
+        return self.SHARD_TIMEOUT
+
 
 def override_config(cfg: dict[str, Any]) -> None:
     """Only use in CLI."""
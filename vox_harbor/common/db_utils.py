@@ -1,5 +1,6 @@
 import contextlib
 import logging
+import time
 import typing as tp
 from functools import partial
 from operator import attrgetter
@@ -10,11 +11,24 @@ from asynch.cursors import DictCursor as _DictCursor
 from asynch.pool import Pool
 
 from vox_harbor.big_bot import structures
+from vox_harbor.common.cache import QueryCache, make_key
 from vox_harbor.common.config import config
 from vox_harbor.common.exceptions import NotFoundError
+from vox_harbor.common.metrics import gauge, histogram
 
 pool: Pool | None = None
 
+query_duration = histogram(
+    'vox_harbor_clickhouse_query_duration_seconds', 'ClickHouse reads by query name, cache hits excluded.', ('name',)
+)
+pool_wait = histogram('vox_harbor_clickhouse_pool_wait_seconds', 'Time to acquire a pooled connection.')
+gauge(
+    'vox_harbor_clickhouse_pool_connections',
+    'Pooled connections by state.',
+    ('state',),
+    collect=lambda: {} if pool is None else {('free',): pool.freesize, ('used',): pool.size - pool.freesize},
+)
+
 
 class DictCursor(_DictCursor):
     logger = logging.getLogger('vox_harbor.common.db_utils.cursor')
@@ -26,6 +40,81 @@ class DictCursor(_DictCursor):
 
         return await super().execute(query, *args, **kwargs)
 
+    async def insert_block(self, block: 'ColumnarBlock') -> int | None:
+        """Sends a columnar block as-is, skipping the row-to-column transposition done by `execute`."""
+        if config.READ_ONLY:
+            self.logger.warning('read only session, insert into %s will be ignored', block.table)
+            return None
+
+        self._check_cursor_closed()
+        self._check_query_executing()
+        self._begin_query()
+
+        execute, execute_kwargs = self._prepare()
+        response = await execute(block.query, args=block.data, columnar=True, **execute_kwargs)
+
+        await self._process_response(response)
+        self._end_query()
+        return self._rowcount
+
+    async def reset_connection(self) -> None:
+        """
+        Drops the socket under the cursor, e.g. when a streamed result is abandoned half-read and the rest of it
+        would be taken for the reply to the next query. asynch has no public API for this, the protocol connection
+        reconnects on its next query, so the pooled connection stays usable.
+        """
+        await self._connection._connection.disconnect()
+
+
+def _estimate_size(value: tp.Any) -> int:
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, list):
+        return sum(map(_estimate_size, value))
+    return 8
+
+
+class ColumnarBlock:
+    """
+    Append-only buffer of per-column lists for bulk inserts.
+    Values are stored as-is, without model validation, in the order of `columns`.
+    """
+
+    def __init__(self, table: str, columns: tp.Sequence[str]):
+        self.table = table
+        self.columns = tuple(columns)
+        self.data: list[list[tp.Any]] = [[] for _ in self.columns]
+
+    def __len__(self) -> int:
+        return len(self.data[0])
+
+    def __bool__(self) -> bool:
+        return bool(self.data[0])
+
+    @property
+    def query(self) -> str:
+        return f'INSERT INTO {self.table} ({", ".join(f"`{c}`" for c in self.columns)}) VALUES'
+
+    @property
+    def nbytes(self) -> int:
+        """Estimated size of the buffered values, extrapolated from up to 100 sampled rows."""
+        if not (rows := len(self)):
+            return 0
+
+        sample = range(0, rows, max(rows // 100, 1))
+        size = sum(_estimate_size(column[i]) for column in self.data for i in sample)
+        return size * rows // len(sample)
+
+    def append(self, *row: tp.Any) -> None:
+        for column, value in zip(self.data, row, strict=True):
+            column.append(value)
+
+    def take(self) -> 'ColumnarBlock':
+        """Moves buffered rows into a new block and leaves this one empty."""
+        block = ColumnarBlock(self.table, self.columns)
+        block.data, self.data = self.data, block.data
+        return block
+
 
 @contextlib.asynccontextmanager
 async def with_clickhouse(**kwargs):
@@ -44,7 +133,9 @@ async def session_scope(cursor_type=DictCursor) -> DictCursor:
     if pool is None:
         raise RuntimeError('out of `with_clickhouse()` scope')
 
+    started = time.perf_counter()
     async with pool.acquire() as conn:
+        pool_wait.observe(time.perf_counter() - started)
         async with conn.cursor(cursor_type) as cursor:
             yield cursor
 
@@ -70,18 +161,26 @@ async def db_fetchone(
     name: str | None = None,
     *,
     raise_not_found: bool = True,
+    cache: QueryCache | None = None,
 ) -> tp.Any:
     if query_args is None:
         query_args = {}
 
-    async with session_scope() as session:
-        await session.execute(query, query_args)
-        try:
-            return model.from_row(await session.fetchone())
-        except AttributeError as exc:
-            if raise_not_found:
-                raise NotFoundError(name or model.__name__) from exc
-            return None
+    async def fetch():
+        with query_duration.time(name=name or model.__name__):
+            async with session_scope() as session:
+                await session.execute(query, query_args)
+                try:
+                    return model.from_row(await session.fetchone())
+                except AttributeError as exc:
+                    if raise_not_found:
+                        raise NotFoundError(name or model.__name__) from exc
+                    return None
+
+    if cache is None:
+        return await fetch()
+
+    return await cache.get_or_fetch(make_key(model.__name__, query, query_args, raise_not_found), fetch)
 
 
 async def db_fetchall(
@@ -91,19 +190,61 @@ async def db_fetchall(
     name: str | None = None,
     *,
     raise_not_found: bool = True,
+    cache: QueryCache | None = None,
 ) -> tp.Any:
     if query_args is None:
         query_args = {}
 
+    async def fetch():
+        with query_duration.time(name=name or model.__name__):
+            async with session_scope() as session:
+                await session.execute(query, query_args)
+                try:
+                    return model.from_rows(await session.fetchall())
+                except AttributeError as exc:
+                    if raise_not_found:
+                        raise NotFoundError(name or model.__name__) from exc
+
+                    return []
+
+    if cache is None:
+        return await fetch()
+
+    rows = await cache.get_or_fetch(make_key(model.__name__, query, query_args, raise_not_found), fetch)
+    return list(rows)  # callers may reorder the list, never the cached one
+
+
+async def db_iterate(
+    model: tp.Type[structures._Base],
+    query: str,
+    query_args: dict[str, tp.Any] | None = None,
+    *,
+    batch_size: int = 10_000,
+) -> tp.AsyncIterator[list[tp.Any]]:
+    """
+    Streams query results from the server in batches of at most `batch_size` models.
+    Close the iterator (e.g. with `contextlib.aclosing`) when leaving it early, so that the connection is released.
+    """
+    if query_args is None:
+        query_args = {}
+
     async with session_scope() as session:
+        session.set_stream_results(True, batch_size)
         await session.execute(query, query_args)
+
+        exhausted = False
         try:
-            return model.from_rows(await session.fetchall())
-        except AttributeError as exc:
-            if raise_not_found:
-                raise NotFoundError(name or model.__name__) from exc
+            while True:
+                try:
+                    rows = await session.fetchmany(batch_size)
+                except AttributeError:  # no more rows
+                    exhausted = True
+                    return
 
-            return []
+                yield model.from_rows(rows)
+        finally:
+            if not exhausted:
+                await session.reset_connection()
 
 
 def rows_to_unique_column(rows: tp.Iterable[pydantic.BaseModel], column: str) -> list[tp.Any]:
@@ -1,57 +1,165 @@
 import asyncio
+import collections
 import contextlib
 import datetime
 import logging
 import socket
+import sys
+import time
 
 from vox_harbor.big_bot import structures
 from vox_harbor.common.config import config
-from vox_harbor.common.db_utils import session_scope
+from vox_harbor.common.db_utils import ColumnarBlock, session_scope
+from vox_harbor.common.exceptions import format_exception
+
+
+class RateLimit:
+    """Token bucket: `rate` records per second on average, bursts of up to `burst`."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def acquire(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if self.tokens < 1:
+            return False
+
+        self.tokens -= 1
+        return True
 
 
 class ClickHouseHandler(logging.Handler):
+    """
+    Ships records to the `logs` table without ever blocking or raising into the caller.
+
+    `emit` only formats the record and appends a row to a bounded buffer, a background loop sends it
+    in columnar blocks of at most MAX_BATCH rows. Records below WARNING are rate limited per logger.
+    Blocks that fail to insert are retried with backoff while they fit into MAX_RETRY_ROWS,
+    the oldest ones that don't fit are dropped and counted.
+    """
+
     INTERVAL = 5
+    MAX_BATCH = 10_000
+    MAX_RETRY_ROWS = 100_000
+    MAX_BACKOFF = 5 * 60
+
+    RATE = 50
+    BURST = 500
 
     def __init__(self, max_size: int = 100_000):
         super().__init__()
-        self.queue = asyncio.Queue(max_size)
+        self.max_size = max_size
         self.fqdn = socket.getfqdn()
 
-    def process_record(self, record: logging.LogRecord) -> structures.Log:
-        return structures.Log(
-            created=datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc),
-            filename=record.filename,
-            func_name=record.funcName,
-            levelno=record.levelno,
-            lineno=record.lineno,
-            message=self.format(record),
-            name=record.name,
-            shard=config.SHARD_NUM,
-            fqdn=self.fqdn,
+        self._rows: collections.deque[tuple] = collections.deque()
+        self._blocks: collections.deque[ColumnarBlock] = collections.deque()
+        self._blocks_rows = 0
+        self._backoff = 0
+        self._limits: dict[str, RateLimit] = {}
+
+        self.shipped = 0
+        self.dropped = collections.Counter[str]()
+        self.rate_limited = collections.Counter[str]()
+        self.failed_flushes = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._rows) + self._blocks_rows
+
+    def process_record(self, record: logging.LogRecord) -> tuple:
+        return (
+            datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc),
+            record.filename,
+            record.funcName,
+            record.levelno,
+            record.lineno,
+            self.format(record),
+            record.name,
+            config.SHARD_NUM,
+            self.fqdn,
         )
 
-    async def batch_flush(self):
-        batch = []
+    def _allowed(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+
+        if (limit := self._limits.get(record.name)) is None:
+            limit = self._limits[record.name] = RateLimit(self.RATE, self.BURST)
 
-        size = self.queue.qsize()
-        for _ in range(size):
-            batch.append(self.process_record(self.queue.get_nowait()))
+        return limit.acquire()
 
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            if not self._allowed(record):
+                self.rate_limited[record.name] += 1
+            elif len(self._rows) >= self.max_size:
+                self.dropped['queue_full'] += 1
+            else:
+                self._rows.append(self.process_record(record))
+        except Exception:
+            self.handleError(record)
+
+    def _take_block(self) -> ColumnarBlock:
+        block = ColumnarBlock('logs', structures.Log.model_fields)
+        for _ in range(min(len(self._rows), self.MAX_BATCH)):
+            block.append(*self._rows.popleft())
+
+        return block
+
+    def _seal(self) -> None:
+        """Moves buffered rows into blocks, dropping the oldest blocks beyond MAX_RETRY_ROWS."""
+        while self._rows:
+            block = self._take_block()
+            self._blocks.append(block)
+            self._blocks_rows += len(block)
+
+        while self._blocks_rows > self.MAX_RETRY_ROWS:
+            dropped = self._blocks.popleft()
+            self._blocks_rows -= len(dropped)
+            self.dropped['insert_failed'] += len(dropped)
+
+    @staticmethod
+    async def _insert(block: ColumnarBlock):
         async with session_scope() as session:
-            await session.execute('INSERT INTO logs VALUES', [obj.model_dump() for obj in batch])
+            session.set_settings(dict(async_insert=True))
+            await session.insert_block(block)
+
+    async def batch_flush(self):
+        """Sends blocks oldest first, stops at the first failure and keeps the rest for the next flush."""
+        self._seal()
+
+        while self._blocks:
+            await self._insert(self._blocks[0])
+            block = self._blocks.popleft()
+            self._blocks_rows -= len(block)
+            self.shipped += len(block)
+
+    @staticmethod
+    def _report(message: str, e: Exception):
+        # not through `logging`: the message would come back here and pile up while ClickHouse is unavailable
+        print(f'{message}: {format_exception(e)}', file=sys.stderr)
 
     async def loop(self):
         while True:
-            with contextlib.suppress(Exception):
-                await asyncio.sleep(self.INTERVAL)
+            await asyncio.sleep(self.INTERVAL + self._backoff)
+
+            try:
                 await self.batch_flush()
+                self._backoff = 0
+            except Exception as e:
+                self.failed_flushes += 1
+                self._backoff = min(max(self._backoff * 2, self.INTERVAL), self.MAX_BACKOFF)
+                self._report(f'failed to ship logs, {self.pending} pending, retry in {self._backoff}s', e)
 
     def start(self):
         asyncio.create_task(self.loop())
 
-    def emit(self, record: logging.LogRecord) -> None:
-        self.queue.put_nowait(record)
-
 
 @contextlib.asynccontextmanager
 async def clickhouse_logger():
@@ -67,4 +175,8 @@ async def clickhouse_logger():
         handler.start()
         yield
     finally:
-        await handler.batch_flush()
+        try:
+            await handler.batch_flush()
+        except Exception as e:
+            handler.dropped['insert_failed'] += handler.pending
+            handler._report(f'failed to ship logs on exit, dropped {handler.pending}', e)
@@ -0,0 +1,65 @@
+import logging
+import typing as tp
+
+import cachetools
+
+from vox_harbor.big_bot.structures import MessageText
+from vox_harbor.common.db_utils import db_fetchall
+from vox_harbor.common.exceptions import format_exception
+
+MessageKey = tuple[int, int]
+
+
+class MessageTextStore:
+    """
+    Bounded LRU in front of the `message_texts` table, keyed by (chat_id, message_id).
+    Writes to the table are done by the caller (see `BlockInserter.insert_message_texts`).
+    """
+
+    logger = logging.getLogger('vox_harbor.common.message_texts')
+
+    def __init__(self, maxsize: int = 100_000):
+        self.memory: cachetools.LRUCache[MessageKey, MessageText] = cachetools.LRUCache(maxsize=maxsize)
+
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def remember(self, texts: tp.Iterable[MessageText]) -> None:
+        for text in texts:
+            self.memory[text.chat_id, text.message_id] = text
+
+    async def get_many(self, keys: tp.Iterable[MessageKey]) -> dict[MessageKey, MessageText]:
+        """Returns known texts, looking up the table only for keys missing in memory."""
+        found: dict[MessageKey, MessageText] = {}
+        missing: list[MessageKey] = []
+
+        for key in dict.fromkeys(keys):
+            if (text := self.memory.get(key)) is not None:
+                found[key] = text
+            else:
+                missing.append(key)
+
+        self.memory_hits += len(found)
+        if not missing:
+            return found
+
+        try:
+            rows: list[MessageText] = await db_fetchall(
+                MessageText,
+                'SELECT chat_id, message_id, text, chat FROM message_texts FINAL\n'
+                'WHERE chat_id IN %(chat_ids)s AND (chat_id, message_id) IN %(keys)s',
+                dict(chat_ids=list({chat_id for chat_id, _ in missing}), keys=missing),
+                raise_not_found=False,
+            )
+        except Exception as e:
+            self.logger.error('failed to look up message texts: %s', format_exception(e))
+            rows = []
+
+        self.remember(rows)
+        for row in rows:
+            found[row.chat_id, row.message_id] = row
+
+        self.db_hits += len(rows)
+        self.misses += len(missing) - len(rows)
+        return found
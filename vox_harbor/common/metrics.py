@@ -0,0 +1,181 @@
+import bisect
+import contextlib
+import math
+import time
+import typing as tp
+
+from fastapi import FastAPI, Request, Response
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+LabelValues = tuple[str, ...]
+
+
+class Metric:
+    """
+    A metric family in the Prometheus text format.
+    Values are either updated in place or, with `collect`, read from their owner on every scrape.
+    """
+
+    TYPE = 'untyped'
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tp.Sequence[str] = (),
+        collect: tp.Callable[[], tp.Mapping[LabelValues, float]] | None = None,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.collect = collect
+
+        self._values: dict[LabelValues, float] = {}
+
+    def _key(self, labels: dict[str, tp.Any]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self) -> tp.Iterator[tuple[str, tuple[str, ...], LabelValues, float]]:
+        """`(name, label names, label values, value)` of every sample."""
+        values = self.collect() if self.collect is not None else self._values
+        for key, value in values.items():
+            yield self.name, self.labels, tuple(map(str, key)), value
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.TYPE}']
+        for name, labels, key, value in self.samples():
+            lines.append(f'{name}{_format_labels(labels, key)} {_format_value(value)}')
+
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    TYPE = 'counter'
+
+    def inc(self, amount: float = 1, **labels: tp.Any) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    TYPE = 'gauge'
+
+    def set(self, value: float, **labels: tp.Any) -> None:
+        self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    TYPE = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: tp.Sequence[str] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+        self._counts: dict[LabelValues, list[int]] = {}  # per bucket, +Inf last, not cumulative
+
+    def observe(self, value: float, **labels: tp.Any) -> None:
+        key = self._key(labels)
+        if (counts := self._counts.get(key)) is None:
+            counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._values[key] = self._values.get(key, 0) + value
+
+    @contextlib.contextmanager
+    def time(self, **labels: tp.Any) -> tp.Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> tp.Iterator[tuple[str, tuple[str, ...], LabelValues, float]]:
+        bucket_labels = self.labels + ('le',)
+
+        for key, counts in self._counts.items():
+            total = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                total += count
+                yield f'{self.name}_bucket', bucket_labels, key + (_format_value(bound),), total
+
+            yield f'{self.name}_sum', self.labels, key, self._values[key]
+            yield f'{self.name}_count', self.labels, key, total
+
+
+def _format_labels(names: tuple[str, ...], values: LabelValues) -> str:
+    if not names:
+        return ''
+
+    escaped = (v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in values)
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, escaped)) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+registry: dict[str, Metric] = {}
+
+_M = tp.TypeVar('_M', bound=Metric)
+
+
+def _register(metric: _M) -> _M:
+    if metric.name in registry:
+        raise ValueError(f'metric {metric.name} is already registered')
+
+    registry[metric.name] = metric
+    return metric
+
+
+def counter(name: str, documentation: str, labels: tp.Sequence[str] = (), collect=None) -> Counter:
+    return _register(Counter(name, documentation, labels, collect))
+
+
+def gauge(name: str, documentation: str, labels: tp.Sequence[str] = (), collect=None) -> Gauge:
+    return _register(Gauge(name, documentation, labels, collect))
+
+
+def histogram(name: str, documentation: str, labels: tp.Sequence[str] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+    return _register(Histogram(name, documentation, labels, buckets))
+
+
+def render() -> str:
+    return ''.join(metric.render() + '\n' for metric in registry.values())
+
+
+request_duration = histogram(
+    'vox_harbor_http_request_duration_seconds',
+    'Time to the response start per endpoint.',
+    ('method', 'endpoint', 'status'),
+)
+
+
+def instrument(app: FastAPI) -> None:
+    """Records request latencies of `app` and serves the registry at `/metrics`."""
+
+    @app.middleware('http')
+    async def observe_request(request: Request, call_next):
+        started = time.perf_counter()
+        status = 500
+
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            # path templates, not raw urls, so that ids and 404 scans don't blow up the number of series
+            route = request.scope.get('route')
+            request_duration.observe(
+                time.perf_counter() - started,
+                method=request.method,
+                endpoint=route.path if route is not None else 'unmatched',
+                status=status,
+            )
+
+    @app.get('/metrics', include_in_schema=False)
+    async def get_metrics() -> Response:
+        return Response(render(), media_type=CONTENT_TYPE)
@@ -1,50 +1,93 @@
 import asyncio
+import contextlib
 import datetime
 import logging
 import typing as tp
-from itertools import chain, groupby
+import zlib
+from itertools import groupby
 from operator import attrgetter
 
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pyrogram import utils
 
 from vox_harbor.big_bot.structures import (
+    CacheStats,
     Chat,
     CheckUserResult,
     Comment,
     CommentCount,
+    CommentsPage,
     EmptyResponse,
+    ExportEnd,
     Message,
+    MessageText,
     ParsedMsgURL,
     ParsedPostURL,
     Post,
     PostText,
     Sample,
+    SearchQuery,
+    ShardClientStats,
     User,
     UserInfo,
     UsersAndChats,
 )
+from vox_harbor.common.cache import QueryCache, caches, query_cache
 from vox_harbor.common.config import config
 from vox_harbor.common.db_utils import (
     clickhouse_default,
     db_execute,
     db_fetchall,
     db_fetchone,
+    db_iterate,
     rows_to_unique_column,
     session_scope,
 )
-from vox_harbor.common.exceptions import BadRequestError, NotFoundError
+from vox_harbor.common.exceptions import BadRequestError, NotFoundError, format_exception
+from vox_harbor.common.message_texts import MessageTextStore
+from vox_harbor.common.metrics import instrument
 from vox_harbor.gpt.main import Model
 
 # from vox_harbor.services.auto_discover import AutoDiscover
-from vox_harbor.services.shard_client import ShardClient
-from vox_harbor.services.utils import parse_msg_url, parse_post_url
+from vox_harbor.services.retention import PostRollup
+from vox_harbor.services.shard_client import shard_clients
+from vox_harbor.services.utils import (
+    decode_comments_cursor,
+    encode_comments_cursor,
+    parse_msg_url,
+    parse_post_url,
+    parse_search_query,
+)
 
 logger = logging.getLogger('vox_harbor.big_bot.services.controller')
 
-controller = FastAPI()
+user_cache = query_cache('user', ttl=60)
+chat_cache = query_cache('chat', ttl=300)
+comment_count_cache = query_cache('comment_count', ttl=60)
+reactions_cache = query_cache('reactions', ttl=30)
+
+message_texts = MessageTextStore()
+
+EXPORT_BATCH_SIZE = 10_000
+EXPORT_TEXT_BATCH_SIZE = 500
+EXPORT_TEXT_CONCURRENCY = 4
+
+
+@contextlib.asynccontextmanager
+async def _lifespan(_: FastAPI):
+    if config.POSTS_ROLLUP:
+        PostRollup().start()
+
+    try:
+        yield
+    finally:
+        await shard_clients.aclose()
+
+
+controller = FastAPI(lifespan=_lifespan)
 controller.add_middleware(
     CORSMiddleware,
     allow_origins=['*'],
@@ -52,63 +95,98 @@ controller.add_middleware(
     allow_methods=['*'],
     allow_headers=['*'],
 )
+instrument(controller)
 
 
 @controller.get('/users_and_chats')
 async def get_users_and_chats(query: str) -> UsersAndChats:
-    users = _get_users(query)
-    chats = _get_chats(query)
-    users, chats = await asyncio.gather(users, chats)
+    """Web UI. The query is classified once, only applicable lookups run (concurrently)."""
+    search = parse_search_query(query)
+    logger.info('search query: %s', search)
 
-    return UsersAndChats(users=users, chats=chats)
+    match search.kind:
+        case SearchQuery.Kind.ID:
+            user_lookups = [_search_users_by_ids([search.id])]
+            chat_lookups = [_search_chats_by_id(search.id)]
 
+        case SearchQuery.Kind.MSG_URL:
+            user_lookups = [_search_user_by_msg_url(search.text)]
+            chat_lookups = []
 
-async def _get_chats(query: str) -> list[Chat]:
-    getters = ((get_chat, 'chat_id'), (get_chats, 'join_string'), (get_chats, 'name'))
-    chats: list[Chat] = []
+        case SearchQuery.Kind.CHAT_URL:
+            user_lookups = []
+            chat_lookups = [_search_chats(join_string=search.text)]
 
-    for func, arg_name in getters:
-        logger.info('_get_chats - arg_name: %s', arg_name)  # todo logs mix due to async :(
+        case _:
+            user_lookups = [_search_users_by_username(search.text)]
+            chat_lookups = [_search_chats(name=search.text, join_string=search.text)]
 
-        try:
-            response = await func(**{arg_name: query})  # todo make truly async
-        except Exception as exc:
-            logger.info('_get_chats - response exc: %s', exc)
+    users, chats = await asyncio.gather(_merge_lookups(user_lookups, 'user_id'), _merge_lookups(chat_lookups, 'id'))
+    return UsersAndChats(users=users, chats=chats)
+
+
+async def _merge_lookups(lookups: list[tp.Awaitable[list[tp.Any]]], key: str) -> list[tp.Any]:
+    """Runs lookups concurrently and merges their results, deduplicated by `key`."""
+    merged: dict[tp.Any, tp.Any] = {}
+
+    for result in await asyncio.gather(*lookups, return_exceptions=True):
+        if isinstance(result, Exception):
+            logger.error('search lookup failed: %s', format_exception(result))
             continue
 
-        if not isinstance(response, list):
-            response = [response]
-        logger.info('_get_chats - response: %s', response)
+        for row in result:
+            merged.setdefault(getattr(row, key), row)
 
-        chats += response
+    return list(merged.values())
 
-    logger.info('_get_chats - chats: %s', chats)
 
-    return chats
+async def _search_users_by_ids(user_ids: list[int]) -> list[UserInfo]:
+    return _users_to_users_info(await _get_users_by_user_ids(user_ids, raise_not_found=False))
+
+
+async def _search_users_by_username(username: str, limit: int = 10) -> list[UserInfo]:
+    username_query = """--sql
+        SELECT *
+        FROM users
+        WHERE username ILIKE %(username)s
+        LIMIT %(limit)s
+    """
+    username_rows = await db_fetchall(
+        User, username_query, dict(username=username + '%', limit=limit), raise_not_found=False
+    )
+    if not username_rows:
+        return []
 
+    return await _search_users_by_ids(rows_to_unique_column(username_rows, 'user_id'))
 
-async def _get_users(query: str) -> list[UserInfo]:
-    getters = ((get_users, 'username'), (get_user, 'user_id'), (get_user_by_msg_url, 'msg_url'))
-    users: list[UserInfo] = []
 
-    for func, arg_name in getters:
-        logger.info('_get_users - arg_name: %s', arg_name)  # todo logs mix due to async :(
+async def _search_user_by_msg_url(msg_url: str) -> list[UserInfo]:
+    try:
+        return [await get_user_by_msg_url(msg_url)]
+    except (BadRequestError, NotFoundError):
+        return []
 
-        try:
-            response = await func(**{arg_name: query})  # todo make truly async
-        except Exception as exc:
-            logger.info('_get_users - response exc: %s', exc)
-            continue
 
-        if not isinstance(response, list):
-            response = [response]
-        logger.info('_get_users - response: %s', response)
+async def _search_chats_by_id(chat_id: int) -> list[Chat]:
+    query = """--sql
+        SELECT *
+        FROM chats
+        WHERE id = %(chat_id)s
+    """
 
-        users += response
+    return await db_fetchall(Chat, query, dict(chat_id=chat_id), raise_not_found=False)
 
-    logger.info('_get_users - users: %s', users)
 
-    return users
+async def _search_chats(name: tp.Optional[str] = None, join_string: tp.Optional[str] = None) -> list[Chat]:
+    query = """--sql
+        SELECT *
+        FROM chats
+        WHERE name ILIKE %(name)s OR join_string ILIKE %(join_string)s 
+    """
+    name = name and name + '%'
+    join_string = join_string and join_string + '%'
+
+    return await db_fetchall(Chat, query, dict(name=name, join_string=join_string), raise_not_found=False)
 
 
 @controller.get('/healthcheck')
@@ -116,10 +194,20 @@ async def healthcheck() -> str:
     return 'OK'
 
 
+@controller.get('/shard_clients_stats')
+async def get_shard_clients_stats() -> list[ShardClientStats]:
+    return shard_clients.stats()
+
+
+@controller.get('/cache_stats')
+async def get_cache_stats() -> list[CacheStats]:
+    return [cache.stats for cache in caches.values()]
+
+
 @controller.get('/user')
 async def get_user(user_id: int) -> UserInfo:
     """Web UI (consumer)"""
-    return _users_to_user_info(await _get_users_by_user_ids(user_ids=[user_id]))
+    return _users_to_user_info(await _get_users_by_user_ids(user_ids=[user_id], cache=user_cache))
 
 
 @controller.get('/user_by_msg_url')
@@ -148,8 +236,7 @@ async def get_user_by_msg_url(msg_url: str) -> UserInfo:
     else:  # public chat
         bot_index = shard = 0
 
-    async with ShardClient(shard) as shard_client:
-        user = await shard_client.get_user_by_msg(parsed_url.chat_id, parsed_url.message_id, bot_index)
+    user = await shard_clients[shard].get_user_by_msg(parsed_url.chat_id, parsed_url.message_id, bot_index)
 
     if isinstance(user, EmptyResponse):
         raise NotFoundError('user')
@@ -163,26 +250,15 @@ async def get_user_by_msg_url(msg_url: str) -> UserInfo:
 @controller.get('/users')
 async def get_users(username: str, limit: int = 10) -> list[UserInfo]:
     """Web UI (consumer)"""
-    username_query = """--sql
-        SELECT *
-        FROM users
-        WHERE username ILIKE %(username)s
-        LIMIT %(limit)s
-    """
-    username_rows = await db_fetchall(
-        User, username_query, dict(username=username + '%', limit=limit), name=f'Users w/ {username=}'
-    )
+    if not (users := await _search_users_by_username(username, limit)):
+        raise NotFoundError(f'Users w/ {username=}')
 
-    username_to_user_ids: dict[str, list[int]] = {}
-    for username, rows_by_username in groupby(username_rows, attrgetter('username')):
-        username_to_user_ids[username] = rows_to_unique_column(rows_by_username, 'user_id')
-
-    all_user_ids = chain.from_iterable(username_to_user_ids.values())
-
-    return _users_to_users_info(await _get_users_by_user_ids(all_user_ids))
+    return users
 
 
-async def _get_users_by_user_ids(user_ids: tp.Iterable[int]):
+async def _get_users_by_user_ids(
+    user_ids: tp.Iterable[int], *, raise_not_found: bool = True, cache: QueryCache | None = None
+):
     user_ids = list(user_ids)
 
     query = f"""--sql
@@ -190,7 +266,14 @@ async def _get_users_by_user_ids(user_ids: tp.Iterable[int]):
         FROM users
         WHERE user_id in %(user_ids)s
     """
-    return await db_fetchall(User, query, dict(user_ids=user_ids), name=f'Users w/ id in {user_ids}')
+    return await db_fetchall(
+        User,
+        query,
+        dict(user_ids=user_ids),
+        name='users',
+        raise_not_found=raise_not_found,
+        cache=cache,
+    )
 
 
 def _users_to_user_info(user_rows: list[User]) -> UserInfo:
@@ -211,23 +294,83 @@ def _users_to_users_info(users_rows: list[User]) -> list[UserInfo]:
 
 @controller.get('/messages_by_user_id')
 async def get_messages_by_user_id(user_id: int, limit: int = 10) -> list[Message]:
-    return await get_messages(await get_comments(user_id, limit))
+    return await get_messages(await _get_first_comments(user_id, limit))
 
 
 @controller.get('/comments')
 async def get_comments(user_id: int, offset: int = 0, fetch: int = 10) -> list[Comment]:
-    """Web UI (consumer). Use with get_messages."""
+    """Web UI (consumer). Use with get_messages. Deep pages are slow, prefer /comments_page."""
+    if offset == 0:
+        return await _get_first_comments(user_id, fetch, raise_not_found=True)
+
     query = """--sql
         SELECT *
         FROM comments
         WHERE user_id = %(user_id)s
-        ORDER BY date OFFSET %(offset)s ROW
+        ORDER BY date, chat_id, message_id OFFSET %(offset)s ROW
         FETCH FIRST %(fetch)s ROWS ONLY;
     """
 
     return await db_fetchall(Comment, query, dict(user_id=user_id, offset=offset * fetch, fetch=fetch), name='comments')
 
 
+@controller.get('/comments_page')
+async def get_comments_page(user_id: int, cursor: str | None = None, fetch: int = 10) -> CommentsPage:
+    """Web UI (consumer). Keyset pagination over (date, chat_id, message_id), pass `next_cursor` back as `cursor`."""
+    after = ''
+    query_args: dict[str, tp.Any] = dict(user_id=user_id, fetch=fetch + 1)
+
+    if cursor:
+        try:
+            query_args['date'], query_args['chat_id'], query_args['message_id'] = decode_comments_cursor(cursor)
+        except ValueError as exc:
+            raise BadRequestError(str(exc)) from exc
+
+        after = 'AND (date, chat_id, message_id) > (toDateTime(%(date)s), %(chat_id)s, %(message_id)s)'
+
+    query = f"""--sql
+        SELECT *
+        FROM comments
+        WHERE user_id = %(user_id)s {after}
+        ORDER BY date, chat_id, message_id
+        LIMIT %(fetch)s
+    """
+
+    comments: list[Comment] = await db_fetchall(Comment, query, query_args, raise_not_found=False)
+    if len(comments) <= fetch:
+        return CommentsPage(comments=comments, next_cursor=None)
+
+    comments = comments[:fetch]
+    return CommentsPage(comments=comments, next_cursor=encode_comments_cursor(comments[-1]))
+
+
+async def _get_first_comments(user_id: int, limit: int, *, raise_not_found: bool = False) -> list[Comment]:
+    query = """--sql
+        SELECT *
+        FROM comments
+        WHERE user_id = %(user_id)s
+        ORDER BY date, chat_id, message_id
+        LIMIT %(limit)s
+    """
+
+    return await db_fetchall(
+        Comment, query, dict(user_id=user_id, limit=limit), name='comments', raise_not_found=raise_not_found
+    )
+
+
+async def _get_last_comments(user_id: int, limit: int) -> list[Comment]:
+    """Newest first."""
+    query = """--sql
+        SELECT *
+        FROM comments
+        WHERE user_id = %(user_id)s
+        ORDER BY date DESC, chat_id DESC, message_id DESC
+        LIMIT %(limit)s
+    """
+
+    return await db_fetchall(Comment, query, dict(user_id=user_id, limit=limit), raise_not_found=False)
+
+
 @controller.post('/messages')
 async def get_messages(comments: list[Comment]) -> list[Message]:
     """Web UI (consumer)"""
@@ -240,22 +383,107 @@ async def get_messages(comments: list[Comment]) -> list[Message]:
 
 
 async def _get_messages(comments: list[Comment]) -> list[Message]:
-    sorted_comments = sorted(comments)
-    messages: list[Message] = []
+    """Sorted by date, comments of the same date keep their input order."""
+    known = await message_texts.get_many((c.chat_id, c.message_id) for c in comments)
+
+    sorted_comments = sorted(c for c in comments if (c.chat_id, c.message_id) not in known)
     tasks: list[tp.Awaitable] = []
 
     async def _do_request(_shard: int, _comments_by_shard: list[Comment]):
-        async with ShardClient(_shard) as shard_client:
-            messages.extend(await shard_client.get_messages(_comments_by_shard))
+        shard_messages = await shard_clients[_shard].get_messages(_comments_by_shard)
+        texts = [
+            MessageText(chat_id=m.comment.chat_id, message_id=m.comment.message_id, text=m.text, chat=m.chat)
+            for m in shard_messages
+        ]
+        message_texts.remember(texts)
+        known.update(((t.chat_id, t.message_id), t) for t in texts)
 
     for shard, comments_by_shard in groupby(sorted_comments, attrgetter('shard')):
         tasks.append(_do_request(shard, list(comments_by_shard)))
     await asyncio.gather(*tasks)
 
+    messages = [
+        Message(text=text.text, chat=text.chat, comment=c)
+        for c in comments
+        if (text := known.get((c.chat_id, c.message_id))) is not None
+    ]
     messages.sort(key=lambda m: m.comment.date)
     return messages
 
 
+@controller.get('/export/comments')
+async def export_comments(
+    user_id: int | None = None, chat_id: int | None = None, with_text: bool = False, gzip: bool = False
+) -> StreamingResponse:
+    """
+    Full comment history of a user or a chat as NDJSON, oldest first, followed by an `ExportEnd` line.
+    Rows are streamed from ClickHouse block by block, `with_text` resolves message texts batch by batch,
+    comments whose text can't be resolved have a null text.
+    """
+    if (user_id is None) == (chat_id is None):
+        raise BadRequestError('Exactly one of user_id or chat_id must be provided')
+
+    column, value = ('user_id', user_id) if user_id is not None else ('chat_id', chat_id)
+    query = f"""--sql
+        SELECT *
+        FROM comments
+        WHERE {column} = %(value)s
+        ORDER BY date, chat_id, message_id
+    """
+
+    async def _lines() -> tp.AsyncIterator[bytes]:
+        end = ExportEnd(rows=0)
+        try:
+            async with contextlib.aclosing(
+                db_iterate(Comment, query, dict(value=value), batch_size=EXPORT_BATCH_SIZE)
+            ) as batches:
+                async for comments in batches:
+                    rows: tp.Iterable[Comment | Message] = comments
+                    if with_text:
+                        rows = await _get_export_messages(comments)
+
+                    yield b''.join(row.model_dump_json().encode() + b'\n' for row in rows)
+                    end.rows += len(comments)
+        except Exception as e:
+            # headers are sent already, the status can't tell the client anymore
+            logger.error('export of %s %s failed: %s', column, value, format_exception(e, with_traceback=True))
+            end.error = format_exception(e)
+
+        yield end.model_dump_json().encode() + b'\n'
+
+    async def _gzip(lines: tp.AsyncIterator[bytes]) -> tp.AsyncIterator[bytes]:
+        compressor = zlib.compressobj(wbits=31)
+        async for chunk in lines:
+            if compressed := compressor.compress(chunk):
+                yield compressed
+        yield compressor.flush()
+
+    if gzip:
+        return StreamingResponse(
+            _gzip(_lines()), media_type='application/x-ndjson', headers={'Content-Encoding': 'gzip'}
+        )
+
+    return StreamingResponse(_lines(), media_type='application/x-ndjson')
+
+
+async def _get_export_messages(comments: list[Comment]) -> list[Message]:
+    semaphore = asyncio.Semaphore(EXPORT_TEXT_CONCURRENCY)
+
+    async def _get_batch(batch: list[Comment]) -> list[Message]:
+        async with semaphore:
+            return await _get_messages(batch)
+
+    batches = [comments[i : i + EXPORT_TEXT_BATCH_SIZE] for i in range(0, len(comments), EXPORT_TEXT_BATCH_SIZE)]
+    resolved = {
+        (m.comment.chat_id, m.comment.message_id): m
+        for messages in await asyncio.gather(*map(_get_batch, batches))
+        for m in messages
+    }
+
+    # an export is the full history, comments without a known text are kept
+    return [resolved.get((c.chat_id, c.message_id)) or Message(text=None, comment=c) for c in comments]
+
+
 @controller.post('/discover')
 async def discover(join_string: str, ignore_protection: bool = False) -> None:
     """Web UI (consumer)"""
@@ -263,8 +491,7 @@ async def discover(join_string: str, ignore_protection: bool = False) -> None:
     tasks: list[tp.Awaitable] = []
 
     async def _do_request(_shard: int):
-        async with ShardClient(_shard) as _shard_client:
-            shards_chats_count.append(await _shard_client.get_known_chats_count())
+        shards_chats_count.append(await shard_clients[_shard].get_known_chats_count())
 
     for shard in range(len(config.SHARD_ENDPOINTS)):
         tasks.append(_do_request(shard))
@@ -272,8 +499,7 @@ async def discover(join_string: str, ignore_protection: bool = False) -> None:
     await asyncio.gather(*tasks)
     lazy_shard = shards_chats_count.index(min(shards_chats_count))
 
-    async with ShardClient(lazy_shard) as shard_client:
-        await shard_client.discover(join_string, ignore_protection)
+    await shard_clients[lazy_shard].discover(join_string, ignore_protection)
 
 
 @controller.post('/add_bot')
@@ -302,44 +528,170 @@ async def get_chat(chat_id: int) -> Chat:
         WHERE id = %(chat_id)s
     """
 
-    return await db_fetchone(Chat, query, dict(chat_id=chat_id))
+    return await db_fetchone(Chat, query, dict(chat_id=chat_id), cache=chat_cache)
 
 
 @controller.get('/reactions_by_url')
-async def get_reactions_by_url(post_url: str) -> list[Post]:
-    """Web UI"""
+async def get_reactions_by_url(
+    post_url: str,
+    resolution: int | None = None,
+    points: int | None = None,
+    from_: datetime.datetime | None = Query(None, alias='from'),
+    to: datetime.datetime | None = None,
+    keys: list[str] | None = Query(None),
+    deltas: bool = False,
+) -> list[Post]:
+    """Web UI. See /reactions for the series parameters."""
     try:
         parsed_url: ParsedPostURL = parse_post_url(post_url)
     except ValueError as exc:
         raise BadRequestError(str(exc)) from exc
 
-    query = """--sql
-        SELECT *, data.key AS keys, data.value AS values
-        FROM posts
-        WHERE id = %(post_id)s
-            AND channel_id = (
-                SELECT id
-                FROM chats
-                WHERE join_string = %(channel_nick)s
-            )
-        ORDER BY point_date ASC
+    post_filter = """
+        id = %(post_id)s
+        AND channel_id = (
+            SELECT id
+            FROM chats
+            WHERE join_string = %(channel_nick)s
+        )
     """
+    query, query_args = _reactions_query(post_filter, resolution, points, from_, to, keys, deltas)
+    query_args.update(post_id=parsed_url.post_id, channel_nick=parsed_url.channel_nick)
 
-    return await db_fetchall(
-        Post, query, dict(post_id=parsed_url.post_id, channel_nick=parsed_url.channel_nick), 'Reactions'
-    )
+    return await db_fetchall(Post, query, query_args, 'Reactions')
 
 
 @controller.get('/reactions')
-async def get_reactions(channel_id: int, post_id: int) -> list[Post]:
-    query = """--sql
-        SELECT *, data.key AS keys, data.value AS values
-        FROM posts
-        WHERE id = %(id)s AND channel_id = %(channel_id)s
+async def get_reactions(
+    channel_id: int,
+    post_id: int,
+    resolution: int | None = None,
+    points: int | None = None,
+    from_: datetime.datetime | None = Query(None, alias='from'),
+    to: datetime.datetime | None = None,
+    keys: list[str] | None = Query(None),
+    deltas: bool = False,
+) -> list[Post]:
+    """
+    Snapshots of a post ordered by `point_date`. Without parameters every stored snapshot is returned.
+    `resolution` (seconds) or `points` (bucket count over the selected window) keep the last snapshot per bucket,
+    `from`/`to` limit the window, `keys` the reactions and `deltas` replaces values with changes since the previous row
+    (the first row of the window is then dropped, it has no previous one).
+    """
+    post_filter = 'id = %(id)s AND channel_id = %(channel_id)s'
+    query, query_args = _reactions_query(post_filter, resolution, points, from_, to, keys, deltas)
+    query_args.update(id=post_id, channel_id=channel_id)
+
+    return await db_fetchall(Post, query, query_args, 'Reactions', cache=reactions_cache)
+
+
+def _reactions_query(
+    post_filter: str,
+    resolution: int | None,
+    points: int | None,
+    from_: datetime.datetime | None,
+    to: datetime.datetime | None,
+    keys: list[str] | None,
+    deltas: bool,
+) -> tuple[str, dict[str, tp.Any]]:
+    """Bucketing, filtering and deltas are all done by ClickHouse, only the resulting rows are sent."""
+    if resolution is None and points is None and from_ is None and to is None and keys is None and not deltas:
+        query = f"""--sql
+            SELECT *, data.key AS keys, data.value AS values
+            FROM posts
+            WHERE {post_filter}
+            ORDER BY point_date ASC
+        """
+        return query, {}
+
+    if resolution is not None and resolution <= 0 or points is not None and points <= 0:
+        raise BadRequestError('resolution and points must be positive')
+
+    query_args: dict[str, tp.Any] = {}
+
+    if from_ is not None:
+        post_filter += ' AND point_date >= toDateTime(%(from)s)'
+        query_args['from'] = int(_as_utc(from_).timestamp())
+
+    if to is not None:
+        post_filter += ' AND point_date < toDateTime(%(to)s)'
+        query_args['to'] = int(_as_utc(to).timestamp())
+
+    if resolution is not None:
+        span = '(0, %(resolution)s)'
+        query_args['resolution'] = resolution
+    elif points is not None:
+        span = f"""(
+            SELECT (
+                toUnixTimestamp(min(point_date)),
+                intDiv(toUnixTimestamp(max(point_date)) - toUnixTimestamp(min(point_date)), %(points)s) + 1
+            )
+            FROM posts
+            WHERE {post_filter}
+        )"""
+        query_args['points'] = points
+    else:
+        span = '(0, 1)'
+
+    snapshot = 'mapFromArrays(argMax(data.key, point_date), argMax(data.value, point_date))'
+    if keys is not None:
+        snapshot = f'mapFilter((k, v) -> has(%(keys)s, k), {snapshot})'
+        query_args['keys'] = keys
+
+    if deltas:
+        window = 'PARTITION BY id, channel_id ORDER BY last_point'
+        previous = f'lagInFrame(snapshot) OVER ({window} ROWS BETWEEN 1 PRECEDING AND CURRENT ROW)'
+        values_map = f'mapSubtract(snapshot, {previous})'
+        bucket_number = f'row_number() OVER ({window})'
+        # the first bucket has nothing to subtract, it is only the baseline and isn't returned
+        buckets_filter = 'WHERE bucket_number > 1'
+    else:
+        values_map, bucket_number, buckets_filter = 'snapshot', '1', ''
+
+    query = f"""--sql
+        WITH {span} AS span
+        SELECT
+            id,
+            channel_id,
+            post_date,
+            last_point AS point_date,
+            mapKeys(values_map) AS keys,
+            mapValues(values_map) AS values,
+            bot_index,
+            shard
+        FROM (
+            SELECT
+                id,
+                channel_id,
+                post_date,
+                last_point,
+                {values_map} AS values_map,
+                {bucket_number} AS bucket_number,
+                bot_index,
+                shard
+            FROM (
+                SELECT
+                    id,
+                    channel_id,
+                    any(post_date) AS post_date,
+                    max(point_date) AS last_point,
+                    {snapshot} AS snapshot,
+                    argMax(bot_index, point_date) AS bot_index,
+                    argMax(shard, point_date) AS shard
+                FROM posts
+                WHERE {post_filter}
+                GROUP BY id, channel_id, intDiv(toUnixTimestamp(point_date) - span.1, span.2)
+            )
+        )
+        {buckets_filter}
         ORDER BY point_date ASC
     """
 
-    return await db_fetchall(Post, query, dict(id=post_id, channel_id=channel_id), 'Reactions')
+    return query, query_args
+
+
+def _as_utc(value: datetime.datetime) -> datetime.datetime:
+    return value.replace(tzinfo=datetime.timezone.utc) if value.tzinfo is None else value
 
 
 @controller.get('/chats')
@@ -348,15 +700,10 @@ async def get_chats(name: tp.Optional[str] = None, join_string: tp.Optional[str]
     if not name and not join_string:
         raise BadRequestError('Either name or join_string must be provided')
 
-    query = """--sql
-        SELECT *
-        FROM chats
-        WHERE name ILIKE %(name)s OR join_string ILIKE %(join_string)s 
-    """
-    name = name and name + '%'
-    join_string = join_string and join_string + '%'
+    if not (chats := await _search_chats(name=name, join_string=join_string)):
+        raise NotFoundError('Chats')
 
-    return await db_fetchall(Chat, query, dict(name=name, join_string=join_string), 'Chats')
+    return chats
 
 
 @controller.get('/post')
@@ -371,8 +718,7 @@ async def get_post(channel_id: int, post_id: int) -> PostText | EmptyResponse:
 
     post: Post = await db_fetchone(Post, query, dict(id=post_id, channel_id=channel_id), 'Post')
 
-    async with ShardClient(post.shard) as shard_client:
-        return await shard_client.get_post(post.channel_id, post.id, post.bot_index)
+    return await shard_clients[post.shard].get_post(post.channel_id, post.id, post.bot_index)
 
 
 @controller.get('/random_users')
@@ -411,34 +757,27 @@ async def get_sample(user_id: int) -> Sample:
         raise_not_found=False,
     )
 
-    comments = await get_comments(user_id, fetch=1000)
-    comments.reverse()
+    recent_comments, old_comments = await asyncio.gather(
+        _get_last_comments(user_id, 10), _get_first_comments(user_id, 5)
+    )
+    recent_keys = {(c.chat_id, c.message_id) for c in recent_comments}
+    old_comments = [c for c in old_comments if (c.chat_id, c.message_id) not in recent_keys]
+
+    recent_messages: list[Sample.Comment] = []
+    old_messages: list[Sample.Comment] = []
 
-    recent_comments = comments[:10]
-    recent_messages = [
-        Sample.Comment(
+    for m in await _get_messages(recent_comments + old_comments):
+        sample_comment = Sample.Comment(
             chat_name=m.chat,
             date=m.comment.date,
             text=m.text or '<no text>',
             post_id=m.comment.post_id,
         )
-        for m in await get_messages(recent_comments)
-    ]
 
-    old_comments_count = max(min(len(comments) - 5, 5), 0)
-    if old_comments_count > 0:
-        old_comments = comments[-old_comments_count:]
-        old_messages = [
-            Sample.Comment(
-                chat_name=m.chat,
-                date=m.comment.date,
-                text=m.text or '<no text>',
-                post_id=m.comment.post_id,
-            )
-            for m in await get_messages(old_comments)
-        ]
-    else:
-        old_messages = []
+        if (m.comment.chat_id, m.comment.message_id) in recent_keys:
+            recent_messages.append(sample_comment)
+        else:
+            old_messages.append(sample_comment)
 
     return Sample(user=user, most_recent_comments=recent_messages, most_old_comments=old_messages, channels=channels)
 
@@ -479,7 +818,7 @@ async def get_comment_count(user_id: int) -> CommentCount:
         FROM comments
         WHERE user_id = %(user_id)s
     """
-    return await db_fetchone(CommentCount, query, dict(user_id=user_id), 'Comments')
+    return await db_fetchone(CommentCount, query, dict(user_id=user_id), 'Comments', cache=comment_count_cache)
 
 
 def main():
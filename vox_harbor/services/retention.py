@@ -0,0 +1,121 @@
+import asyncio
+import datetime
+import enum
+import logging
+import time
+
+from vox_harbor.common.config import config
+from vox_harbor.common.db_utils import session_scope
+from vox_harbor.common.exceptions import format_exception
+
+
+class PostRollup:
+    """
+    Rolls old post snapshots into coarser tiers: RAW -> HOURLY after POSTS_HOURLY_AFTER_DAYS,
+    -> DAILY after POSTS_DAILY_AFTER_DAYS. A rolled up point is the last snapshot of its bucket,
+    the same thing /reactions returns for bucketed series, so readers don't need to know about tiers.
+
+    Work is done a day window at a time and is idempotent: aggregates are rebuilt from every row of the window
+    up to the target tier and tagged with the run's `rollup_version`, then all other rows of the window are deleted,
+    except aggregates of the same or a newer run. A run interrupted in between is fixed up by the next one,
+    overlapping runs (e.g. two controllers) leave the newest aggregates.
+    """
+
+    logger = logging.getLogger('vox_harbor.services.retention')
+
+    INTERVAL = 60 * 60
+
+    class Tier(enum.IntEnum):
+        RAW = 0
+        HOURLY = 1
+        DAILY = 2
+
+    BUCKETS = {Tier.HOURLY: 'toStartOfHour', Tier.DAILY: 'toStartOfDay'}
+
+    _last_version = 0
+
+    @classmethod
+    def _next_version(cls) -> int:
+        """Unique per run: nanoseconds, kept increasing for runs that start within the same clock tick."""
+        cls._last_version = max(time.time_ns(), cls._last_version + 1)
+        return cls._last_version
+
+    async def run_once(self):
+        now = datetime.datetime.now(datetime.timezone.utc)
+
+        for target, after_days in (
+            (self.Tier.HOURLY, config.POSTS_HOURLY_AFTER_DAYS),
+            (self.Tier.DAILY, config.POSTS_DAILY_AFTER_DAYS),
+        ):
+            cutoff = int((now - datetime.timedelta(days=after_days)).timestamp())
+            for window_start in await self._pending_windows(target, cutoff):
+                await self.roll_up(target, window_start, window_start + 24 * 60 * 60)
+
+    async def _pending_windows(self, target: Tier, cutoff: int) -> list[int]:
+        """Whole days before `cutoff` that still have rows below `target`."""
+        async with session_scope() as session:
+            await session.execute(
+                'SELECT DISTINCT toUnixTimestamp(toStartOfDay(point_date)) AS window_start\n'
+                'FROM posts\n'
+                'WHERE tier < %(target)s AND point_date < toStartOfDay(toDateTime(%(cutoff)s))\n'
+                'ORDER BY window_start',
+                dict(target=int(target), cutoff=cutoff),
+            )
+            try:
+                return [row['window_start'] for row in await session.fetchall()]
+            except AttributeError:  # no rows
+                return []
+
+    async def roll_up(self, target: Tier, window_start: int, window_end: int):
+        window = dict(target=int(target), start=window_start, end=window_end, version=self._next_version())
+        in_window = 'point_date >= toDateTime(%(start)s) AND point_date < toDateTime(%(end)s)'
+
+        async with session_scope() as session:
+            await session.execute(
+                'INSERT INTO posts\n'
+                '(id, channel_id, post_date, point_date, `data.key`, `data.value`, bot_index, shard, tier, rollup_version)\n'
+                'SELECT\n'
+                '    id,\n'
+                '    channel_id,\n'
+                '    any(post_date),\n'
+                '    max(point_date),\n'
+                '    argMax(data.key, point_date),\n'
+                '    argMax(data.value, point_date),\n'
+                '    argMax(bot_index, point_date),\n'
+                '    argMax(shard, point_date),\n'
+                '    %(target)s,\n'
+                '    %(version)s\n'
+                'FROM posts\n'
+                f'WHERE tier <= %(target)s AND {in_window}\n'
+                f'GROUP BY channel_id, id, {self.BUCKETS[target]}(point_date)',
+                window,
+            )
+
+            await session.execute(
+                'DELETE FROM posts\n'
+                f'WHERE tier <= %(target)s AND {in_window}\n'
+                'AND NOT (tier = %(target)s AND rollup_version >= %(version)s)',
+                window,
+            )
+
+        self.logger.info(
+            'rolled up posts of %s into %s',
+            datetime.datetime.fromtimestamp(window_start, datetime.timezone.utc).date(),
+            target.name,
+        )
+
+    async def loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                self.logger.error('failed to roll up posts: %s', format_exception(e, with_traceback=True))
+
+            await asyncio.sleep(self.INTERVAL)
+
+    def start(self):
+        if config.READ_ONLY:
+            self.logger.warning('read only session, posts rollup is disabled')
+            return
+
+        asyncio.create_task(self.loop())
@@ -9,22 +9,52 @@ from pyrogram import types
 from pyrogram.types.messages_and_media.message import Message as PyrogramMessage
 
 from vox_harbor.big_bot.bots import Bot, BotManager
+from vox_harbor.big_bot.handlers import inserter
+from vox_harbor.big_bot.posts import PostManager
+from vox_harbor.big_bot.tasks import TaskManager
 from vox_harbor.big_bot.structures import (
     Comment,
     EmptyResponse,
     Message,
+    MessageText,
     Post,
+    PostPollingStats,
     PostText,
+    TaskGroupStats,
     User,
 )
 from vox_harbor.common.config import config
+from vox_harbor.common.message_texts import MessageTextStore
+from vox_harbor.common.metrics import instrument
 
 shard = FastAPI()
+instrument(shard)
 logger = logging.getLogger(f'vox_harbor.services.shard.{config.SHARD_NUM}')
 
+message_texts = MessageTextStore()
+
 
 @shard.post('/messages')
 async def get_messages(sorted_comments: list[Comment]) -> list[Message]:
+    known = await message_texts.get_many((c.chat_id, c.message_id) for c in sorted_comments)
+    missing = [c for c in sorted_comments if (c.chat_id, c.message_id) not in known]
+    logger.debug('get_messages: %s known texts, %s to fetch', len(known), len(missing))
+
+    if missing:
+        fetched = await _fetch_message_texts(missing)
+        message_texts.remember(fetched)
+        await inserter.insert_message_texts(fetched)
+
+        known.update(((t.chat_id, t.message_id), t) for t in fetched)
+
+    return [
+        Message(text=text.text, chat=text.chat, comment=cmt)
+        for cmt in sorted_comments
+        if (text := known.get((cmt.chat_id, cmt.message_id))) is not None
+    ]
+
+
+async def _fetch_message_texts(sorted_comments: list[Comment]) -> list[MessageText]:
     bot_manager = await BotManager.get_instance(config.SHARD_NUM)
     tasks = []
 
@@ -43,7 +73,12 @@ async def get_messages(sorted_comments: list[Comment]) -> list[Message]:
 
     msg: types.Message
     return [
-        Message(text=msg.text, chat=msg.chat.title or ' '.join((msg.chat.first_name, msg.chat.last_name)), comment=cmt)
+        MessageText(
+            chat_id=cmt.chat_id,
+            message_id=cmt.message_id,
+            text=msg.text or msg.caption,
+            chat=msg.chat.title or ' '.join(filter(None, (msg.chat.first_name, msg.chat.last_name))),
+        )
         for msg, cmt in messages_zipped
         if msg is not None and msg.chat is not None
     ]
@@ -60,6 +95,20 @@ async def get_known_chats_count() -> int:
     return chats_count
 
 
+@shard.get('/tasks_stats')
+async def get_tasks_stats() -> list[TaskGroupStats]:
+    """History steps per bot."""
+    tasks = await TaskManager.get_instance()
+    return tasks.stats()
+
+
+@shard.get('/posts_stats')
+async def get_posts_stats() -> PostPollingStats:
+    """Reaction snapshots, `posts_per_call` shows how well get_messages calls are batched."""
+    posts = await PostManager.get_instance(await BotManager.get_instance(config.SHARD_NUM))
+    return posts.stats()
+
+
 @shard.post('/discover')
 async def discover(join_string: str, ignore_protection: bool = False) -> None:
     bot_manager = await BotManager.get_instance(config.SHARD_NUM)
@@ -72,13 +121,13 @@ async def get_user_by_msg(chat_id: int | str, message_id: int, bot_index: int) -
     bot_manager = await BotManager.get_instance(config.SHARD_NUM)
     messages: list[PyrogramMessage] = await bot_manager.get_messages(bot_index, chat_id, [message_id])
 
-    logger.info('user_by_msg - messages: %s', messages)
+    logger.debug('user_by_msg - messages: %s', messages)
 
     if not messages or messages[0].empty:
         return EmptyResponse()
     message = messages[0]
 
-    logger.info('user_by_msg - message: %s', message)
+    logger.debug('user_by_msg - message: %s', message)
 
     return User(
         user_id=message.from_user.id,
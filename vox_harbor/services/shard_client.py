@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from typing import Any, Iterable
 
@@ -8,6 +9,7 @@ from vox_harbor.big_bot.structures import (
     EmptyResponse,
     Message,
     PostText,
+    ShardClientStats,
     User,
 )
 from vox_harbor.common.config import config
@@ -18,9 +20,39 @@ logger = logging.getLogger(f'vox_harbor.services.shard_client')
 class ShardClient(httpx.AsyncClient):
     def __init__(self, shard: int, **kwargs: Any) -> None:
         kwargs['base_url'] = config.shard_url(shard)
-        kwargs['timeout'] = 120
+        kwargs.setdefault('timeout', config.shard_timeout(shard))
+        kwargs.setdefault(
+            'limits',
+            httpx.Limits(
+                max_connections=config.SHARD_MAX_CONNECTIONS,
+                max_keepalive_connections=config.SHARD_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=config.SHARD_KEEPALIVE_EXPIRY,
+            ),
+        )
+        kwargs.setdefault('event_hooks', {'request': [self._on_request]})
         super().__init__(**kwargs)
 
+        self.shard = shard
+        self.requests_count = 0
+        self.connections_count = 0
+
+    async def _on_request(self, request: httpx.Request) -> None:
+        self.requests_count += 1
+        request.extensions['trace'] = self._trace
+
+    async def _trace(self, event_name: str, _: dict[str, Any]) -> None:
+        if event_name == 'connection.connect_tcp.complete':
+            self.connections_count += 1
+
+    @property
+    def stats(self) -> ShardClientStats:
+        return ShardClientStats(
+            shard=self.shard,
+            requests=self.requests_count,
+            connections=self.connections_count,
+            reused=max(self.requests_count - self.connections_count, 0),
+        )
+
     async def get_messages(self, sorted_comments: Iterable[Comment]) -> list[Message]:
         json: list[dict[str, Any]] = [c.model_dump(mode='json') for c in sorted_comments]
         messages = (await self.post('/messages', json=json)).json()
@@ -48,3 +80,33 @@ class ShardClient(httpx.AsyncClient):
         if not response.json():
             return EmptyResponse()
         return User.model_validate(response.json())
+
+
+class ShardClientPool:
+    """
+    Registry of long-lived keep-alive clients, one per shard.
+    Clients are created lazily and closed together on controller shutdown.
+    """
+
+    def __init__(self) -> None:
+        self._clients: dict[int, ShardClient] = {}
+
+    def __getitem__(self, shard: int) -> ShardClient:
+        client = self._clients.get(shard)
+        if client is None or client.is_closed:
+            client = self._clients[shard] = ShardClient(shard)
+
+        return client
+
+    def stats(self) -> list[ShardClientStats]:
+        return [client.stats for _, client in sorted(self._clients.items())]
+
+    async def aclose(self) -> None:
+        clients = list(self._clients.values())
+        self._clients.clear()
+
+        await asyncio.gather(*(client.aclose() for client in clients))
+        logger.info('closed %s shard clients', len(clients))
+
+
+shard_clients = ShardClientPool()
@@ -1,8 +1,12 @@
+import base64
+import calendar
+import json
+import re
 from pprint import pprint
 from typing import NoReturn
 from urllib.parse import ParseResult, parse_qs, urlparse
 
-from vox_harbor.big_bot.structures import ParsedMsgURL, ParsedPostURL
+from vox_harbor.big_bot.structures import Comment, ParsedMsgURL, ParsedPostURL, SearchQuery
 
 
 def parse_msg_url(url: str) -> ParsedMsgURL:
@@ -44,5 +48,41 @@ def parse_post_url(url: str) -> ParsedPostURL:
     return ParsedPostURL(channel_nick=channel_nick, post_id=int(post_id))
 
 
+def parse_search_query(query: str) -> SearchQuery:
+    """Classifies a free-form search query: numeric id, t.me message/chat URL or a name prefix."""
+    query = query.strip()
+
+    if re.fullmatch(r'-?\d+', query):
+        return SearchQuery(kind=SearchQuery.Kind.ID, text=query, id=int(query))
+
+    if query.startswith('t.me/'):
+        query = 'https://' + query
+
+    if urlparse(query).netloc == 't.me':
+        try:
+            parse_msg_url(query)
+            return SearchQuery(kind=SearchQuery.Kind.MSG_URL, text=query)
+        except ValueError:
+            if nick := urlparse(query).path.strip('/').split('/')[0]:
+                return SearchQuery(kind=SearchQuery.Kind.CHAT_URL, text=nick)
+
+    return SearchQuery(kind=SearchQuery.Kind.NAME, text=query.lstrip('@'))
+
+
+def encode_comments_cursor(comment: Comment) -> str:
+    """Opaque keyset cursor pointing right after `comment` in (date, chat_id, message_id) order."""
+    # naive dates from ClickHouse are UTC, not local time
+    key = [calendar.timegm(comment.date.utctimetuple()), comment.chat_id, comment.message_id]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+
+def decode_comments_cursor(cursor: str) -> tuple[int, int, int]:
+    try:
+        date, chat_id, message_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return int(date), int(chat_id), int(message_id)
+    except (ValueError, TypeError) as exc:
+        raise ValueError(f'Invalid {cursor = }') from exc
+
+
 if __name__ == '__main__':
     pprint(parse_post_url('https://t.me/RKadyrov_95/3932'))
@@ -0,0 +1,15 @@
+CREATE TABLE history_checkpoints
+(
+    task_id String,
+    chat_id Int64,
+    start_id Int64,
+    end_id Int64,
+    current_offset Int64,
+    priority UInt8,
+    finished Bool,
+    shard UInt8,
+    bot_index UInt8,
+    updated DateTime64(3) DEFAULT now64(3)
+)
+ENGINE = SharedReplacingMergeTree(updated)
+ORDER BY (shard, chat_id, task_id)
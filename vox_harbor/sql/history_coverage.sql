@@ -0,0 +1,10 @@
+CREATE TABLE history_coverage
+(
+    chat_id Int64,
+    lo Array(Int64),
+    hi Array(Int64),
+    shard UInt8,
+    updated DateTime64(3) DEFAULT now64(3)
+)
+ENGINE = SharedReplacingMergeTree(updated)
+ORDER BY (shard, chat_id)
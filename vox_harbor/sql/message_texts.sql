@@ -0,0 +1,10 @@
+CREATE TABLE message_texts
+(
+    chat_id Int64,
+    message_id Int64,
+    text Nullable(String) CODEC(ZSTD(3)),
+    chat Nullable(String),
+    added DateTime DEFAULT now()
+)
+ENGINE = SharedReplacingMergeTree()
+ORDER BY (chat_id, message_id)
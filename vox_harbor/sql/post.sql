@@ -10,7 +10,10 @@ CREATE TABLE posts
         value Int64
     ),
     bot_index UInt8,
-    shard UInt8
+    shard UInt8,
+
+    tier Enum('RAW' = 0, 'HOURLY' = 1, 'DAILY' = 2) DEFAULT 'RAW',
+    rollup_version UInt64 DEFAULT 0
 )
 ENGINE = SharedMergeTree()
 ORDER BY (channel_id, id, point_date)
@@ -0,0 +1,3 @@
+ALTER TABLE posts
+    ADD COLUMN IF NOT EXISTS tier Enum('RAW' = 0, 'HOURLY' = 1, 'DAILY' = 2) DEFAULT 'RAW',
+    ADD COLUMN IF NOT EXISTS rollup_version UInt64 DEFAULT 0